@@ -54,22 +54,32 @@ defs_stepcompress = """
     int stepcompress_extract_old(struct stepcompress *sc
         , struct pull_history_steps *p, int max
         , uint64_t start_clock, uint64_t end_clock);
+    uint64_t stepcompress_get_step_count(struct stepcompress *sc);
 
     struct steppersync *steppersync_alloc(struct serialqueue *sq
         , struct stepcompress **sc_list, int sc_num, int move_num);
     void steppersync_free(struct steppersync *ss);
     void steppersync_set_time(struct steppersync *ss
         , double time_offset, double mcu_freq);
+    int steppersync_get_pending(struct steppersync *ss, uint64_t clock);
     int steppersync_flush(struct steppersync *ss, uint64_t move_clock
         , uint64_t clear_history_clock);
 """
 
+# Only used by scripts/benchmark_stepcompress.py (not part of klippy)
+defs_stepcompress_bench = """
+    int stepcompress_append_clocks(struct stepcompress *sc, int sdir
+        , uint64_t *clocks, int count);
+"""
+
 defs_itersolve = """
     int32_t itersolve_generate_steps(struct stepper_kinematics *sk
         , double flush_time);
     double itersolve_check_active(struct stepper_kinematics *sk
         , double flush_time);
     int32_t itersolve_is_active_axis(struct stepper_kinematics *sk, char axis);
+    void itersolve_set_linear(struct stepper_kinematics *sk
+        , double x, double y, double z);
     void itersolve_set_trapq(struct stepper_kinematics *sk, struct trapq *tq);
     void itersolve_set_stepcompress(struct stepper_kinematics *sk
         , struct stepcompress *sc, double step_dist);
@@ -208,6 +218,14 @@ defs_trdispatch = """
         , uint64_t expire_ticks, uint64_t min_extend_ticks);
 """
 
+defs_msgblock = """
+    uint16_t msgblock_crc16_ccitt(uint8_t *buf, uint8_t len);
+    int msgblock_check(uint8_t *need_sync, uint8_t *buf, int buf_len);
+    int msgblock_decode_blocks(uint8_t *param_types, uint8_t *buf
+        , int buf_pos, int buf_len, uint32_t *data, int data_len
+        , int *data_count);
+"""
+
 defs_pyhelper = """
     void set_python_logging_callback(void (*func)(const char *));
     double get_monotonic(void);
@@ -218,11 +236,12 @@ defs_std = """
 """
 
 defs_all = [
-    defs_pyhelper, defs_serialqueue, defs_std, defs_stepcompress,
-    defs_itersolve, defs_trapq, defs_trdispatch,
+    defs_pyhelper, defs_serialqueue, defs_msgblock, defs_std,
+    defs_stepcompress, defs_itersolve, defs_trapq, defs_trdispatch,
     defs_kin_cartesian, defs_kin_corexy, defs_kin_corexz, defs_kin_delta,
     defs_kin_deltesian, defs_kin_polar, defs_kin_rotary_delta, defs_kin_winch,
     defs_kin_extruder, defs_kin_shaper, defs_kin_idex,
+    defs_stepcompress_bench,
 ]
 
 # Update filenames to an absolute path
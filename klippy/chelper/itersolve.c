@@ -4,7 +4,7 @@
 //
 // This file may be distributed under the terms of the GNU GPLv3 license.
 
-#include <math.h> // fabs
+#include <math.h> // fabs, sqrt
 #include <stddef.h> // offsetof
 #include <string.h> // memset
 #include "compiler.h" // __visible
@@ -14,6 +14,72 @@
 #include "trapq.h" // struct move
 
 
+/****************************************************************
+ * Closed form solver for linear kinematics
+ ****************************************************************/
+
+// Generate step times for a portion of a move on a stepper whose
+// position is a linear combination of the cartesian coordinates.
+// Moves on the trapq never reverse, so the stepper position is
+// monotonic within the move and each step time is a quadratic root.
+static int32_t
+itersolve_gen_steps_linear(struct stepper_kinematics *sk, struct move *m
+                           , double abs_start, double abs_end)
+{
+    double half_step = .5 * sk->step_dist;
+    double start = abs_start - m->print_time, end = abs_end - m->print_time;
+    if (start < 0.)
+        start = 0.;
+    if (end > m->move_t)
+        end = m->move_t;
+    double commanded_pos = sk->commanded_pos;
+    double axis_r = (sk->linear_x * m->axes_r.x + sk->linear_y * m->axes_r.y
+                     + sk->linear_z * m->axes_r.z);
+    if (axis_r) {
+        double start_pos = (sk->linear_x * m->start_pos.x
+                            + sk->linear_y * m->start_pos.y
+                            + sk->linear_z * m->start_pos.z);
+        double end_pos = start_pos + axis_r * move_get_distance(m, end);
+        int sdir = stepcompress_get_step_dir(sk->sc), mdir = axis_r > 0.;
+        for (;;) {
+            double target = commanded_pos + (mdir ? half_step : -half_step);
+            double rel_end = mdir ? end_pos - target : target - end_pos;
+            // Match the iterative solver's step and direction change limits
+            if (rel_end < (mdir == sdir ? -.000000001 : .000000010))
+                break;
+            // Solve start_v*t + half_accel*t^2 = dist
+            double dist = (target - start_pos) / axis_r;
+            double disc = m->start_v * m->start_v + 4. * m->half_accel * dist;
+            double step_time = end;
+            if (disc >= 0.) {
+                double div = m->start_v + sqrt(disc);
+                step_time = div > 0. ? 2. * dist / div : 0.;
+            }
+            if (step_time < start)
+                step_time = start;
+            else if (step_time > end)
+                step_time = end;
+            int ret = stepcompress_append(sk->sc, mdir, m->print_time
+                                          , step_time);
+            if (ret)
+                return ret;
+            sdir = mdir;
+            commanded_pos = target + (mdir ? half_step : -half_step);
+        }
+        if ((sdir ? end_pos - commanded_pos : commanded_pos - end_pos) >= 0.) {
+            // Avoid rollback if stepper fully reaches step position
+            int ret = stepcompress_commit(sk->sc);
+            if (ret)
+                return ret;
+        }
+    }
+    sk->commanded_pos = commanded_pos;
+    if (sk->post_cb)
+        sk->post_cb(sk);
+    return 0;
+}
+
+
 /****************************************************************
  * Main iterative solver
  ****************************************************************/
@@ -29,6 +95,8 @@ static int32_t
 itersolve_gen_steps_range(struct stepper_kinematics *sk, struct move *m
                           , double abs_start, double abs_end)
 {
+    if (sk->use_linear)
+        return itersolve_gen_steps_linear(sk, m, abs_start, abs_end);
     sk_calc_callback calc_position_cb = sk->calc_position_cb;
     double half_step = .5 * sk->step_dist;
     double start = abs_start - m->print_time, end = abs_end - m->print_time;
@@ -43,12 +111,22 @@ itersolve_gen_steps_range(struct stepper_kinematics *sk, struct move *m
     double last_time=start, low_time=start, high_time=start + SEEK_TIME_RESET;
     if (high_time > end)
         high_time = end;
+    // Divided differences of recent step times (for warm starts)
+    struct timepos prev_step = {0., 0.};
+    double prev_p1 = 0., prev_p0 = 0., prev_d1 = 0., prev_d2 = 0.;
+    double predict_time = 0.;
+    int step_count = 0;
     for (;;) {
         // Use the "secant method" to guess a new time from previous guesses
         double guess_dist = guess.position - target;
         double og_dist = old_guess.position - target;
         double next_time = ((old_guess.time*guess_dist - guess.time*og_dist)
                             / (guess_dist - og_dist));
+        if (predict_time) {
+            // Warm start - use the time extrapolated from recent steps
+            next_time = predict_time;
+            predict_time = 0.;
+        }
         if (!(next_time > low_time && next_time < high_time)) { // or NaN
             // Next guess is outside bounds checks - validate it
             if (have_bracket) {
@@ -119,6 +197,27 @@ itersolve_gen_steps_range(struct stepper_kinematics *sk, struct move *m
         high_time = guess.time + seek_time_delta;
         if (high_time > end)
             high_time = end;
+        // Warm start the next search by extrapolating a cubic through the
+        // time and position of the last four steps
+        if (is_dir_change)
+            step_count = 0;
+        double p = guess.position, d1 = 0., d2 = 0.;
+        if (step_count >= 1)
+            d1 = (guess.time - prev_step.time) / (p - prev_step.position);
+        if (step_count >= 2)
+            d2 = (d1 - prev_d1) / (p - prev_p1);
+        if (step_count >= 3) {
+            double d3 = (d2 - prev_d2) / (p - prev_p0);
+            predict_time = guess.time + (target - p) * (
+                d1 + (target - prev_step.position) * (
+                    d2 + (target - prev_p1) * d3));
+        }
+        prev_p0 = prev_p1;
+        prev_p1 = prev_step.position;
+        prev_step = guess;
+        prev_d1 = d1;
+        prev_d2 = d2;
+        step_count++;
         is_dir_change = have_bracket = check_oscillate = 0;
     }
     sk->commanded_pos = target - (sdir ? half_step : -half_step);
@@ -148,6 +247,7 @@ itersolve_generate_steps(struct stepper_kinematics *sk, double flush_time)
 {
     double last_flush_time = sk->last_flush_time;
     sk->last_flush_time = flush_time;
+    sk->gen_steps_count++;
     if (!sk->tq)
         return 0;
     trapq_check_sentinels(sk->tq);
@@ -239,6 +339,17 @@ itersolve_is_active_axis(struct stepper_kinematics *sk, char axis)
     return (sk->active_flags & (AF_X << (axis - 'x'))) != 0;
 }
 
+// Enable the closed form solver for a stepper at position x*X + y*Y + z*Z
+void __visible
+itersolve_set_linear(struct stepper_kinematics *sk
+                     , double x, double y, double z)
+{
+    sk->linear_x = x;
+    sk->linear_y = y;
+    sk->linear_z = z;
+    sk->use_linear = x || y || z;
+}
+
 void __visible
 itersolve_set_trapq(struct stepper_kinematics *sk, struct trapq *tq)
 {
@@ -17,18 +17,26 @@ struct stepper_kinematics {
     struct stepcompress *sc;
 
     double last_flush_time, last_move_time;
+    // Incremented on each itersolve_generate_steps() call
+    uint32_t gen_steps_count;
     struct trapq *tq;
     int active_flags;
     double gen_steps_pre_active, gen_steps_post_active;
 
     sk_calc_callback calc_position_cb;
     sk_post_callback post_cb;
+
+    // Optional closed form solver for positions linear in x, y, z
+    int use_linear;
+    double linear_x, linear_y, linear_z;
 };
 
 int32_t itersolve_generate_steps(struct stepper_kinematics *sk
                                  , double flush_time);
 double itersolve_check_active(struct stepper_kinematics *sk, double flush_time);
 int32_t itersolve_is_active_axis(struct stepper_kinematics *sk, char axis);
+void itersolve_set_linear(struct stepper_kinematics *sk
+                          , double x, double y, double z);
 void itersolve_set_trapq(struct stepper_kinematics *sk, struct trapq *tq);
 void itersolve_set_stepcompress(struct stepper_kinematics *sk
                                 , struct stepcompress *sc, double step_dist);
@@ -39,12 +39,15 @@ cartesian_stepper_alloc(char axis)
     memset(sk, 0, sizeof(*sk));
     if (axis == 'x') {
         sk->calc_position_cb = cart_stepper_x_calc_position;
+        itersolve_set_linear(sk, 1., 0., 0.);
         sk->active_flags = AF_X;
     } else if (axis == 'y') {
         sk->calc_position_cb = cart_stepper_y_calc_position;
+        itersolve_set_linear(sk, 0., 1., 0.);
         sk->active_flags = AF_Y;
     } else if (axis == 'z') {
         sk->calc_position_cb = cart_stepper_z_calc_position;
+        itersolve_set_linear(sk, 0., 0., 1.);
         sk->active_flags = AF_Z;
     }
     return sk;
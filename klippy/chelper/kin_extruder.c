@@ -50,10 +50,11 @@ extruder_integrate_time(double base, double start_v, double half_accel
     return ei - si;
 }
 
-// Calculate the definitive integral of extruder for a given move
-static double
-pa_move_integrate(struct move *m, double pressure_advance
-                  , double base, double start, double end, double time_offset)
+// Calculate the definitive integral (and time weighted integral) of
+// extruder for a given move
+static void
+pa_move_integrals(struct move *m, double pressure_advance, double base
+                  , double start, double end, double *iext, double *wgt_ext)
 {
     if (start < 0.)
         start = 0.;
@@ -67,8 +68,17 @@ pa_move_integrate(struct move *m, double pressure_advance
     double start_v = m->start_v + pressure_advance * 2. * m->half_accel;
     // Calculate definitive integral
     double ha = m->half_accel;
-    double iext = extruder_integrate(base, start_v, ha, start, end);
-    double wgt_ext = extruder_integrate_time(base, start_v, ha, start, end);
+    *iext = extruder_integrate(base, start_v, ha, start, end);
+    *wgt_ext = extruder_integrate_time(base, start_v, ha, start, end);
+}
+
+// Calculate the definitive integral of extruder for a given move
+static double
+pa_move_integrate(struct move *m, double pressure_advance
+                  , double base, double start, double end, double time_offset)
+{
+    double iext, wgt_ext;
+    pa_move_integrals(m, pressure_advance, base, start, end, &iext, &wgt_ext);
     return wgt_ext - time_offset * iext;
 }
 
@@ -101,11 +111,214 @@ pa_range_integrate(struct move *m, double move_time
     return res;
 }
 
+
+/****************************************************************
+ * Running integral cache
+ ****************************************************************/
+
+// With many small moves the smoothing window may span dozens of
+// moves. To avoid walking them on every evaluation, recent moves are
+// cached along with running totals of their full move integrals.
+// All times and positions in the cache are relative to its first
+// move (cache_time and cache_pos) to limit rounding errors.
+
+#define PA_CACHE_SIZE 1024
+// Rebuild the cache once its origin is this many half smooth times old
+#define PA_CACHE_REBASE 32.
+
+struct pa_cache_move {
+    struct move *m;
+    double print_time, move_t, start_pos;
+    // Totals of the integral and time weighted integral of all
+    // cached moves up to and including this move
+    double sum_area, sum_weight;
+};
+
 struct extruder_stepper {
     struct stepper_kinematics sk;
     double pressure_advance, half_smooth_time, inv_half_smooth_time2;
+    double cache_time, cache_pos;
+    int cache_count, cache_move, cache_start, cache_end;
+    struct pa_cache_move cache[PA_CACHE_SIZE];
 };
 
+// Add a move to the end of the cache - returns the number of entries
+// discarded from the start of the cache (or -1 if the cache is full)
+static int
+pa_cache_append(struct extruder_stepper *es, struct move *m, int keep)
+{
+    struct pa_cache_move *cache = es->cache;
+    int discard = 0;
+    if (es->cache_count >= PA_CACHE_SIZE) {
+        // Discard the moves prior to the current smoothing window
+        discard = keep;
+        if (!discard)
+            return -1;
+        es->cache_count -= discard;
+        memmove(cache, &cache[discard], es->cache_count * sizeof(*cache));
+    }
+    struct pa_cache_move *cm = &cache[es->cache_count++];
+    cm->m = m;
+    cm->print_time = m->print_time;
+    cm->move_t = m->move_t;
+    cm->start_pos = m->start_pos.x;
+    double iext, wgt_ext, offset = m->print_time - es->cache_time;
+    pa_move_integrals(m, es->pressure_advance, cm->start_pos - es->cache_pos
+                      , 0., m->move_t, &iext, &wgt_ext);
+    cm->sum_area = iext;
+    cm->sum_weight = wgt_ext + offset * iext;
+    if (cm != cache) {
+        cm->sum_area += cm[-1].sum_area;
+        cm->sum_weight += cm[-1].sum_weight;
+    }
+    return discard;
+}
+
+// Reset the cache so that it starts at the smoothing window of a move
+static int
+pa_cache_reset(struct extruder_stepper *es, struct move *m, double move_time)
+{
+    es->cache_count = 0;
+    struct move *first = m;
+    double start = move_time - es->half_smooth_time;
+    int count = 1;
+    while (unlikely(start < 0.)) {
+        first = list_prev_entry(first, node);
+        start += first->move_t;
+        count++;
+    }
+    if (count > PA_CACHE_SIZE)
+        return -1;
+    es->cache_time = first->print_time;
+    es->cache_pos = first->start_pos.x;
+    es->cache_start = es->cache_end = 0;
+    for (;;) {
+        pa_cache_append(es, first, 0);
+        if (first == m)
+            break;
+        first = list_next_entry(first, node);
+    }
+    return count - 1;
+}
+
+static inline int
+pa_cache_match(struct pa_cache_move *cm, struct move *m)
+{
+    return (cm->m == m && cm->print_time == m->print_time
+            && cm->move_t == m->move_t);
+}
+
+// Find a move in the cache
+static int
+pa_cache_find(struct extruder_stepper *es, struct move *m)
+{
+    struct pa_cache_move *cache = es->cache;
+    int count = es->cache_count, pos = es->cache_move;
+    if (pos < count && pa_cache_match(&cache[pos], m))
+        return pos;
+    if (pos + 1 < count && pa_cache_match(&cache[pos + 1], m))
+        return pos + 1;
+    if (!count)
+        return -1;
+    int low = 0, high = count - 1;
+    while (low < high) {
+        int mid = (low + high + 1) / 2;
+        if (cache[mid].print_time <= m->print_time)
+            low = mid;
+        else
+            high = mid - 1;
+    }
+    return pa_cache_match(&cache[low], m) ? low : -1;
+}
+
+// Calculate the definitive integral of the extruder over the
+// smoothing window using the cache (relative to cache_pos)
+static int
+pa_cache_integrate(struct extruder_stepper *es, struct move *m
+                   , double move_time, double *area)
+{
+    double hst = es->half_smooth_time, pa = es->pressure_advance;
+    struct pa_cache_move *cache = es->cache;
+    int i = pa_cache_find(es, m);
+    if (i < 0 || cache[0].print_time - m->print_time > move_time - hst
+        || m->print_time - es->cache_time > PA_CACHE_REBASE * hst) {
+        i = pa_cache_reset(es, m, move_time);
+        if (i < 0)
+            return -1;
+    }
+    double ctime = es->cache_time, move_offset = m->print_time - ctime;
+    double start = move_offset + move_time - hst;
+    double end = move_offset + move_time + hst;
+    // Find the first move in the smoothing window
+    int first = es->cache_start;
+    if (first > i)
+        first = i;
+    while (first > 0 && cache[first].print_time - ctime > start)
+        first--;
+    while (first < i && cache[first + 1].print_time - ctime <= start)
+        first++;
+    // Find the last move in the smoothing window (adding moves as needed)
+    int last = es->cache_end;
+    if (last < i)
+        last = i;
+    while (last > i && cache[last].print_time - ctime >= end)
+        last--;
+    for (;;) {
+        struct pa_cache_move *cm = &cache[last];
+        if (cm->print_time - ctime + cm->move_t >= end)
+            break;
+        if (last + 1 >= es->cache_count) {
+            struct move *next = list_next_entry(cm->m, node);
+            if (list_is_last(&next->node, &es->sk.tq->moves))
+                // Window extends into the tail sentinel
+                return -1;
+            int discard = pa_cache_append(es, next, first);
+            if (discard < 0)
+                return -1;
+            first -= discard;
+            i -= discard;
+            last -= discard;
+        }
+        last++;
+    }
+    es->cache_move = i;
+    es->cache_start = first;
+    es->cache_end = last;
+    // Calculate integral for the current move
+    double cpos = es->cache_pos, base = m->start_pos.x - cpos;
+    double res = pa_move_integrate(m, pa, base, move_time - hst, move_time
+                                   , move_time - hst);
+    res -= pa_move_integrate(m, pa, base, move_time, move_time + hst
+                             , move_time + hst);
+    // Integrate over previous moves
+    if (first < i) {
+        struct pa_cache_move *cm = &cache[first];
+        double ms = start - (cm->print_time - ctime);
+        res += pa_move_integrate(cm->m, pa, cm->start_pos - cpos
+                                 , ms, cm->move_t, ms);
+        struct pa_cache_move *pm = &cache[i - 1];
+        res += ((pm->sum_weight - cm->sum_weight)
+                - start * (pm->sum_area - cm->sum_area));
+    }
+    // Integrate over future moves
+    if (last > i) {
+        struct pa_cache_move *cm = &cache[last];
+        double me = end - (cm->print_time - ctime);
+        res -= pa_move_integrate(cm->m, pa, cm->start_pos - cpos
+                                 , 0., me, me);
+        struct pa_cache_move *pm = &cache[last - 1], *mm = &cache[i];
+        res += (end * (pm->sum_area - mm->sum_area)
+                - (pm->sum_weight - mm->sum_weight));
+    }
+    *area = res;
+    return 0;
+}
+
+
+/****************************************************************
+ * Extruder kinematics
+ ****************************************************************/
+
 static double
 extruder_calc_position(struct stepper_kinematics *sk, struct move *m
                        , double move_time)
@@ -116,7 +329,11 @@ extruder_calc_position(struct stepper_kinematics *sk, struct move *m
         // Pressure advance not enabled
         return m->start_pos.x + move_get_distance(m, move_time);
     // Apply pressure advance and average over smooth_time
-    double area = pa_range_integrate(m, move_time, es->pressure_advance, hst);
+    double area;
+    if (likely(!list_is_last(&m->node, &sk->tq->moves)
+               && !pa_cache_integrate(es, m, move_time, &area)))
+        return es->cache_pos + area * es->inv_half_smooth_time2;
+    area = pa_range_integrate(m, move_time, es->pressure_advance, hst);
     return m->start_pos.x + area * es->inv_half_smooth_time2;
 }
 
@@ -128,6 +345,7 @@ extruder_set_pressure_advance(struct stepper_kinematics *sk
     double hst = smooth_time * .5;
     es->half_smooth_time = hst;
     es->sk.gen_steps_pre_active = es->sk.gen_steps_post_active = hst;
+    es->cache_count = 0;
     if (! hst)
         return;
     es->inv_half_smooth_time2 = 1. / (hst * hst);
@@ -22,6 +22,8 @@ struct shaper_pulses {
     int num_pulses;
     struct {
         double t, a;
+        // Move containing this pulse on the last evaluation
+        struct move *m;
     } pulses[5];
 };
 
@@ -74,9 +76,17 @@ get_axis_position(struct move *m, int axis, double move_time)
     return start_pos + axis_r * move_dist;
 }
 
+// Find the position at 'time' (relative to move 'm'), starting the
+// search of the move list from the move found on the last evaluation
 static inline double
-get_axis_position_across_moves(struct move *m, int axis, double time)
+get_axis_position_across_moves(struct move *m, int axis, double time
+                               , struct move **last_m)
 {
+    struct move *lm = *last_m;
+    if (lm && lm != m) {
+        time += m->print_time - lm->print_time;
+        m = lm;
+    }
     while (likely(time < 0.)) {
         m = list_prev_entry(m, node);
         time += m->move_t;
@@ -85,6 +95,7 @@ get_axis_position_across_moves(struct move *m, int axis, double time)
         time -= m->move_t;
         m = list_next_entry(m, node);
     }
+    *last_m = m;
     return get_axis_position(m, axis, time);
 }
 
@@ -97,11 +108,21 @@ calc_position(struct move *m, int axis, double move_time
     int num_pulses = sp->num_pulses, i;
     for (i = 0; i < num_pulses; ++i) {
         double t = sp->pulses[i].t, a = sp->pulses[i].a;
-        res += a * get_axis_position_across_moves(m, axis, move_time + t);
+        res += a * get_axis_position_across_moves(m, axis, move_time + t
+                                                  , &sp->pulses[i].m);
     }
     return res;
 }
 
+// Forget the moves found on previous evaluations
+static void
+clear_pulse_moves(struct shaper_pulses *sp)
+{
+    int i;
+    for (i = 0; i < ARRAY_SIZE(sp->pulses); ++i)
+        sp->pulses[i].m = NULL;
+}
+
 
 /****************************************************************
  * Kinematics-related shaper code
@@ -114,8 +135,25 @@ struct input_shaper {
     struct stepper_kinematics *orig_sk;
     struct move m;
     struct shaper_pulses sx, sy;
+    uint32_t pulse_moves_count;
 };
 
+// The moves found for each pulse are only known to remain in the trapq
+// during a single itersolve_generate_steps() call
+static void
+shaper_check_pulse_moves(struct input_shaper *is, struct move *m)
+{
+    if (likely(is->pulse_moves_count == is->sk.gen_steps_count
+               && m->node.next))
+        return;
+    clear_pulse_moves(&is->sx);
+    clear_pulse_moves(&is->sy);
+    is->pulse_moves_count = is->sk.gen_steps_count;
+    if (!m->node.next)
+        // Not a trapq move (see itersolve_calc_position_from_coord)
+        is->pulse_moves_count--;
+}
+
 // Optimized calc_position when only x axis is needed
 static double
 shaper_x_calc_position(struct stepper_kinematics *sk, struct move *m
@@ -124,6 +162,7 @@ shaper_x_calc_position(struct stepper_kinematics *sk, struct move *m
     struct input_shaper *is = container_of(sk, struct input_shaper, sk);
     if (!is->sx.num_pulses)
         return is->orig_sk->calc_position_cb(is->orig_sk, m, move_time);
+    shaper_check_pulse_moves(is, m);
     is->m.start_pos.x = calc_position(m, 'x', move_time, &is->sx);
     return is->orig_sk->calc_position_cb(is->orig_sk, &is->m, DUMMY_T);
 }
@@ -136,6 +175,7 @@ shaper_y_calc_position(struct stepper_kinematics *sk, struct move *m
     struct input_shaper *is = container_of(sk, struct input_shaper, sk);
     if (!is->sy.num_pulses)
         return is->orig_sk->calc_position_cb(is->orig_sk, m, move_time);
+    shaper_check_pulse_moves(is, m);
     is->m.start_pos.y = calc_position(m, 'y', move_time, &is->sy);
     return is->orig_sk->calc_position_cb(is->orig_sk, &is->m, DUMMY_T);
 }
@@ -148,6 +188,7 @@ shaper_xy_calc_position(struct stepper_kinematics *sk, struct move *m
     struct input_shaper *is = container_of(sk, struct input_shaper, sk);
     if (!is->sx.num_pulses && !is->sy.num_pulses)
         return is->orig_sk->calc_position_cb(is->orig_sk, m, move_time);
+    shaper_check_pulse_moves(is, m);
     is->m.start_pos = move_get_coord(m, move_time);
     if (is->sx.num_pulses)
         is->m.start_pos.x = calc_position(m, 'x', move_time, &is->sx);
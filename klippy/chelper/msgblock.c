@@ -7,6 +7,7 @@
 #include <stddef.h> // offsetof
 #include <stdlib.h> // malloc
 #include <string.h> // memset
+#include "compiler.h" // __visible
 #include "msgblock.h" // message_alloc
 #include "pyhelper.h" // errorf
 
@@ -16,7 +17,7 @@
  ****************************************************************/
 
 // Implement the standard crc "ccitt" algorithm on the given buffer
-uint16_t
+uint16_t __visible
 msgblock_crc16_ccitt(uint8_t *buf, uint8_t len)
 {
     uint16_t crc = 0xffff;
@@ -31,7 +32,7 @@ msgblock_crc16_ccitt(uint8_t *buf, uint8_t len)
 }
 
 // Verify a buffer starts with a valid mcu message
-int
+int __visible
 msgblock_check(uint8_t *need_sync, uint8_t *buf, int buf_len)
 {
     if (buf_len < MESSAGE_MIN)
@@ -118,6 +119,63 @@ msgblock_decode(uint32_t *data, int data_len, uint8_t *msg, int msg_len)
     return 0;
 }
 
+// Decode the messages in a series of message blocks.  The 'param_types'
+// table has MSGBLOCK_MAX_PARAMS entries for each msgid - the number of
+// parameters plus one (or zero if the message is not supported) followed
+// by the type of each parameter.  Each message is stored in 'data' as
+// its msgid followed by its parameters (a buffer parameter is stored as
+// its offset in 'buf' and its length).  Decoding stops at the first
+// incomplete or invalid block and at any block containing an unsupported
+// message.  Returns the position in 'buf' where decoding stopped.
+int __visible
+msgblock_decode_blocks(uint8_t *param_types, uint8_t *buf, int buf_pos
+                       , int buf_len, uint32_t *data, int data_len
+                       , int *data_count)
+{
+    int count = 0;
+    while (data_len - count >= MESSAGE_MAX * 2) {
+        uint8_t need_sync = 0;
+        int msglen = msgblock_check(&need_sync, &buf[buf_pos]
+                                    , buf_len - buf_pos);
+        if (msglen <= 0)
+            break;
+        uint8_t *p = &buf[buf_pos + MESSAGE_HEADER_SIZE];
+        uint8_t *end = &buf[buf_pos + msglen - MESSAGE_TRAILER_SIZE];
+        int block_count = count;
+        while (p < end) {
+            uint8_t msgid = *p++;
+            if (msgid >= MSGBLOCK_MAX_MSGID)
+                goto unsupported;
+            uint8_t *pt = &param_types[msgid * MSGBLOCK_MAX_PARAMS];
+            int nparams = *pt++;
+            if (!nparams--)
+                goto unsupported;
+            data[count++] = msgid;
+            while (nparams--) {
+                if (p > end)
+                    goto unsupported;
+                if (*pt++ == MSGBLOCK_PT_INT) {
+                    data[count++] = parse_int(&p);
+                    continue;
+                }
+                uint8_t len = *p++;
+                data[count++] = p - buf;
+                data[count++] = len;
+                p += len;
+            }
+            if (p > end)
+                goto unsupported;
+        }
+        buf_pos += msglen;
+        continue;
+unsupported:
+        count = block_count;
+        break;
+    }
+    *data_count = count;
+    return buf_pos;
+}
+
 
 /****************************************************************
  * Command queues
@@ -17,6 +17,11 @@
 #define MESSAGE_DEST 0x10
 #define MESSAGE_SYNC 0x7E
 
+#define MSGBLOCK_MAX_MSGID 128
+#define MSGBLOCK_MAX_PARAMS 16
+#define MSGBLOCK_PT_INT 1
+#define MSGBLOCK_PT_BUFFER 2
+
 struct queue_message {
     int len;
     uint8_t msg[MESSAGE_MAX];
@@ -42,6 +47,9 @@ struct clock_estimate {
 uint16_t msgblock_crc16_ccitt(uint8_t *buf, uint8_t len);
 int msgblock_check(uint8_t *need_sync, uint8_t *buf, int buf_len);
 int msgblock_decode(uint32_t *data, int data_len, uint8_t *msg, int msg_len);
+int msgblock_decode_blocks(uint8_t *param_types, uint8_t *buf, int buf_pos
+                           , int buf_len, uint32_t *data, int data_len
+                           , int *data_count);
 struct queue_message *message_alloc(void);
 struct queue_message *message_fill(uint8_t *data, int len);
 struct queue_message *message_alloc_and_encode(uint32_t *data, int len);
@@ -46,6 +46,8 @@ struct stepcompress {
     // History tracking
     int64_t last_position;
     struct list_head history_list;
+    // Statistics
+    uint64_t step_count;
 };
 
 struct step_move {
@@ -129,10 +131,12 @@ compress_bisect_add(struct stepcompress *sc)
             nextpoint = minmax_point(sc, sc->queue_pos + nextcount - 1);
             int32_t nextaddfactor = nextcount*(nextcount-1)/2;
             int32_t c = add*nextaddfactor;
-            if (nextmininterval*nextcount < nextpoint.minp - c)
-                nextmininterval = idiv_up(nextpoint.minp - c, nextcount);
-            if (nextmaxinterval*nextcount > nextpoint.maxp - c)
-                nextmaxinterval = idiv_down(nextpoint.maxp - c, nextcount);
+            // Always calculate both limits - the divides are cheaper
+            // than the hard to predict branches needed to skip them
+            int32_t mi = idiv_up(nextpoint.minp - c, nextcount);
+            int32_t ma = idiv_down(nextpoint.maxp - c, nextcount);
+            nextmininterval = mi > nextmininterval ? mi : nextmininterval;
+            nextmaxinterval = ma < nextmaxinterval ? ma : nextmaxinterval;
             if (nextmininterval > nextmaxinterval)
                 break;
             interval = nextmaxinterval;
@@ -321,6 +325,13 @@ stepcompress_get_step_dir(struct stepcompress *sc)
     return sc->next_step_dir;
 }
 
+// Return the total number of steps queued for the mcu
+uint64_t __visible
+stepcompress_get_step_count(struct stepcompress *sc)
+{
+    return sc->step_count;
+}
+
 // Determine the "print time" of the last_step_clock
 static void
 calc_last_step_print_time(struct stepcompress *sc)
@@ -371,6 +382,7 @@ add_move(struct stepcompress *sc, uint64_t first_clock, struct step_move *move)
     hs->step_count = sc->sdir ? move->count : -move->count;
     sc->last_position += hs->step_count;
     list_add_head(&hs->node, &sc->history_list);
+    sc->step_count += move->count;
 }
 
 // Convert previously scheduled steps into commands for the mcu
@@ -770,6 +782,17 @@ heap_replace(struct steppersync *ss, uint64_t req_clock)
     }
 }
 
+// Return the number of mcu move queue slots still in use at 'clock'
+int __visible
+steppersync_get_pending(struct steppersync *ss, uint64_t clock)
+{
+    int i, pending = 0;
+    for (i=0; i<ss->num_move_clocks; i++)
+        if (ss->move_clocks[i] > clock)
+            pending++;
+    return pending;
+}
+
 // Find and transmit any scheduled steps prior to the given 'move_clock'
 int __visible
 steppersync_flush(struct steppersync *ss, uint64_t move_clock
@@ -825,3 +848,27 @@ steppersync_flush(struct steppersync *ss, uint64_t move_clock
     steppersync_history_expire(ss, clear_history_clock);
     return 0;
 }
+
+
+/****************************************************************
+ * Benchmark only interface (not used by klippy)
+ ****************************************************************/
+
+// Add a series of previously recorded step clocks (for
+// scripts/benchmark_stepcompress.py - klippy uses stepcompress_append)
+int __visible
+stepcompress_append_clocks(struct stepcompress *sc, int sdir
+                           , uint64_t *clocks, int count)
+{
+    int i;
+    for (i = 0; i < count; i++) {
+        if (sc->next_step_clock) {
+            int ret = queue_append(sc);
+            if (ret)
+                return ret;
+        }
+        sc->next_step_clock = clocks[i];
+        sc->next_step_dir = sdir;
+    }
+    return 0;
+}
@@ -20,6 +20,7 @@ void stepcompress_set_invert_sdir(struct stepcompress *sc
 void stepcompress_free(struct stepcompress *sc);
 uint32_t stepcompress_get_oid(struct stepcompress *sc);
 int stepcompress_get_step_dir(struct stepcompress *sc);
+uint64_t stepcompress_get_step_count(struct stepcompress *sc);
 int stepcompress_append(struct stepcompress *sc, int sdir
                         , double print_time, double step_time);
 int stepcompress_commit(struct stepcompress *sc);
@@ -42,6 +43,7 @@ struct steppersync *steppersync_alloc(
 void steppersync_free(struct steppersync *ss);
 void steppersync_set_time(struct steppersync *ss, double time_offset
                           , double mcu_freq);
+int steppersync_get_pending(struct steppersync *ss, uint64_t clock);
 int steppersync_flush(struct steppersync *ss, uint64_t move_clock
                       , uint64_t clear_history_clock);
 
@@ -39,6 +39,8 @@ move_get_coord(struct move *m, double move_time)
 }
 
 #define NEVER_TIME 9999999999999999.9
+#define MAX_FREE_MOVES 4096
+#define MAX_HISTORY_MOVES 131072
 
 // Allocate a new 'trapq' object
 struct trapq * __visible
@@ -47,7 +49,7 @@ trapq_alloc(void)
     struct trapq *tq = malloc(sizeof(*tq));
     memset(tq, 0, sizeof(*tq));
     list_init(&tq->moves);
-    list_init(&tq->history);
+    list_init(&tq->free_moves);
     struct move *head_sentinel = move_alloc(), *tail_sentinel = move_alloc();
     tail_sentinel->print_time = tail_sentinel->move_t = NEVER_TIME;
     list_add_head(&head_sentinel->node, &tq->moves);
@@ -64,14 +66,97 @@ trapq_free(struct trapq *tq)
         list_del(&m->node);
         free(m);
     }
-    while (!list_empty(&tq->history)) {
-        struct move *m = list_first_entry(&tq->history, struct move, node);
+    int i;
+    for (i = 0; i < tq->history_count; i++)
+        free(tq->history[(tq->history_start + i) % tq->history_size]);
+    free(tq->history);
+    while (!list_empty(&tq->free_moves)) {
+        struct move *m = list_first_entry(&tq->free_moves, struct move, node);
         list_del(&m->node);
         free(m);
     }
     free(tq);
 }
 
+// Allocate a 'move' object, reusing a previously released move if possible
+static struct move *
+trapq_move_alloc(struct trapq *tq)
+{
+    if (list_empty(&tq->free_moves))
+        return move_alloc();
+    struct move *m = list_first_entry(&tq->free_moves, struct move, node);
+    list_del(&m->node);
+    tq->free_count--;
+    memset(m, 0, sizeof(*m));
+    return m;
+}
+
+// Release a 'move' object that is no longer referenced by the trapq
+static void
+trapq_move_free(struct trapq *tq, struct move *m)
+{
+    if (tq->free_count >= MAX_FREE_MOVES) {
+        free(m);
+        return;
+    }
+    list_add_head(&m->node, &tq->free_moves);
+    tq->free_count++;
+}
+
+// Return the history move at 'pos' (0 is the oldest move)
+static inline struct move *
+history_get(struct trapq *tq, int pos)
+{
+    int idx = tq->history_start + pos;
+    if (idx >= tq->history_size)
+        idx -= tq->history_size;
+    return tq->history[idx];
+}
+
+// Remove and release the oldest move in the history
+static void
+history_pop_oldest(struct trapq *tq)
+{
+    trapq_move_free(tq, tq->history[tq->history_start]);
+    tq->history_start++;
+    if (tq->history_start >= tq->history_size)
+        tq->history_start = 0;
+    tq->history_count--;
+}
+
+// Remove and release the newest move in the history
+static void
+history_pop_newest(struct trapq *tq)
+{
+    trapq_move_free(tq, history_get(tq, tq->history_count - 1));
+    tq->history_count--;
+}
+
+// Add a move to the end of the history
+static void
+history_push(struct trapq *tq, struct move *m)
+{
+    if (tq->history_count >= MAX_HISTORY_MOVES)
+        // Bound memory usage by discarding the oldest history
+        history_pop_oldest(tq);
+    if (tq->history_count >= tq->history_size) {
+        // Grow the ring buffer
+        int new_size = tq->history_size ? tq->history_size * 2 : 64, i;
+        struct move **h = malloc(new_size * sizeof(*h));
+        for (i = 0; i < tq->history_count; i++)
+            h[i] = history_get(tq, i);
+        free(tq->history);
+        tq->history = h;
+        tq->history_size = new_size;
+        tq->history_start = 0;
+    }
+    int idx = tq->history_start + tq->history_count;
+    if (idx >= tq->history_size)
+        idx -= tq->history_size;
+    tq->history[idx] = m;
+    tq->history_count++;
+}
+
 // Update the list sentinels
 void
 trapq_check_sentinels(struct trapq *tq)
@@ -101,7 +186,7 @@ trapq_add_move(struct trapq *tq, struct move *m)
     struct move *prev = list_prev_entry(tail_sentinel, node);
     if (prev->print_time + prev->move_t < m->print_time) {
         // Add a null move to fill time gap
-        struct move *null_move = move_alloc();
+        struct move *null_move = trapq_move_alloc(tq);
         null_move->start_pos = m->start_pos;
         if (!prev->print_time && m->print_time > MAX_NULL_MOVE)
             // Limit the first null move to improve numerical stability
@@ -126,7 +211,7 @@ trapq_append(struct trapq *tq, double print_time
     struct coord start_pos = { .x=start_pos_x, .y=start_pos_y, .z=start_pos_z };
     struct coord axes_r = { .x=axes_r_x, .y=axes_r_y, .z=axes_r_z };
     if (accel_t) {
-        struct move *m = move_alloc();
+        struct move *m = trapq_move_alloc(tq);
         m->print_time = print_time;
         m->move_t = accel_t;
         m->start_v = start_v;
@@ -139,7 +224,7 @@ trapq_append(struct trapq *tq, double print_time
         start_pos = move_get_coord(m, accel_t);
     }
     if (cruise_t) {
-        struct move *m = move_alloc();
+        struct move *m = trapq_move_alloc(tq);
         m->print_time = print_time;
         m->move_t = cruise_t;
         m->start_v = cruise_v;
@@ -152,7 +237,7 @@ trapq_append(struct trapq *tq, double print_time
         start_pos = move_get_coord(m, cruise_t);
     }
     if (decel_t) {
-        struct move *m = move_alloc();
+        struct move *m = trapq_move_alloc(tq);
         m->print_time = print_time;
         m->move_t = decel_t;
         m->start_v = cruise_v;
@@ -170,7 +255,7 @@ trapq_finalize_moves(struct trapq *tq, double print_time
 {
     struct move *head_sentinel = list_first_entry(&tq->moves, struct move,node);
     struct move *tail_sentinel = list_last_entry(&tq->moves, struct move, node);
-    // Move expired moves from main "moves" list to "history" list
+    // Move expired moves from main "moves" list to the history
     for (;;) {
         struct move *m = list_next_entry(head_sentinel, node);
         if (m == tail_sentinel) {
@@ -181,20 +266,16 @@ trapq_finalize_moves(struct trapq *tq, double print_time
             break;
         list_del(&m->node);
         if (m->start_v || m->half_accel)
-            list_add_head(&m->node, &tq->history);
+            history_push(tq, m);
         else
-            free(m);
+            trapq_move_free(tq, m);
     }
-    // Free old moves from history list
-    if (list_empty(&tq->history))
-        return;
-    struct move *latest = list_first_entry(&tq->history, struct move, node);
-    for (;;) {
-        struct move *m = list_last_entry(&tq->history, struct move, node);
-        if (m == latest || m->print_time + m->move_t > clear_history_time)
+    // Free old moves from history (always retaining the latest move)
+    while (tq->history_count > 1) {
+        struct move *m = tq->history[tq->history_start];
+        if (m->print_time + m->move_t > clear_history_time)
             break;
-        list_del(&m->node);
-        free(m);
+        history_pop_oldest(tq);
     }
 }
 
@@ -207,38 +288,44 @@ trapq_set_position(struct trapq *tq, double print_time
     trapq_finalize_moves(tq, NEVER_TIME, 0);
 
     // Prune any moves in the trapq history that were interrupted
-    while (!list_empty(&tq->history)) {
-        struct move *m = list_first_entry(&tq->history, struct move, node);
+    while (tq->history_count) {
+        struct move *m = history_get(tq, tq->history_count - 1);
         if (m->print_time < print_time) {
             if (m->print_time + m->move_t > print_time)
                 m->move_t = print_time - m->print_time;
             break;
         }
-        list_del(&m->node);
-        free(m);
+        history_pop_newest(tq);
     }
 
     // Add a marker to the trapq history
-    struct move *m = move_alloc();
+    struct move *m = trapq_move_alloc(tq);
     m->print_time = print_time;
     m->start_pos.x = pos_x;
     m->start_pos.y = pos_y;
     m->start_pos.z = pos_z;
-    list_add_head(&m->node, &tq->history);
+    history_push(tq, m);
 }
 
-// Return history of movement queue
+// Return history of movement queue (newest moves first)
 int __visible
 trapq_extract_old(struct trapq *tq, struct pull_move *p, int max
                   , double start_time, double end_time)
 {
-    int res = 0;
-    struct move *m;
-    list_for_each_entry(m, &tq->history, node) {
-        if (start_time >= m->print_time + m->move_t || res >= max)
+    // Binary search for the first history move starting at/after end_time
+    int low = 0, high = tq->history_count;
+    while (low < high) {
+        int mid = (low + high) / 2;
+        if (history_get(tq, mid)->print_time < end_time)
+            low = mid + 1;
+        else
+            high = mid;
+    }
+    int res = 0, pos;
+    for (pos = low - 1; pos >= 0 && res < max; pos--) {
+        struct move *m = history_get(tq, pos);
+        if (start_time >= m->print_time + m->move_t)
             break;
-        if (end_time <= m->print_time)
-            continue;
         p->print_time = m->print_time;
         p->move_t = m->move_t;
         p->start_v = m->start_v;
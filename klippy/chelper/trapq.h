@@ -21,7 +21,13 @@ struct move {
 };
 
 struct trapq {
-    struct list_head moves, history;
+    struct list_head moves;
+    // Expired moves (oldest first) stored in a ring buffer
+    struct move **history;
+    int history_size, history_start, history_count;
+    // Cache of released move objects available for reuse
+    struct list_head free_moves;
+    int free_count;
 };
 
 struct pull_move {
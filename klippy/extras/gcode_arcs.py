@@ -8,7 +8,7 @@
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import math
 
-# Coordinates created by this are converted into G1 commands.
+# Coordinates created by this are sent as a batch of G1 moves.
 #
 # supports XY, XZ & YZ planes with remaining axis as helical
 
@@ -88,7 +88,7 @@ class ArcSupport:
             raise gcmd.error("G2/G3 requires IJ, IK or JK parameters")
 
         asE = gcmd.get_float("E", None)
-        asF = gcmd.get_float("F", None)
+        asF = gcmd.get_float("F", None, above=0.)
 
         # Build list of linear coordinates to move
         coords = self.planArc(currentPos, asTarget, asPlanar,
@@ -99,17 +99,17 @@ class ArcSupport:
                 e_base = currentPos[3]
             e_per_move = (asE - e_base) / len(coords)
 
-        # Convert coords into G1 commands
-        for coord in coords:
-            g1_params = {'X': coord[0], 'Y': coord[1], 'Z': coord[2]}
-            if e_per_move:
-                g1_params['E'] = e_base + e_per_move
-                if gcodestatus['absolute_extrude']:
-                    e_base += e_per_move
-            if asF is not None:
-                g1_params['F'] = asF
-            g1_gcmd = self.gcode.create_gcode_command("G1", "G1", g1_params)
-            self.gcode_move.cmd_G1(g1_gcmd)
+        # Convert coords into G1 moves
+        if not e_per_move:
+            moves = [(c[0], c[1], c[2], None) for c in coords]
+        elif gcodestatus['absolute_extrude']:
+            moves = []
+            for coord in coords:
+                e_base += e_per_move
+                moves.append((coord[0], coord[1], coord[2], e_base))
+        else:
+            moves = [(c[0], c[1], c[2], e_per_move) for c in coords]
+        self.gcode_move.move_G1_batch(moves, asF)
 
     # function planArc() originates from marlin plan_arc()
     # https://github.com/MarlinFirmware/Marlin
@@ -167,12 +167,11 @@ class ArcSupport:
             r_P = -offset[0] * cos_Ti + offset[1] * sin_Ti
             r_Q = -offset[0] * sin_Ti - offset[1] * cos_Ti
 
-            # Coord doesn't support index assignment, create list
-            c = [None, None, None, None]
+            c = [None, None, None]
             c[alpha_axis] = center_P + r_P
             c[beta_axis] = center_Q + r_Q
             c[helical_axis] = currentPos[helical_axis] + dist_Helical
-            coords.append(self.Coord(*c))
+            coords.append(c)
 
         coords.append(targetPos)
         return coords
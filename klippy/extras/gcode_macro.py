@@ -5,12 +5,133 @@
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import traceback, logging, ast, copy, json
 import jinja2
+try:
+    from collections.abc import MutableMapping, MutableSequence
+except ImportError:
+    from collections import MutableMapping, MutableSequence
 
 
 ######################################################################
 # Template handling
 ######################################################################
 
+# Views of printer object status.  These avoid copying the (possibly
+# large) get_status() results during each template render.  The status
+# is only copied if a template modifies one of its values.
+class StatusRoot:
+    def __init__(self, data):
+        self.data = data
+        self.memo = None
+    def resolve(self, orig):
+        if self.memo is None:
+            return orig
+        return self.memo.get(id(orig), orig)
+    def make_writable(self, orig):
+        if self.memo is None:
+            # The deepcopy memo maps each original object to its copy
+            self.memo = {}
+            copy.deepcopy(self.data, self.memo)
+        return self.resolve(orig)
+
+def _status_store(value):
+    if isinstance(value, (StatusDictView, StatusListView)):
+        return value.copy()
+    return value
+
+class StatusDictView(MutableMapping):
+    def __init__(self, data, root):
+        self._orig = data
+        self._root = root
+    def _get(self):
+        return self._root.resolve(self._orig)
+    def _writable(self):
+        return self._root.make_writable(self._orig)
+    def __getitem__(self, key):
+        return status_view(self._get()[key], self._root)
+    def __setitem__(self, key, value):
+        self._writable()[key] = _status_store(value)
+    def __delitem__(self, key):
+        del self._writable()[key]
+    def __iter__(self):
+        return iter(self._get())
+    def __len__(self):
+        return len(self._get())
+    def __contains__(self, key):
+        return key in self._get()
+    def __eq__(self, other):
+        return self._get() == unwrap_status(other)
+    def __ne__(self, other):
+        return not self.__eq__(other)
+    __hash__ = None
+    def __repr__(self):
+        return repr(self._get())
+    def copy(self):
+        return copy.deepcopy(self._get())
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._get(), memo)
+
+class StatusListView(MutableSequence):
+    def __init__(self, data, root):
+        self._orig = data
+        self._root = root
+    def _get(self):
+        return self._root.resolve(self._orig)
+    def _writable(self):
+        return self._root.make_writable(self._orig)
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return copy.deepcopy(self._get()[index])
+        return status_view(self._get()[index], self._root)
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [_status_store(v) for v in value]
+        else:
+            value = _status_store(value)
+        self._writable()[index] = value
+    def __delitem__(self, index):
+        del self._writable()[index]
+    def insert(self, index, value):
+        self._writable().insert(index, _status_store(value))
+    def sort(self, *args, **kwargs):
+        self._writable().sort(*args, **kwargs)
+    def __len__(self):
+        return len(self._get())
+    def __contains__(self, value):
+        return unwrap_status(value) in self._get()
+    def __eq__(self, other):
+        return self._get() == unwrap_status(other)
+    def __ne__(self, other):
+        return not self.__eq__(other)
+    __hash__ = None
+    def __add__(self, other):
+        return self.copy() + list(other)
+    def __radd__(self, other):
+        return list(other) + self.copy()
+    def __repr__(self):
+        return repr(self._get())
+    def copy(self):
+        return copy.deepcopy(self._get())
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self._get(), memo)
+
+def status_view(value, root):
+    if isinstance(value, dict):
+        return StatusDictView(value, root)
+    if isinstance(value, list):
+        return StatusListView(value, root)
+    return value
+
+def unwrap_status(value):
+    if isinstance(value, (StatusDictView, StatusListView)):
+        return value._get()
+    return value
+
+def _status_json_default(obj):
+    if isinstance(obj, (StatusDictView, StatusListView)):
+        return obj._get()
+    raise TypeError("Object of type %s is not JSON serializable"
+                    % (type(obj).__name__,))
+
 # Wrapper for access to printer object get_status() methods
 class GetStatusWrapper:
     def __init__(self, printer, eventtime=None):
@@ -26,7 +147,8 @@ class GetStatusWrapper:
             raise KeyError(val)
         if self.eventtime is None:
             self.eventtime = self.printer.get_reactor().monotonic()
-        self.cache[sval] = res = copy.deepcopy(po.get_status(self.eventtime))
+        status = po.get_status(self.eventtime)
+        self.cache[sval] = res = status_view(status, StatusRoot(status))
         return res
     def __contains__(self, val):
         try:
@@ -47,6 +169,9 @@ class TemplateWrapper:
         self.gcode = self.printer.lookup_object('gcode')
         gcode_macro = self.printer.lookup_object('gcode_macro')
         self.create_template_context = gcode_macro.create_template_context
+        self.reactor = self.printer.get_reactor()
+        self.render_count = 0
+        self.render_time = self.render_max = 0.
         try:
             self.template = env.from_string(script)
         except Exception as e:
@@ -57,6 +182,7 @@ class TemplateWrapper:
     def render(self, context=None):
         if context is None:
             context = self.create_template_context()
+        start_time = self.reactor.monotonic()
         try:
             return str(self.template.render(context))
         except Exception as e:
@@ -64,6 +190,11 @@ class TemplateWrapper:
                 self.name, traceback.format_exception_only(type(e), e)[-1])
             logging.exception(msg)
             raise self.gcode.error(msg)
+        finally:
+            render_time = self.reactor.monotonic() - start_time
+            self.render_count += 1
+            self.render_time += render_time
+            self.render_max = max(self.render_max, render_time)
     def run_gcode_from_command(self, context=None):
         self.gcode.run_script_from_command(self.render(context))
 
@@ -71,7 +202,16 @@ class TemplateWrapper:
 class PrinterGCodeMacro:
     def __init__(self, config):
         self.printer = config.get_printer()
+        self.macro_stats = {}
         self.env = jinja2.Environment('{%', '%}', '{', '}')
+        self.env.policies['json.dumps_kwargs'] = {
+            'sort_keys': True, 'default': _status_json_default}
+        gcode = self.printer.lookup_object('gcode')
+        gcode.register_command('MACRO_PROFILE', self.cmd_MACRO_PROFILE,
+                               desc=self.cmd_MACRO_PROFILE_help)
+        webhooks = self.printer.lookup_object('webhooks')
+        webhooks.register_endpoint("gcode_macro/profile",
+                                   self._handle_profile)
     def load_template(self, config, option, default=None):
         name = "%s:%s" % (config.get_name(), option)
         if default is None:
@@ -89,11 +229,50 @@ class PrinterGCodeMacro:
         raise self.printer.command_error(msg)
     def _action_call_remote_method(self, method, **kwargs):
         webhooks = self.printer.lookup_object('webhooks')
+        kwargs = copy.deepcopy(kwargs)
         try:
             webhooks.call_remote_method(method, **kwargs)
         except self.printer.command_error:
             logging.exception("Remote Call Error")
         return ""
+    def note_macro_stats(self, name, stats):
+        self.macro_stats[name] = stats
+    def get_status(self, eventtime):
+        return {'profile': dict(self.macro_stats)}
+    def _handle_profile(self, web_request):
+        web_request.send({'profile': dict(self.macro_stats)})
+    cmd_MACRO_PROFILE_help = "Report the most expensive g-code macros"
+    def cmd_MACRO_PROFILE(self, gcmd):
+        count = gcmd.get_int('COUNT', 10, minval=1)
+        sort = gcmd.get('SORT', 'total').lower()
+        if sort not in ('total', 'render', 'exec'):
+            raise gcmd.error("Invalid SORT '%s'" % (sort,))
+        if gcmd.get_int('RESET', 0):
+            self.macro_stats.clear()
+            for obj_name, obj in self.printer.lookup_objects('gcode_macro'):
+                if isinstance(obj, GCodeMacro):
+                    obj.reset_stats()
+            gcmd.respond_info("Macro profile reset")
+            return
+        def sort_key(item):
+            stats = item[1]
+            if sort == 'render':
+                return stats['render_time']
+            if sort == 'exec':
+                return stats['exec_time']
+            return stats['render_time'] + stats['exec_time']
+        items = sorted(self.macro_stats.items(), key=sort_key, reverse=True)
+        if not items:
+            gcmd.respond_info("No macros have been run")
+            return
+        msg = []
+        for name, stats in items[:count]:
+            msg.append("%s: calls=%d render=%.6f (max %.6f)"
+                       " exec=%.6f (max %.6f)"
+                       % (name, stats['calls'], stats['render_time'],
+                          stats['render_max'], stats['exec_time'],
+                          stats['exec_max']))
+        gcmd.respond_info("\n".join(msg))
     def create_template_context(self, eventtime=None):
         return {
             'printer': GetStatusWrapper(self.printer, eventtime),
@@ -140,6 +319,9 @@ class GCodeMacro:
                                         name, self.cmd_SET_GCODE_VARIABLE,
                                         desc=self.cmd_SET_GCODE_VARIABLE_help)
         self.in_script = False
+        self.reactor = printer.get_reactor()
+        self.gcode_macro = gcode_macro
+        self.reset_stats()
         self.variables = {}
         prefix = 'variable_'
         for option in config.get_prefix_options(prefix):
@@ -162,6 +344,12 @@ class GCodeMacro:
         self.gcode.register_command(self.alias, self.cmd, desc=self.cmd_desc)
     def get_status(self, eventtime):
         return self.variables
+    def reset_stats(self):
+        self.calls = 0
+        self.exec_time = self.exec_max = 0.
+        template = self.template
+        template.render_count = 0
+        template.render_time = template.render_max = 0.
     cmd_SET_GCODE_VARIABLE_help = "Set the value of a G-Code macro variable"
     def cmd_SET_GCODE_VARIABLE(self, gcmd):
         variable = gcmd.get('VARIABLE')
@@ -185,10 +373,26 @@ class GCodeMacro:
         kwparams['params'] = gcmd.get_command_parameters()
         kwparams['rawparams'] = gcmd.get_raw_command_parameters()
         self.in_script = True
+        exec_start = None
         try:
-            self.template.run_gcode_from_command(kwparams)
+            script = self.template.render(kwparams)
+            exec_start = self.reactor.monotonic()
+            self.gcode.run_script_from_command(script)
         finally:
             self.in_script = False
+            self._note_call(exec_start)
+    def _note_call(self, exec_start):
+        self.calls += 1
+        if exec_start is not None:
+            exec_time = self.reactor.monotonic() - exec_start
+            self.exec_time += exec_time
+            self.exec_max = max(self.exec_max, exec_time)
+        template = self.template
+        self.gcode_macro.note_macro_stats(self.alias, {
+            'calls': self.calls,
+            'render_time': template.render_time,
+            'render_max': template.render_max,
+            'exec_time': self.exec_time, 'exec_max': self.exec_max})
 
 def load_config_prefix(config):
     return GCodeMacro(config)
@@ -33,9 +33,13 @@ class GCodeMove:
             desc = getattr(self, 'cmd_' + cmd + '_help', None)
             gcode.register_command(cmd, func, False, desc)
         gcode.register_command('G0', self.cmd_G1)
+        gcode.register_fast_move(self.cmd_G1, self.move_G1)
         gcode.register_command('M114', self.cmd_M114, True)
         gcode.register_command('GET_POSITION', self.cmd_GET_POSITION, True,
                                desc=self.cmd_GET_POSITION_help)
+        gcode.register_command('MOVE_TRANSFORM_STATS',
+                               self.cmd_MOVE_TRANSFORM_STATS,
+                               desc=self.cmd_MOVE_TRANSFORM_STATS_help)
         self.Coord = gcode.Coord
         # G-Code coordinate manipulation
         self.absolute_coord = self.absolute_extrude = True
@@ -49,12 +53,14 @@ class GCodeMove:
         self.saved_states = {}
         self.move_transform = self.move_with_transform = None
         self.position_with_transform = (lambda: [0., 0., 0., 0.])
+        # Move transform pipeline (see _build_pipeline())
+        self.transforms = []
+        self.stage_funcs = []
+        self.move_sink = None
+        self.stage_stats = None
     def _handle_ready(self):
         self.is_printer_ready = True
-        if self.move_transform is None:
-            toolhead = self.printer.lookup_object('toolhead')
-            self.move_with_transform = toolhead.move
-            self.position_with_transform = toolhead.get_position
+        self._build_pipeline()
         self.reset_last_position()
     def _handle_shutdown(self):
         if not self.is_printer_ready:
@@ -83,9 +89,88 @@ class GCodeMove:
         if old_transform is None:
             old_transform = self.printer.lookup_object('toolhead', None)
         self.move_transform = transform
-        self.move_with_transform = transform.move
-        self.position_with_transform = transform.get_position
+        # Track the chain of transforms (most recently registered first)
+        if transform in self.transforms:
+            # Restoring an earlier transform in the chain
+            self.transforms = self.transforms[self.transforms.index(transform):]
+        elif transform is self.printer.lookup_object('toolhead', None):
+            self.transforms = []
+        else:
+            self.transforms.insert(0, transform)
+        self._build_pipeline()
         return old_transform
+    def _build_pipeline(self):
+        # A transform may implement transform_position(newpos), which
+        # returns the position to pass to the next transform in the chain
+        # (without otherwise changing the move).  Leading transforms that
+        # do so are run as a flat list of stages and the first transform
+        # that does not (or the toolhead) is invoked to perform the move.
+        toolhead = self.printer.lookup_object('toolhead', None)
+        head = self.move_transform
+        if head is None:
+            head = toolhead
+        if head is None:
+            return
+        self.position_with_transform = head.get_position
+        stages = []
+        sink = toolhead
+        for transform in self.transforms:
+            if not hasattr(transform, 'transform_position'):
+                sink = transform
+                break
+            stages.append(transform)
+        if sink is None:
+            # Toolhead not yet available - invoke the chain directly
+            self.stage_funcs = []
+            self.move_sink = None
+            self.move_with_transform = head.move
+            return
+        self.stage_funcs = [t.transform_position for t in stages]
+        self.move_sink = sink
+        if self.stage_stats is not None:
+            self.stage_stats = [[type(t).__name__, 0, 0.]
+                                for t in stages + [sink]]
+            self.move_with_transform = self._move_pipeline_stats
+        elif stages:
+            self.move_with_transform = self._move_pipeline
+        else:
+            self.move_with_transform = sink.move
+    def _move_pipeline(self, newpos, speed):
+        for func in self.stage_funcs:
+            newpos = func(newpos)
+        self.move_sink.move(newpos, speed)
+    def _move_pipeline_stats(self, newpos, speed):
+        monotonic = self.printer.get_reactor().monotonic
+        stats = self.stage_stats
+        start_time = monotonic()
+        for func, stage in zip(self.stage_funcs, stats):
+            newpos = func(newpos)
+            end_time = monotonic()
+            stage[1] += 1
+            stage[2] += end_time - start_time
+            start_time = end_time
+        self.move_sink.move(newpos, speed)
+        stage = stats[-1]
+        stage[1] += 1
+        stage[2] += monotonic() - start_time
+    def move_batch(self, positions, speed):
+        # Perform a series of moves through the transform pipeline.  Each
+        # move passes through all the stages before the next move starts
+        # as stages may track the last position (eg, z_thermal_adjust).
+        # The last_position is updated as each move is queued.
+        last_position = self.last_position
+        if self.move_sink is None or self.stage_stats is not None:
+            for newpos in positions:
+                last_position[:] = newpos
+                self.move_with_transform(newpos, speed)
+            return
+        stage_funcs = self.stage_funcs
+        sink_move = self.move_sink.move
+        for newpos in positions:
+            last_position[:] = newpos
+            for func in stage_funcs:
+                newpos = func(newpos)
+            sink_move(newpos, speed)
     def _get_gcode_position(self):
         p = [lp - bp for lp, bp in zip(self.last_position, self.base_position)]
         p[3] /= self.extrude_factor
@@ -114,33 +199,57 @@ class GCodeMove:
         # Move
         params = gcmd.get_command_parameters()
         try:
-            for pos, axis in enumerate('XYZ'):
-                if axis in params:
-                    v = float(params[axis])
-                    if not self.absolute_coord:
-                        # value relative to position of last move
-                        self.last_position[pos] += v
-                    else:
-                        # value relative to base coordinate position
-                        self.last_position[pos] = v + self.base_position[pos]
-            if 'E' in params:
-                v = float(params['E']) * self.extrude_factor
-                if not self.absolute_coord or not self.absolute_extrude:
-                    # value relative to position of last move
-                    self.last_position[3] += v
-                else:
-                    # value relative to base coordinate position
-                    self.last_position[3] = v + self.base_position[3]
-            if 'F' in params:
-                gcode_speed = float(params['F'])
-                if gcode_speed <= 0.:
-                    raise gcmd.error("Invalid speed in '%s'"
-                                     % (gcmd.get_commandline(),))
-                self.speed = gcode_speed * self.speed_factor
+            params = {a: float(params[a]) for a in 'XYZEF' if a in params}
         except ValueError as e:
             raise gcmd.error("Unable to parse move '%s'"
                              % (gcmd.get_commandline(),))
-        self.move_with_transform(self.last_position, self.speed)
+        if params.get('F', 1.) <= 0.:
+            raise gcmd.error("Invalid speed in '%s'"
+                             % (gcmd.get_commandline(),))
+        self.move_G1(params)
+    def move_G1(self, params):
+        # Move using pre-parsed (float) parameters
+        last_position = self.last_position
+        for pos, axis in enumerate('XYZ'):
+            if axis in params:
+                v = params[axis]
+                if not self.absolute_coord:
+                    # value relative to position of last move
+                    last_position[pos] += v
+                else:
+                    # value relative to base coordinate position
+                    last_position[pos] = v + self.base_position[pos]
+        if 'E' in params:
+            v = params['E'] * self.extrude_factor
+            if not self.absolute_coord or not self.absolute_extrude:
+                # value relative to position of last move
+                last_position[3] += v
+            else:
+                # value relative to base coordinate position
+                last_position[3] = v + self.base_position[3]
+        if 'F' in params:
+            self.speed = params['F'] * self.speed_factor
+        self.move_with_transform(last_position, self.speed)
+    def move_G1_batch(self, moves, feedrate=None):
+        # Perform a series of absolute coordinate moves.  Each move is an
+        # (x, y, z, e) tuple of G1 parameters (e may be None).
+        base_position = self.base_position
+        base_x, base_y, base_z, base_e = base_position
+        extrude_factor = self.extrude_factor
+        absolute_extrude = self.absolute_extrude
+        last_e = self.last_position[3]
+        positions = []
+        for x, y, z, e in moves:
+            if e is not None:
+                v = e * extrude_factor
+                if absolute_extrude:
+                    last_e = v + base_e
+                else:
+                    last_e += v
+            positions.append([x + base_x, y + base_y, z + base_z, last_e])
+        if feedrate is not None:
+            self.speed = feedrate * self.speed_factor
+        self.move_batch(positions, self.speed)
     # G-Code coordinate manipulation
     def cmd_G20(self, gcmd):
         # Set units to inches
@@ -271,6 +380,27 @@ class GCodeMove:
                           "gcode homing: %s"
                           % (mcu_pos, stepper_pos, kin_pos, toolhead_pos,
                              gcode_pos, base_pos, homing_pos))
+    cmd_MOVE_TRANSFORM_STATS_help = (
+        "Report the per move cost of each g-code move transform")
+    def cmd_MOVE_TRANSFORM_STATS(self, gcmd):
+        enable = gcmd.get_int('ENABLE', None, minval=0, maxval=1)
+        if enable is not None:
+            self.stage_stats = [] if enable else None
+            self._build_pipeline()
+        if self.move_sink is None:
+            raise gcmd.error("Printer not ready")
+        names = [type(f.__self__).__name__ for f in self.stage_funcs]
+        names.append(type(self.move_sink).__name__)
+        msg = ["Move transforms: %s" % (" -> ".join(names),)]
+        if self.stage_stats is None:
+            msg.append("Statistics disabled (use ENABLE=1)")
+        for name, count, total in self.stage_stats or []:
+            msg.append("%s: moves=%d time=%.6f per_move=%.3fus"
+                       % (name, count, total, total * 1000000. / max(1, count)))
+        if self.stage_stats:
+            msg.append("(the %s time includes all processing after it)"
+                       % (names[-1],))
+        gcmd.respond_info("\n".join(msg))
 
 def load_config(config):
     return GCodeMove(config)
@@ -66,6 +66,8 @@ class PrinterSkew:
         return [skewed_x, skewed_y, pos[2], pos[3]]
     def get_position(self):
         return self.calc_unskew(self.next_transform.get_position())
+    def transform_position(self, newpos):
+        return self.calc_skew(newpos)
     def move(self, newpos, speed):
         corrected_pos = self.calc_skew(newpos)
         self.next_transform.move(corrected_pos, speed)
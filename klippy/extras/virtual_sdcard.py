@@ -3,10 +3,380 @@
 # Copyright (C) 2018-2024  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, sys, logging, io
+import os, sys, logging, io, struct, bisect, mmap, re, threading
 
 VALID_GCODE_EXTS = ['gcode', 'g', 'gco']
 
+
+######################################################################
+# G-Code file readers
+######################################################################
+
+# Each reader returns blocks of (size, line, params) entries in reverse
+# order, where "size" is the number of bytes the line occupies in the
+# source g-code file (including its newline).
+
+class TextFileReader:
+    def __init__(self, current_file, pos):
+        self.current_file = current_file
+        self.partial_input = ""
+        current_file.seek(pos)
+    def read(self):
+        data = self.current_file.read(8192)
+        if not data:
+            return None
+        lines = data.split('\n')
+        lines[0] = self.partial_input + lines[0]
+        self.partial_input = lines.pop()
+        lines.reverse()
+        if sys.version_info.major >= 3:
+            return [(len(line.encode()) + 1, line, None) for line in lines]
+        return [(len(line) + 1, line, None) for line in lines]
+    def close(self):
+        pass
+
+# Read g-code files via a memory map.  Line boundaries are found in
+# the mapped file (without re-encoding each line) and the kernel is
+# asked to prefetch the file ahead of the print position.  Accessing a
+# mapping of a file that has been truncated raises SIGBUS, so the file
+# is checked for changes before each read and, if it was modified, the
+# reader falls back to the TextFileReader code.
+MMAP_READ_SIZE = 65536
+
+class MmapFileReader:
+    def __init__(self, current_file, pos, read_ahead):
+        self.current_file = current_file
+        self.fileobj = io.open(current_file.name, 'rb')
+        try:
+            st = os.fstat(self.fileobj.fileno())
+            self.mm = mmap.mmap(self.fileobj.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+        except:
+            self.fileobj.close()
+            raise
+        self.file_stat = (st.st_size, st.st_mtime)
+        self.text_reader = None
+        self.pos = pos
+        self.read_ahead = read_ahead
+        self.prefetch_pos = pos & ~(mmap.PAGESIZE - 1)
+        self.can_madvise = hasattr(self.mm, 'madvise')
+        if self.can_madvise:
+            self.mm.madvise(mmap.MADV_SEQUENTIAL)
+            self._prefetch()
+    def _prefetch(self):
+        # Request more read-ahead once half the prior request is consumed
+        mm, pos = self.mm, self.pos
+        if pos + self.read_ahead // 2 < self.prefetch_pos:
+            return
+        start = pos & ~(mmap.PAGESIZE - 1)
+        end = min(pos + self.read_ahead, len(mm))
+        if end > start:
+            mm.madvise(mmap.MADV_WILLNEED, start, end - start)
+        self.prefetch_pos = end
+    def _check_file(self):
+        st = os.fstat(self.fileobj.fileno())
+        if (st.st_size, st.st_mtime) == self.file_stat:
+            return True
+        logging.info("virtual_sdcard: File modified during print - not"
+                     " using mmap (position %d)", self.pos)
+        self.close()
+        self.text_reader = TextFileReader(self.current_file, self.pos)
+        return False
+    def read(self):
+        if self.text_reader is not None or not self._check_file():
+            return self.text_reader.read()
+        mm, pos = self.mm, self.pos
+        if self.can_madvise:
+            self._prefetch()
+        end = mm.rfind(b'\n', pos, pos + MMAP_READ_SIZE)
+        if end < 0:
+            end = mm.find(b'\n', pos)
+            if end < 0:
+                # End of file (a final line without a newline is not run)
+                return None
+        data = mm[pos:end]
+        self.pos = end + 1
+        sizes = [len(rawline) + 1 for rawline in data.split(b'\n')]
+        entries = list(zip(sizes, data.decode().split('\n'),
+                           [None] * len(sizes)))
+        entries.reverse()
+        return entries
+    def close(self):
+        if self.text_reader is None:
+            self.mm.close()
+            self.fileobj.close()
+
+# Pre-parsed g-code files (as generated by scripts/preparse_gcode.py)
+# store one record per line of the source file.  Simple G0/G1 moves
+# are stored as binary floats, blank and comment lines are stored as
+# their length only, and all other lines are stored as text.  An
+# index of (source position, record position) pairs at the end of the
+# file allows seeking to any line of the source file.
+PARSED_EXT = '.parsed'
+PARSED_MAGIC = b'KGCP'
+PARSED_VERSION = 1
+PARSED_HEADER = struct.Struct('<4sIQd')
+PARSED_FOOTER = struct.Struct('<QQ4s')
+PARSED_RECORD = struct.Struct('<BI')
+PARSED_INDEX = struct.Struct('<QQ')
+PARSED_INDEX_INTERVAL = 1024
+PARSED_READ_SIZE = 65536
+REC_SKIP, REC_TEXT, REC_MOVE, REC_MOVE_G0 = 0x00, 0x01, 0x80, 0x20
+MOVE_AXES = 'XYZEF'
+
+def _build_move_types():
+    move_types = {}
+    for mask in range(1 << len(MOVE_AXES)):
+        axes = [a for i, a in enumerate(MOVE_AXES) if mask & (1 << i)]
+        fmt = struct.Struct('<' + 'd' * len(axes))
+        move_types[REC_MOVE | mask] = ('G1', axes, fmt)
+        move_types[REC_MOVE | REC_MOVE_G0 | mask] = ('G0', axes, fmt)
+    return move_types
+MOVE_TYPES = _build_move_types()
+
+class error(Exception):
+    pass
+
+class ParsedFileReader:
+    def __init__(self, fname, source_fname):
+        self.fileobj = f = io.open(fname, 'rb')
+        try:
+            magic, version, source_size, source_mtime = PARSED_HEADER.unpack(
+                f.read(PARSED_HEADER.size))
+            if magic != PARSED_MAGIC or version != PARSED_VERSION:
+                raise error("Not a pre-parsed g-code file")
+            st = os.stat(source_fname)
+            if source_size != st.st_size or source_mtime != st.st_mtime:
+                raise error("Pre-parsed file does not match source file")
+            f.seek(-PARSED_FOOTER.size, os.SEEK_END)
+            index_pos, index_count, magic = PARSED_FOOTER.unpack(
+                f.read(PARSED_FOOTER.size))
+            if magic != PARSED_MAGIC:
+                raise error("Pre-parsed file is truncated")
+            f.seek(index_pos)
+            data = f.read(index_count * PARSED_INDEX.size)
+            index = [PARSED_INDEX.unpack_from(data, i * PARSED_INDEX.size)
+                     for i in range(index_count)]
+        except:
+            f.close()
+            raise
+        self.index_source = [src for src, rec in index]
+        self.index_record = [rec for src, rec in index]
+        self.data_end = index_pos
+        self.partial = b""
+    def seek(self, pos):
+        # Seek to the record of the source line starting at "pos"
+        f = self.fileobj
+        i = bisect.bisect_right(self.index_source, pos) - 1
+        if i < 0:
+            return False
+        source_pos = self.index_source[i]
+        f.seek(self.index_record[i])
+        self.partial = b""
+        while source_pos < pos:
+            data = f.read(PARSED_RECORD.size)
+            if len(data) < PARSED_RECORD.size:
+                return False
+            rtype, size = PARSED_RECORD.unpack(data)
+            if rtype == REC_TEXT:
+                f.seek(size, os.SEEK_CUR)
+            elif rtype in MOVE_TYPES:
+                f.seek(MOVE_TYPES[rtype][2].size, os.SEEK_CUR)
+            source_pos += size + 1
+        return source_pos == pos and f.tell() <= self.data_end
+    def read(self):
+        f = self.fileobj
+        remaining = self.data_end - f.tell()
+        data = self.partial + f.read(min(PARSED_READ_SIZE, remaining))
+        if remaining <= 0 and not data:
+            return None
+        unpack_record = PARSED_RECORD.unpack_from
+        hsize = PARSED_RECORD.size
+        datalen = len(data)
+        entries = []
+        pos = 0
+        while pos + hsize <= datalen:
+            rtype, size = unpack_record(data, pos)
+            ppos = pos + hsize
+            if rtype == REC_SKIP:
+                entries.append((size + 1, None, None))
+                pos = ppos
+                continue
+            if rtype == REC_TEXT:
+                end = ppos + size
+                if end > datalen:
+                    break
+                entries.append((size + 1, data[ppos:end].decode(), None))
+                pos = end
+                continue
+            cmd, axes, fmt = MOVE_TYPES[rtype]
+            end = ppos + fmt.size
+            if end > datalen:
+                break
+            params = dict(zip(axes, fmt.unpack_from(data, ppos)))
+            entries.append((size + 1, cmd, params))
+            pos = end
+        self.partial = data[pos:]
+        if not entries and remaining <= 0:
+            raise error("Pre-parsed file is truncated")
+        entries.reverse()
+        return entries
+    def close(self):
+        self.fileobj.close()
+
+
+######################################################################
+# G-Code file index
+######################################################################
+
+# The index maps line numbers, layers, z heights, and exclude_object
+# markers to file offsets.  It is built in a background thread when a
+# seek first needs it and is kept in memory while the file is unchanged.
+# Small files are indexed immediately (without waiting on a thread).
+INDEX_LINE_INTERVAL = 1024
+INDEX_READ_SIZE = 1024 * 1024
+INDEX_INLINE_SIZE = 64 * 1024
+index_r = re.compile(
+    br'^[ \t]*(?:'
+    br';[ \t]*LAYER:[ \t]*(?P<layer>-?[0-9]+)'
+    br'|;[ \t]*(?P<layer_change>LAYER_CHANGE)'
+    br'|SET_PRINT_STATS_INFO[^\n;]*CURRENT_LAYER=(?P<current_layer>[0-9]+)'
+    br'|EXCLUDE_OBJECT_START[ \t]+NAME=(?P<object>"[^"\n]*"|[^\s;]+)'
+    br'|G[01](?![0-9.])[^\n;]*?[ \t]Z[ \t]*(?P<z>[-+]?[0-9]*\.?[0-9]+)'
+    br')', re.M | re.I)
+extrude_r = re.compile(
+    br'^[ \t]*G1(?![0-9.])(?=[^\n;]*[XY])[^\n;]*E[ \t]*[0-9.]', re.M | re.I)
+
+class GCodeFileIndex:
+    def __init__(self, fname):
+        self.fname = fname
+        st = os.stat(fname)
+        self.file_size, self.file_mtime = st.st_size, st.st_mtime
+        self.index = None
+        self.error = None
+        self.is_ready = False
+        if self.file_size <= INDEX_INLINE_SIZE:
+            self._bg_build()
+            return
+        self.bg_thread = threading.Thread(target=self._bg_build)
+        self.bg_thread.daemon = True
+        self.bg_thread.start()
+    def is_current(self, fname):
+        # Check if the index is for the given (unmodified) file
+        try:
+            st = os.stat(fname)
+        except OSError:
+            return False
+        return (fname == self.fname and st.st_size == self.file_size
+                and st.st_mtime == self.file_mtime)
+    def _bg_build(self):
+        try:
+            index = self._build()
+        except Exception as e:
+            logging.exception("virtual_sdcard index build")
+            self.error = str(e)
+            self.is_ready = True
+            return
+        self.index = index
+        self.is_ready = True
+        logging.info("virtual_sdcard: Indexed %s (%d lines, %d layers)",
+                     self.fname, index['line_count'], len(index['layers']))
+    def _build(self):
+        lines, z_heights, objects = [], [], {}
+        layers = {'current_layer': [], 'layer': [], 'layer_change': []}
+        # Only note z heights that are extruded at (to skip z-hops)
+        def check_z(z_entry, chunk, start, end):
+            if extrude_r.search(chunk, start, end) is None:
+                return z_entry
+            if not z_heights or z_entry[0] > z_heights[-1][0]:
+                z_heights.append(z_entry)
+            return None
+        pending_z = None
+        f = io.open(self.fname, 'rb')
+        offset = 0
+        line_no = 1
+        partial = b""
+        while 1:
+            data = f.read(INDEX_READ_SIZE)
+            if not data:
+                break
+            data = partial + data
+            end = data.rfind(b'\n') + 1
+            chunk, partial = data[:end], data[end:]
+            # Note the offset of every INDEX_LINE_INTERVAL lines
+            chunk_lines = chunk.split(b'\n')
+            nlines = len(chunk_lines) - 1
+            i = -(line_no - 1) % INDEX_LINE_INTERVAL
+            pos = offset + sum(map(len, chunk_lines[:i])) + i
+            while i < nlines:
+                lines.append([line_no + i, pos])
+                next_lines = chunk_lines[i:i + INDEX_LINE_INTERVAL]
+                pos += sum(map(len, next_lines)) + len(next_lines)
+                i += INDEX_LINE_INTERVAL
+            # Note layer changes, z heights, and objects
+            cur_line, count_pos, z_pos = line_no, 0, 0
+            for m in index_r.finditer(chunk):
+                start = m.start()
+                cur_line += chunk.count(b'\n', count_pos, start)
+                count_pos = start
+                entry = [cur_line, offset + start]
+                kind = m.lastgroup
+                value = m.group(kind).decode()
+                if kind == 'z':
+                    if pending_z is not None:
+                        check_z(pending_z, chunk, z_pos, start)
+                    pending_z = [float(value)] + entry
+                    z_pos = m.end()
+                elif kind == 'object':
+                    objects.setdefault(value.strip('"'), []).append(entry)
+                elif kind == 'layer_change':
+                    layer_list = layers[kind]
+                    layer_list.append([len(layer_list)] + entry)
+                else:
+                    layers[kind].append([int(value)] + entry)
+            if pending_z is not None:
+                pending_z = check_z(pending_z, chunk, z_pos, len(chunk))
+            offset += end
+            line_no += nlines
+        f.close()
+        # Use the most specific layer information found in the file
+        for kind in ['current_layer', 'layer', 'layer_change']:
+            if layers[kind]:
+                break
+        return {'line_count': line_no - 1,
+                'lines': lines, 'layers': layers[kind],
+                'z_heights': z_heights, 'objects': objects}
+    def find_line(self, line_no):
+        # Return the file offset of the given line number (starting at 1)
+        lines = self.index['lines']
+        if line_no < 1 or line_no > self.index['line_count']:
+            return None
+        i = bisect.bisect_right(lines, [line_no, self.file_size]) - 1
+        cur_line, pos = lines[i]
+        f = io.open(self.fname, 'rb')
+        f.seek(pos)
+        while cur_line < line_no:
+            pos += len(f.readline())
+            cur_line += 1
+        f.close()
+        return pos
+    def find_layer(self, layer):
+        for entry_layer, line_no, pos in self.index['layers']:
+            if entry_layer == layer:
+                return pos
+        return None
+    def find_z(self, z):
+        # Return the file offset of the first move to (or above) height z
+        for entry_z, line_no, pos in self.index['z_heights']:
+            if entry_z >= z:
+                return pos
+        return None
+
+
+######################################################################
+# Virtual sdcard
+######################################################################
+
 class VirtualSD:
     def __init__(self, config):
         self.printer = config.get_printer()
@@ -16,13 +386,17 @@ class VirtualSD:
         sd = config.get('path')
         self.sdcard_dirname = os.path.normpath(os.path.expanduser(sd))
         self.current_file = None
+        self.parsed_fname = self.file_index = None
         self.file_position = self.file_size = 0
+        self.use_mmap = config.getboolean('use_mmap', False)
+        self.mmap_read_ahead = config.getint(
+            'mmap_read_ahead', 4 * 1024 * 1024, minval=MMAP_READ_SIZE)
         # Print Stat Tracking
         self.print_stats = self.printer.load_object(config, 'print_stats')
         # Work timer
         self.reactor = self.printer.get_reactor()
         self.must_pause_work = self.cmd_from_sd = False
-        self.next_file_position = 0
+        self.next_file_position = self.batch_position = 0
         self.work_timer = None
         # Error handling
         gcode_macro = self.printer.load_object(config, 'gcode_macro')
@@ -40,6 +414,9 @@ class VirtualSD:
         self.gcode.register_command(
             "SDCARD_PRINT_FILE", self.cmd_SDCARD_PRINT_FILE,
             desc=self.cmd_SDCARD_PRINT_FILE_help)
+        self.gcode.register_command(
+            "SDCARD_SEEK", self.cmd_SDCARD_SEEK,
+            desc=self.cmd_SDCARD_SEEK_help)
     def handle_shutdown(self):
         if self.work_timer is not None:
             self.must_pause_work = True
@@ -119,6 +496,7 @@ class VirtualSD:
             self.current_file.close()
             self.current_file = None
             self.print_stats.note_cancel()
+        self.parsed_fname = None
         self.file_position = self.file_size = 0
     # G-Code commands
     def cmd_error(self, gcmd):
@@ -128,6 +506,7 @@ class VirtualSD:
             self.do_pause()
             self.current_file.close()
             self.current_file = None
+        self.parsed_fname = None
         self.file_position = self.file_size = 0
         self.print_stats.reset()
         self.printer.send_event("virtual_sdcard:reset_file")
@@ -148,7 +527,50 @@ class VirtualSD:
         if filename[0] == '/':
             filename = filename[1:]
         self._load_file(gcmd, filename, check_subdirs=True)
+        params = gcmd.get_command_parameters()
+        if 'LINE' in params or 'LAYER' in params or 'Z' in params:
+            self.file_position = self._lookup_position(gcmd)
         self.do_resume()
+    cmd_SDCARD_SEEK_help = "Set the position in the loaded SD file from" \
+        " a line number, layer, or z height"
+    def cmd_SDCARD_SEEK(self, gcmd):
+        if self.work_timer is not None:
+            raise gcmd.error("SD busy")
+        self.file_position = self._lookup_position(gcmd)
+        gcmd.respond_info("SD position set to byte %d" % (self.file_position,))
+    def _get_file_index(self, gcmd):
+        if self.current_file is None:
+            raise gcmd.error("No SD file loaded")
+        file_index = self.file_index
+        fname = self.current_file.name
+        if file_index is None or not file_index.is_current(fname):
+            try:
+                self.file_index = file_index = GCodeFileIndex(fname)
+            except:
+                logging.exception("virtual_sdcard index")
+                raise gcmd.error("Unable to index SD file")
+        while not file_index.is_ready:
+            self.reactor.pause(self.reactor.monotonic() + .100)
+        if file_index.error is not None:
+            raise gcmd.error("Unable to index SD file: %s"
+                             % (file_index.error,))
+        return file_index
+    def _lookup_position(self, gcmd):
+        file_index = self._get_file_index(gcmd)
+        line_no = gcmd.get_int('LINE', None, minval=1)
+        layer = gcmd.get_int('LAYER', None)
+        z = gcmd.get_float('Z', None)
+        if line_no is not None:
+            pos = file_index.find_line(line_no)
+        elif layer is not None:
+            pos = file_index.find_layer(layer)
+        elif z is not None:
+            pos = file_index.find_z(z)
+        else:
+            raise gcmd.error("Must specify LINE, LAYER, or Z")
+        if pos is None:
+            raise gcmd.error("Requested position not found in SD file")
+        return pos
     def cmd_M20(self, gcmd):
         # List SD card
         files = self.get_file_list()
@@ -187,9 +609,24 @@ class VirtualSD:
         gcmd.respond_raw("File opened:%s Size:%d" % (filename, fsize))
         gcmd.respond_raw("File selected")
         self.current_file = f
+        self.parsed_fname = self._check_parsed_file(fname)
         self.file_position = 0
         self.file_size = fsize
         self.print_stats.set_current_file(filename)
+    def _check_parsed_file(self, fname):
+        parsed_fname = fname + PARSED_EXT
+        if not os.path.exists(parsed_fname):
+            return None
+        try:
+            ParsedFileReader(parsed_fname, fname).close()
+        except error as e:
+            logging.info("virtual_sdcard: Ignoring %s: %s", parsed_fname, e)
+            return None
+        except:
+            logging.exception("virtual_sdcard pre-parsed file open")
+            return None
+        logging.info("virtual_sdcard: Using pre-parsed file %s", parsed_fname)
+        return parsed_fname
     def cmd_M24(self, gcmd):
         # Start/resume SD print
         self.do_resume()
@@ -200,7 +637,13 @@ class VirtualSD:
         # Set SD position
         if self.work_timer is not None:
             raise gcmd.error("SD busy")
-        pos = gcmd.get_int('S', minval=0)
+        line_no = gcmd.get_int('L', None, minval=1)
+        if line_no is not None:
+            pos = self._get_file_index(gcmd).find_line(line_no)
+            if pos is None:
+                raise gcmd.error("Line %d not found in SD file" % (line_no,))
+        else:
+            pos = gcmd.get_int('S', minval=0)
         self.file_position = pos
     def cmd_M27(self, gcmd):
         # Report SD print status
@@ -216,55 +659,85 @@ class VirtualSD:
     def is_cmd_from_sd(self):
         return self.cmd_from_sd
     # Background work timer
+    def _open_reader(self, pos):
+        if self.parsed_fname is not None:
+            try:
+                reader = ParsedFileReader(self.parsed_fname,
+                                          self.current_file.name)
+            except:
+                logging.exception("virtual_sdcard pre-parsed file open")
+            else:
+                if reader.seek(pos):
+                    return reader
+                reader.close()
+                logging.info("virtual_sdcard: Position %d is not the start"
+                             " of a pre-parsed line", pos)
+        if self.use_mmap and self.file_size:
+            return MmapFileReader(self.current_file, pos, self.mmap_read_ahead)
+        return TextFileReader(self.current_file, pos)
+    def _finish_command(self):
+        self.cmd_from_sd = False
+        self.file_position = self.next_file_position
+    def _read_source_line(self, pos):
+        self.current_file.seek(pos)
+        return self.current_file.readline().rstrip('\n')
+    def _batch_commands(self, lines):
+        # Generate the commands to run from the pending lines (see
+        # GCodeDispatch.run_batch), stopping on a pause or file seek
+        while lines and not self.must_pause_work:
+            size, line, params = lines.pop()
+            self.batch_position = self.file_position + size
+            self.next_file_position = self.batch_position
+            if line is None and params is None:
+                # Empty line or comment
+                self.file_position = self.batch_position
+                continue
+            if params is not None and not self.gcode.can_run_parsed_move():
+                # G0/G1 is overridden - run the original line of the file
+                line, params = self._read_source_line(self.file_position), None
+            self.cmd_from_sd = True
+            yield line, params
+            self._finish_command()
+            if self.file_position != self.batch_position:
+                return
     def work_handler(self, eventtime):
         logging.info("Starting SD card print (position %d)", self.file_position)
         self.reactor.unregister_timer(self.work_timer)
         try:
-            self.current_file.seek(self.file_position)
+            reader = self._open_reader(self.file_position)
         except:
             logging.exception("virtual_sdcard seek")
             self.work_timer = None
             return self.reactor.NEVER
         self.print_stats.note_start()
+        self.batch_position = self.file_position
         gcode_mutex = self.gcode.get_mutex()
-        partial_input = ""
         lines = []
         error_message = None
         while not self.must_pause_work:
             if not lines:
                 # Read more data
                 try:
-                    data = self.current_file.read(8192)
+                    lines = reader.read()
                 except:
                     logging.exception("virtual_sdcard read")
                     break
-                if not data:
+                if lines is None:
                     # End of file
                     self.current_file.close()
                     self.current_file = None
                     logging.info("Finished SD card print")
                     self.gcode.respond_raw("Done printing file")
                     break
-                lines = data.split('\n')
-                lines[0] = partial_input + lines[0]
-                partial_input = lines.pop()
-                lines.reverse()
                 self.reactor.pause(self.reactor.NOW)
                 continue
             # Pause if any other request is pending in the gcode class
             if gcode_mutex.test():
                 self.reactor.pause(self.reactor.monotonic() + 0.100)
                 continue
-            # Dispatch command
-            self.cmd_from_sd = True
-            line = lines.pop()
-            if sys.version_info.major >= 3:
-                next_file_position = self.file_position + len(line.encode()) + 1
-            else:
-                next_file_position = self.file_position + len(line) + 1
-            self.next_file_position = next_file_position
+            # Dispatch a batch of commands
             try:
-                self.gcode.run_script(line)
+                self.gcode.run_batch(self._batch_commands(lines))
             except self.gcode.error as e:
                 error_message = str(e)
                 try:
@@ -275,18 +748,20 @@ class VirtualSD:
             except:
                 logging.exception("virtual_sdcard dispatch")
                 break
-            self.cmd_from_sd = False
-            self.file_position = self.next_file_position
+            if self.cmd_from_sd:
+                # Batch stopped early - complete the last command
+                self._finish_command()
             # Do we need to skip around?
-            if self.next_file_position != next_file_position:
+            if self.file_position != self.batch_position:
+                reader.close()
                 try:
-                    self.current_file.seek(self.file_position)
+                    reader = self._open_reader(self.file_position)
                 except:
                     logging.exception("virtual_sdcard seek")
                     self.work_timer = None
                     return self.reactor.NEVER
                 lines = []
-                partial_input = ""
+        reader.close()
         logging.info("Exiting SD card print (position %d)", self.file_position)
         self.work_timer = None
         self.cmd_from_sd = False
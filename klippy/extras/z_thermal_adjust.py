@@ -122,16 +122,18 @@ class ZThermalAdjuster:
         self.last_position = self.calc_adjust(position)
         return position
 
-    def move(self, newpos, speed):
+    def transform_position(self, newpos):
         # don't apply to extrude only moves or when disabled
         if (newpos[0:2] == self.last_position[0:2]) or not self.adjust_enable:
             z = newpos[2] + self.last_z_adjust_mm
             adjusted_pos = [newpos[0], newpos[1], z, newpos[3]]
-            self.next_transform.move(adjusted_pos, speed)
         else:
             adjusted_pos = self.calc_adjust(newpos)
-            self.next_transform.move(adjusted_pos, speed)
         self.last_position[:] = newpos
+        return adjusted_pos
+
+    def move(self, newpos, speed):
+        self.next_transform.move(self.transform_position(newpos), speed)
 
     def temperature_callback(self, read_time, temp):
         'Called everytime the Z adjust thermistor is read'
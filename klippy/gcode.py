@@ -8,6 +8,9 @@ import os, re, logging, collections, shlex
 class CommandError(Exception):
     pass
 
+BATCH_MAX_TIME = 0.050
+PARSED_MOVE_DIGITS = 9
+
 Coord = collections.namedtuple('Coord', ('x', 'y', 'z', 'e'))
 
 class GCodeCommand:
@@ -105,6 +108,8 @@ class GCodeDispatch:
         self.mux_commands = {}
         self.gcode_help = {}
         self.status_commands = {}
+        self.fast_move_handlers = None
+        self.fast_move = None
         # Register commands needed before config file is loaded
         handlers = ['M110', 'M112', 'M115',
                     'RESTART', 'FIRMWARE_RESTART', 'ECHO', 'STATUS', 'HELP']
@@ -157,6 +162,13 @@ class GCodeDispatch:
                 "mux command %s %s %s already registered (%s)" % (
                     cmd, key, value, prev_values))
         prev_values[value] = func
+    def register_fast_move(self, handler, fast_handler):
+        # Register an optimized handler for simple G0/G1 lines.  The
+        # fast_handler is passed a dictionary of pre-parsed float
+        # parameters.  It is only used while both G0 and G1 are
+        # registered to the given handler (ie, they are not overridden).
+        self.fast_move_handlers = (handler, fast_handler)
+        self._build_status_commands()
     def get_command_help(self):
         return dict(self.gcode_help)
     def get_status(self, eventtime):
@@ -167,6 +179,13 @@ class GCodeDispatch:
             if cmd in commands:
                 commands[cmd]['help'] = self.gcode_help[cmd]
         self.status_commands = commands
+        # Only use the G0/G1 fast path if those commands are not overridden
+        self.fast_move = None
+        if self.fast_move_handlers is not None:
+            handler, fast_handler = self.fast_move_handlers
+            if (self.gcode_handlers.get('G0') == handler
+                and self.gcode_handlers.get('G1') == handler):
+                self.fast_move = fast_handler
     def register_output_handler(self, cb):
         self.output_callbacks.append(cb)
     def _handle_shutdown(self):
@@ -185,48 +204,113 @@ class GCodeDispatch:
         self._respond_state("Ready")
     # Parse input into commands
     args_r = re.compile('([A-Z_]+|[A-Z*/])')
+    fast_move_r = re.compile(
+        r'G[01](?: +[XYZEF][-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+))* *$')
     def _process_commands(self, commands, need_ack=True):
+        fast_move_match = self.fast_move_r.match
         for line in commands:
             # Ignore comments and leading/trailing spaces
             line = origline = line.strip()
             cpos = line.find(';')
             if cpos >= 0:
                 line = line[:cpos]
-            # Break line into parts and determine command
-            parts = self.args_r.split(line.upper())
-            numparts = len(parts)
-            cmd = ""
-            if numparts >= 3 and parts[1] != 'N':
-                cmd = parts[1] + parts[2].strip()
-            elif numparts >= 5 and parts[1] == 'N':
-                # Skip line number at start of command
-                cmd = parts[3] + parts[4].strip()
-            # Build gcode "params" dictionary
-            params = { parts[i]: parts[i+1].strip()
-                       for i in range(1, numparts, 2) }
-            gcmd = GCodeCommand(self, cmd, origline, params, need_ack)
-            # Invoke handler for command
-            handler = self.gcode_handlers.get(cmd, self.cmd_default)
-            try:
-                handler(gcmd)
-            except self.error as e:
-                self._respond_error(str(e))
-                self.printer.send_event("gcode:command_error")
-                if not need_ack:
-                    raise
-            except:
-                msg = 'Internal error on command:"%s"' % (cmd,)
-                logging.exception(msg)
-                self.printer.invoke_shutdown(msg)
-                self._respond_error(msg)
-                if not need_ack:
-                    raise
-            gcmd.ack()
+            gcmd = None
+            # The fast path may be disabled by a prior command (eg, shutdown)
+            fast_move = self.fast_move
+            if fast_move is not None and fast_move_match(line) is not None:
+                # Simple G0/G1 move - skip generic parsing and GCodeCommand
+                params = {}
+                for p in line.split()[1:]:
+                    params[p[0]] = float(p[1:])
+                if params.get('F', 1.) > 0.:
+                    cmd = line[:2]
+                    handler = fast_move
+                    arg = params
+                else:
+                    gcmd = self._parse_command(origline, line, need_ack)
+            else:
+                gcmd = self._parse_command(origline, line, need_ack)
+            if gcmd is not None:
+                cmd = gcmd.get_command()
+                handler = self.gcode_handlers.get(cmd, self.cmd_default)
+                arg = gcmd
+            self._invoke_handler(cmd, handler, arg, need_ack)
+            if gcmd is not None:
+                gcmd.ack()
+            elif need_ack:
+                self.respond_raw("ok")
+    def _invoke_handler(self, cmd, handler, arg, need_ack):
+        try:
+            handler(arg)
+        except self.error as e:
+            self._respond_error(str(e))
+            self.printer.send_event("gcode:command_error")
+            if not need_ack:
+                raise
+        except:
+            msg = 'Internal error on command:"%s"' % (cmd,)
+            logging.exception(msg)
+            self.printer.invoke_shutdown(msg)
+            self._respond_error(msg)
+            if not need_ack:
+                raise
+    def _parse_command(self, origline, line, need_ack):
+        # Break line into parts and determine command
+        parts = self.args_r.split(line.upper())
+        numparts = len(parts)
+        cmd = ""
+        if numparts >= 3 and parts[1] != 'N':
+            cmd = parts[1] + parts[2].strip()
+        elif numparts >= 5 and parts[1] == 'N':
+            # Skip line number at start of command
+            cmd = parts[3] + parts[4].strip()
+        # Build gcode "params" dictionary
+        params = { parts[i]: parts[i+1].strip()
+                   for i in range(1, numparts, 2) }
+        return GCodeCommand(self, cmd, origline, params, need_ack)
     def run_script_from_command(self, script):
         self._process_commands(script.split('\n'), need_ack=False)
     def run_script(self, script):
         with self.mutex:
             self._process_commands(script.split('\n'), need_ack=False)
+    def _run_parsed_move(self, cmd, params):
+        fast_move = self.fast_move
+        if fast_move is None:
+            # G0/G1 overridden (or not ready) - use the generic path
+            # (with fixed point numbers, as "%r" may use an exponent)
+            line = " ".join([cmd] + ["%s%.*f" % (a, PARSED_MOVE_DIGITS, v)
+                                     for a, v in params.items()])
+            self._process_commands([line], need_ack=False)
+            return
+        self._invoke_handler(cmd, fast_move, params, False)
+    def can_run_parsed_move(self):
+        # Report if G0/G1 moves currently use the pre-parsed move handler
+        return self.fast_move is not None
+    def run_parsed_move(self, cmd, params):
+        # Run a G0/G1 move from already parsed (float) parameters
+        with self.mutex:
+            self._run_parsed_move(cmd, params)
+    def run_batch(self, commands):
+        # Run the (line, params) commands from the given iterator while
+        # holding the mutex.  A command with params is a G0/G1 move (see
+        # run_parsed_move), otherwise line is run as a script.  The batch
+        # stops early (releasing the mutex) if another task is waiting on
+        # the mutex or after BATCH_MAX_TIME.  Returns the number of
+        # commands run.
+        count = 0
+        with self.mutex:
+            reactor = self.printer.get_reactor()
+            end_time = reactor.monotonic() + BATCH_MAX_TIME
+            for line, params in commands:
+                if params is not None:
+                    self._run_parsed_move(line, params)
+                else:
+                    self._process_commands([line], need_ack=False)
+                count += 1
+                if (self.mutex.test_waiting()
+                    or reactor.monotonic() >= end_time):
+                    break
+        return count
     def get_mutex(self):
         return self.mutex
     def create_gcode_command(self, command, commandline, params):
@@ -366,6 +450,13 @@ class GCodeDispatch:
         gcmd.respond_info("\n".join(cmdhelp), log=False)
 
 # Support reading gcode from a pseudo-tty interface
+# Amount of pseudo-tty input to read at a time, and maximum amount of
+# unprocessed input to buffer before pausing reads.  The pending limit
+# is several reads in size so that reading is not paused after every
+# read while commands are being processed.
+INPUT_READ_SIZE = 8192
+INPUT_PENDING_BYTES = 4 * INPUT_READ_SIZE
+
 class GCodeIO:
     def __init__(self, printer):
         self.printer = printer
@@ -386,7 +477,12 @@ class GCodeIO:
                                                       self._process_data)
         self.partial_input = ""
         self.pending_commands = []
+        self.pending_bytes = 0
         self.bytes_read = 0
+        self.last_stats_time = self.reactor.monotonic()
+        self.last_stats_bytes = 0
+        self.stall_start = None
+        self.stall_time = 0.
         self.input_log = collections.deque([], 50)
     def _handle_ready(self):
         self.is_printer_ready = True
@@ -406,18 +502,20 @@ class GCodeIO:
         self._dump_debug()
         if self.is_fileinput:
             self.printer.request_exit('error_exit')
-    m112_r = re.compile('^(?:[nN][0-9]+)?\s*[mM]112(?:\s|$)')
+    m112_r = re.compile('^(?:[nN][0-9]+)?\s*[mM]112(?:\s|$)', re.M)
     def _process_data(self, eventtime):
         # Read input, separate by newline, and add to pending_commands
         try:
-            data = str(os.read(self.fd, 4096).decode())
+            data = str(os.read(self.fd, INPUT_READ_SIZE).decode())
         except (os.error, UnicodeDecodeError):
             logging.exception("Read g-code")
             return
         self.input_log.append((eventtime, data))
         self.bytes_read += len(data)
-        lines = data.split('\n')
-        lines[0] = self.partial_input + lines[0]
+        self.pending_bytes += len(data)
+        prev_len = len(self.partial_input)
+        text = self.partial_input + data
+        lines = text.split('\n')
         self.partial_input = lines.pop()
         pending_commands = self.pending_commands
         pending_commands.extend(lines)
@@ -431,21 +529,27 @@ class GCodeIO:
             pending_commands.append("")
         # Handle case where multiple commands pending
         if self.is_processing_data or len(pending_commands) > 1:
-            if len(pending_commands) < 20:
-                # Check for M112 out-of-order
-                for line in lines:
-                    if self.m112_r.match(line) is not None:
-                        self.gcode.cmd_M112(None)
+            # Check for M112 out-of-order (in a single scan of the newly
+            # read data).  A line started in an earlier read is only
+            # checked at its start.
+            end = len(text) - len(self.partial_input)
+            if ((prev_len and self.m112_r.match(text, 0, end) is not None)
+                or (text.find('112', prev_len, end) >= 0
+                    and self.m112_r.search(text, prev_len, end) is not None)):
+                self.gcode.cmd_M112(None)
             if self.is_processing_data:
-                if len(pending_commands) >= 20:
+                if (self.pending_bytes >= INPUT_PENDING_BYTES
+                    and self.fd_handle is not None):
                     # Stop reading input
                     self.reactor.unregister_fd(self.fd_handle)
                     self.fd_handle = None
+                    self.stall_start = eventtime
                 return
         # Process commands
         self.is_processing_data = True
         while pending_commands:
             self.pending_commands = []
+            self.pending_bytes = len(self.partial_input)
             with self.gcode_mutex:
                 self.gcode._process_commands(pending_commands)
             pending_commands = self.pending_commands
@@ -453,6 +557,10 @@ class GCodeIO:
         if self.fd_handle is None:
             self.fd_handle = self.reactor.register_fd(self.fd,
                                                       self._process_data)
+            if self.stall_start is not None:
+                curtime = self.reactor.monotonic()
+                self.stall_time += curtime - self.stall_start
+                self.stall_start = None
     def _respond_raw(self, msg):
         if self.pipe_is_active:
             try:
@@ -461,7 +569,17 @@ class GCodeIO:
                 logging.exception("Write g-code response")
                 self.pipe_is_active = False
     def stats(self, eventtime):
-        return False, "gcodein=%d" % (self.bytes_read,)
+        stall_time = self.stall_time
+        if self.stall_start is not None:
+            stall_time += eventtime - self.stall_start
+        rate = 0.
+        if eventtime > self.last_stats_time:
+            rate = ((self.bytes_read - self.last_stats_bytes)
+                    / (eventtime - self.last_stats_time))
+        self.last_stats_time = eventtime
+        self.last_stats_bytes = self.bytes_read
+        return False, "gcodein=%d gcodein_rate=%.0f gcodein_stall=%.3f" % (
+            self.bytes_read, rate, stall_time)
 
 def add_early_printer_objects(printer):
     printer.add_object('gcode', GCodeDispatch(printer))
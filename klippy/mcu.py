@@ -573,6 +573,7 @@ class MCU:
         self._reserved_move_slots = 0
         self._stepqueues = []
         self._steppersync = None
+        self._steppersync_moves = 0
         self._flush_callbacks = []
         # Stats
         self._get_status_info = {}
@@ -737,10 +738,11 @@ class MCU:
         if move_count < self._reserved_move_slots:
             raise error("Too few moves available on MCU '%s'" % (self._name,))
         ffi_main, ffi_lib = chelper.get_ffi()
+        self._steppersync_moves = move_count - self._reserved_move_slots
         self._steppersync = ffi_main.gc(
             ffi_lib.steppersync_alloc(self._serial.get_serialqueue(),
                                       self._stepqueues, len(self._stepqueues),
-                                      move_count-self._reserved_move_slots),
+                                      self._steppersync_moves),
             ffi_lib.steppersync_free)
         ffi_lib.steppersync_set_time(self._steppersync, 0., self._mcu_freq)
         # Log config information
@@ -953,6 +955,14 @@ class MCU:
         if ret:
             raise error("Internal error in MCU '%s' stepcompress"
                         % (self._name,))
+    def get_move_queue_fill(self, print_time):
+        # Return the fraction of the mcu move queue in use at print_time
+        if self._steppersync is None:
+            return 0.
+        clock = max(0, self.print_time_to_clock(print_time))
+        pending = self._ffi_lib.steppersync_get_pending(self._steppersync,
+                                                        clock)
+        return pending / float(self._steppersync_moves)
     def check_active(self, print_time, eventtime):
         if self._steppersync is None:
             return
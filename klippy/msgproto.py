@@ -23,6 +23,12 @@ MESSAGE_SEQ_MASK = 0x0f
 MESSAGE_DEST = 0x10
 MESSAGE_SYNC = 0x7e
 
+MSGBLOCK_MAX_MSGID = 128
+MSGBLOCK_MAX_PARAMS = 16
+MSGBLOCK_PT_INT = 1
+MSGBLOCK_PT_BUFFER = 2
+MSGBLOCK_DATA_SIZE = 4096
+
 class error(Exception):
     pass
 
@@ -34,6 +40,19 @@ def crc16_ccitt(buf):
         crc = ((data << 8) | (crc >> 8)) ^ (data >> 4) ^ (data << 3)
     return [crc >> 8, crc & 0xff]
 
+# Load the C message block helpers (if they are available)
+CHelper = None
+def get_chelper():
+    global CHelper
+    if CHelper is None:
+        try:
+            import chelper
+            CHelper = chelper.get_ffi()
+        except Exception:
+            logging.debug("C message block helpers not available")
+            CHelper = ()
+    return CHelper
+
 class PT_uint32:
     is_int = True
     is_dynamic_string = False
@@ -107,12 +126,14 @@ class Enumeration:
         if tv is None:
             raise enumeration_error(self.enum_name, v)
         self.pt.encode(out, tv)
-    def parse(self, s, pos):
-        v, pos = self.pt.parse(s, pos)
+    def decode(self, v):
         tv = self.reverse_enums.get(v)
         if tv is None:
             tv = "?%d" % (v,)
-        return tv, pos
+        return tv
+    def parse(self, s, pos):
+        v, pos = self.pt.parse(s, pos)
+        return self.decode(v), pos
 
 MessageTypes = {
     '%u': PT_uint32(), '%i': PT_int32(),
@@ -159,6 +180,83 @@ def convert_msg_format(msgformat):
         msgformat = msgformat.replace(c, '%s')
     return msgformat
 
+# Code templates for the generated message encoders and decoders
+ENCODE_INT = """
+    v = params[%(i)d]
+    if v >= 0x60 or v < -0x20:
+        if v >= 0x3000 or v < -0x1000:
+            if v >= 0x180000 or v < -0x80000:
+                if v >= 0xc000000 or v < -0x4000000:
+                    out.append((v>>28) & 0x7f | 0x80)
+                out.append((v>>21) & 0x7f | 0x80)
+            out.append((v>>14) & 0x7f | 0x80)
+        out.append((v>>7) & 0x7f | 0x80)
+    out.append(v & 0x7f)"""
+ENCODE_OTHER = """
+    types[%(i)d].encode(out, params[%(i)d])"""
+PARSE_INT = """
+    c = s[pos]
+    pos += 1
+    v%(i)d = c
+    if c >= 0x60:
+        v%(i)d = c & 0x7f
+        if (c & 0x60) == 0x60:
+            v%(i)d |= -0x20
+        while c & 0x80:
+            c = s[pos]
+            pos += 1
+            v%(i)d = (v%(i)d<<7) | (c & 0x7f)%(unsigned)s"""
+PARSE_UNSIGNED = """
+        v%(i)d = int(v%(i)d & 0xffffffff)"""
+PARSE_BUFFER = """
+    l = s[pos]
+    v%(i)d = bytes(bytearray(s[pos+1:pos+l+1]))
+    pos += l + 1"""
+PARSE_OTHER = """
+    v%(i)d, pos = types[%(i)d].parse(s, pos)"""
+
+# Generate encode and parse functions specialized to a parameter list
+def build_codecs(msgid, param_names):
+    types = [t for name, t in param_names]
+    enc = ["def encode(params):\n    out = [%d]" % (msgid,)]
+    dec = ["def parse(s, pos):\n    pos += 1"]
+    res, vres = [], []
+    vpos = 1
+    for i, (name, t) in enumerate(param_names):
+        fmt = {'i': i, 'unsigned': ""}
+        if isinstance(t, Enumeration):
+            enc.append(ENCODE_OTHER % fmt)
+            dec.append(PARSE_OTHER % fmt)
+        elif t.is_int:
+            if not t.signed:
+                fmt['unsigned'] = PARSE_UNSIGNED % fmt
+            enc.append(ENCODE_INT % fmt)
+            dec.append(PARSE_INT % fmt)
+        else:
+            enc.append(ENCODE_OTHER % fmt)
+            dec.append(PARSE_BUFFER % fmt)
+        res.append("%s: v%d" % (repr(name), i))
+        # Conversion of values decoded by msgblock_decode_blocks()
+        pt = getattr(t, 'pt', t)
+        if pt.is_int:
+            v = "v[i+%d]" % (vpos,)
+            if pt.signed:
+                v = "((%s ^ 0x80000000) - 0x80000000)" % (v,)
+            vpos += 1
+        else:
+            v = "bytes(s[v[i+%d]:v[i+%d]+v[i+%d]])" % (vpos, vpos, vpos+1)
+            vpos += 2
+        if t is not pt:
+            v = "types[%d].decode(%s)" % (i, v)
+        vres.append("%s: %s" % (repr(name), v))
+    enc.append("\n    return out\n")
+    dec.append("\n    return {%s}, pos\n" % (", ".join(res),))
+    vdec = ("def parse_values(v, i, s):\n    return {%s}, i+%d\n"
+            % (", ".join(vres), vpos))
+    glbs = {'types': types}
+    exec("\n".join(["".join(enc), "".join(dec), vdec]), glbs)
+    return glbs['encode'], glbs['parse'], glbs['parse_values']
+
 class MessageFormat:
     def __init__(self, msgid, msgformat, enumerations={}):
         self.msgid = msgid
@@ -168,12 +266,13 @@ class MessageFormat:
         self.param_names = lookup_params(msgformat, enumerations)
         self.param_types = [t for name, t in self.param_names]
         self.name_to_type = dict(self.param_names)
+    def _build_codecs(self):
+        # Replace these methods with code generated for this message
+        self.encode, self.parse, self.parse_values = build_codecs(
+            self.msgid, self.param_names)
     def encode(self, params):
-        out = []
-        out.append(self.msgid)
-        for i, t in enumerate(self.param_types):
-            t.encode(out, params[i])
-        return out
+        self._build_codecs()
+        return self.encode(params)
     def encode_by_name(self, **params):
         out = []
         out.append(self.msgid)
@@ -181,12 +280,11 @@ class MessageFormat:
             t.encode(out, params[name])
         return out
     def parse(self, s, pos):
-        pos += 1
-        out = {}
-        for name, t in self.param_names:
-            v, pos = t.parse(s, pos)
-            out[name] = v
-        return out, pos
+        self._build_codecs()
+        return self.parse(s, pos)
+    def parse_values(self, v, i, s):
+        self._build_codecs()
+        return self.parse_values(v, i, s)
     def format_params(self, params):
         out = []
         for name, t in self.param_names:
@@ -238,10 +336,20 @@ class MessageParser:
         self.config = {}
         self.version = self.build_versions = ""
         self.raw_identify_data = ""
+        self.c_param_types = None
         self._init_messages(DefaultMessages)
     def _error(self, msg, *params):
         raise error(self.warn_prefix + (msg % params))
     def check_packet(self, s):
+        ffi = get_chelper()
+        if ffi:
+            ffi_main, ffi_lib = ffi
+            if not isinstance(s, (bytes, bytearray)):
+                s = bytearray(s)
+            need_sync = ffi_main.new('uint8_t *')
+            ret = ffi_lib.msgblock_check(
+                need_sync, ffi_main.from_buffer('uint8_t[]', s), len(s))
+            return max(-1, ret)
         if len(s) < MESSAGE_MIN:
             return 0
         msglen = s[MESSAGE_POS_LEN]
@@ -273,6 +381,68 @@ class MessageParser:
             if pos >= len(s)-MESSAGE_TRAILER_SIZE:
                 break
         return out
+    def _parse_block(self, s, out):
+        pos = MESSAGE_HEADER_SIZE
+        while pos < len(s) - MESSAGE_TRAILER_SIZE:
+            mid = self.messages_by_id.get(s[pos], self.unknown)
+            params, pos = mid.parse(s, pos)
+            params['#name'] = mid.name
+            out.append(params)
+    def _build_c_param_types(self, ffi_main):
+        pt = ffi_main.new('uint8_t[]', MSGBLOCK_MAX_MSGID * MSGBLOCK_MAX_PARAMS)
+        for msgid, mid in self.messages_by_id.items():
+            if (not isinstance(mid, MessageFormat)
+                or len(mid.param_types) >= MSGBLOCK_MAX_PARAMS):
+                continue
+            row = msgid * MSGBLOCK_MAX_PARAMS
+            pt[row] = len(mid.param_types) + 1
+            for i, t in enumerate(mid.param_types):
+                pt[row + i + 1] = MSGBLOCK_PT_INT
+                if t.is_dynamic_string:
+                    pt[row + i + 1] = MSGBLOCK_PT_BUFFER
+        return pt
+    def parse_blocks(self, data):
+        # Parse all the complete message blocks at the start of 'data'.
+        # Returns the messages and the number of bytes processed.
+        out = []
+        pos = 0
+        ffi = get_chelper()
+        if not ffi:
+            while 1:
+                l = self.check_packet(data[pos:pos+MESSAGE_MAX])
+                if l <= 0:
+                    return out, pos
+                self._parse_block(data[pos:pos+l], out)
+                pos += l
+        ffi_main, ffi_lib = ffi
+        if self.c_param_types is None:
+            self.c_param_types = self._build_c_param_types(ffi_main)
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytearray(data)
+        buf = ffi_main.from_buffer('uint8_t[]', data)
+        vals = ffi_main.new('uint32_t[]', MSGBLOCK_DATA_SIZE)
+        count = ffi_main.new('int *')
+        messages_by_id = self.messages_by_id
+        while 1:
+            newpos = ffi_lib.msgblock_decode_blocks(
+                self.c_param_types, buf, pos, len(data),
+                vals, MSGBLOCK_DATA_SIZE, count)
+            v = ffi_main.unpack(vals, count[0])
+            i = 0
+            while i < len(v):
+                mid = messages_by_id[v[i]]
+                params, i = mid.parse_values(v, i, data)
+                params['#name'] = mid.name
+                out.append(params)
+            if newpos != pos:
+                pos = newpos
+                continue
+            # Parse blocks that the C code does not support
+            l = self.check_packet(data[pos:pos+MESSAGE_MAX])
+            if l <= 0:
+                return out, pos
+            self._parse_block(data[pos:pos+l], out)
+            pos += l
     def format_params(self, params):
         name = params.get('#name')
         mid = self.messages_by_name.get(name)
@@ -294,7 +464,14 @@ class MessageParser:
         msglen = MESSAGE_MIN + len(cmd)
         seq = (seq & MESSAGE_SEQ_MASK) | MESSAGE_DEST
         out = [msglen, seq] + cmd
-        out.append(crc16_ccitt(out))
+        ffi = get_chelper()
+        if ffi:
+            ffi_main, ffi_lib = ffi
+            crc = ffi_lib.msgblock_crc16_ccitt(
+                ffi_main.new('uint8_t[]', out), len(out))
+            out.extend([crc >> 8, crc & 0xff])
+        else:
+            out.extend(crc16_ccitt(out))
         out.append(MESSAGE_SYNC)
         return out
     def _parse_buffer(self, value):
@@ -383,6 +560,7 @@ class MessageParser:
             if msgtag < -32 or msgtag > 95:
                 self._error("Multi-byte msgtag not supported")
             self.msgtag_by_format[msgformat] = msgtag
+            self.c_param_types = None
             msgid = msgtag & 0x7f
             if msgtype == 'output':
                 self.messages_by_id[msgid] = OutputFormat(msgid, msgformat)
@@ -30,16 +30,16 @@ def main():
             break
         data += bytearray(newdata)
         while 1:
+            msgs, l = mp.parse_blocks(data)
+            for params in msgs:
+                sys.stdout.write(mp.format_params(params) + '\n')
+            data = data[l:]
             l = mp.check_packet(data)
             if l == 0:
                 break
             if l < 0:
                 logging.error("Invalid data")
                 data = data[-l:]
-                continue
-            msgs = mp.dump(data[:l])
-            sys.stdout.write('\n'.join(msgs[1:]) + '\n')
-            data = data[l:]
 
 if __name__ == '__main__':
     main()
@@ -162,6 +162,9 @@ class MCU_stepper:
         return (data, count)
     def get_stepper_kinematics(self):
         return self._stepper_kinematics
+    def get_step_count(self):
+        ffi_main, ffi_lib = chelper.get_ffi()
+        return ffi_lib.stepcompress_get_step_count(self._stepqueue)
     def set_stepper_kinematics(self, sk):
         old_sk = self._stepper_kinematics
         mcu_pos = 0
@@ -211,7 +214,7 @@ class MCU_stepper:
         return old_tq
     def add_active_callback(self, cb):
         self._active_callbacks.append(cb)
-    def generate_steps(self, flush_time):
+    def check_active(self, flush_time):
         # Check for activity if necessary
         if self._active_callbacks:
             sk = self._stepper_kinematics
@@ -221,6 +224,8 @@ class MCU_stepper:
                 self._active_callbacks = []
                 for cb in cbs:
                     cb(ret)
+    def generate_steps(self, flush_time):
+        self.check_active(flush_time)
         # Generate steps
         sk = self._stepper_kinematics
         ret = self._itersolve_generate_steps(sk, flush_time)
@@ -3,8 +3,12 @@
 # Copyright (C) 2016-2024  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import math, logging, importlib
-import mcu, chelper, kinematics.extruder
+import math, logging, importlib, threading
+import mcu, chelper, stepper, kinematics.extruder
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 # Common suffixes: _d is distance (in mm), _v is velocity (in
 #   mm/second), _v2 is velocity squared (mm^2/s^2), _t is time (in
@@ -12,6 +16,12 @@ import mcu, chelper, kinematics.extruder
 
 # Class to track each move request
 class Move:
+    __slots__ = (
+        'toolhead', 'start_pos', 'end_pos', 'accel', 'junction_deviation',
+        'timing_callbacks', 'is_kinematic_move', 'axes_d', 'move_d', 'axes_r',
+        'min_move_t', 'max_start_v2', 'max_cruise_v2', 'delta_v2',
+        'max_smoothed_v2', 'smooth_delta_v2', 'start_v', 'cruise_v', 'end_v',
+        'accel_t', 'cruise_t', 'decel_t')
     def __init__(self, toolhead, start_pos, end_pos, speed):
         self.toolhead = toolhead
         self.start_pos = tuple(start_pos)
@@ -106,6 +116,31 @@ class Move:
         self.cruise_t = cruise_d / cruise_v
         self.decel_t = decel_d / ((end_v + cruise_v) * 0.5)
 
+# Track how long an operation takes using power of two buckets.  The
+# first bucket counts durations under 1us, bucket N counts durations
+# from 2**(N-1) to 2**N us, and the last bucket counts everything over.
+PERF_BUCKETS = 21
+
+class LatencyHistogram:
+    def __init__(self):
+        self.reset()
+    def reset(self):
+        self.count = 0
+        self.total_time = self.max_time = self.interval_max = 0.
+        self.buckets = [0] * PERF_BUCKETS
+    def note(self, duration):
+        self.count += 1
+        self.total_time += duration
+        if duration > self.interval_max:
+            self.interval_max = duration
+            if duration > self.max_time:
+                self.max_time = duration
+        bucket = math.frexp(duration * 1000000.)[1]
+        self.buckets[max(0, min(bucket, PERF_BUCKETS - 1))] += 1
+    def get_status(self):
+        return {'count': self.count, 'total_time': self.total_time,
+                'max_time': self.max_time, 'buckets': list(self.buckets)}
+
 LOOKAHEAD_FLUSH_TIME = 0.250
 
 # Class to track a list of pending move requests and to facilitate
@@ -115,17 +150,70 @@ class LookAheadQueue:
         self.toolhead = toolhead
         self.queue = []
         self.junction_flush = LOOKAHEAD_FLUSH_TIME
+        self.monotonic = chelper.get_ffi()[1].get_monotonic
+        self.flush_perf = LatencyHistogram()
+        # State from the last lazy flush check that found no moves to flush
+        self.limited_index = None
+        self.limited_peaks = []
     def reset(self):
         del self.queue[:]
         self.junction_flush = LOOKAHEAD_FLUSH_TIME
+        self.limited_index = None
     def set_flush_time(self, flush_time):
         self.junction_flush = flush_time
     def get_last(self):
         if self.queue:
             return self.queue[-1]
         return None
-    def flush(self, lazy=False):
-        self.junction_flush = LOOKAHEAD_FLUSH_TIME
+    def _check_lazy_flush(self):
+        # Determine if flush(lazy=True) would flush any moves.  This runs
+        # the same smoothed_v2 backward pass as flush() (without
+        # calculating junction speeds) and finds the second "peak".
+        # When no moves can be flushed, the last move with a smoothed_v2
+        # limited by its own max_smoothed_v2 is noted.  The pass results
+        # before that move do not depend on any moves added later, so
+        # the next check only needs to traverse the moves after it.
+        queue = self.queue
+        stop_index = self.limited_index
+        if stop_index is None:
+            stop_index = 0
+        peaks = []
+        delayed = False
+        first_limited = None
+        next_smoothed_v2 = 0.
+        for i in range(len(queue)-1, stop_index-1, -1):
+            move = queue[i]
+            reachable_smoothed_v2 = next_smoothed_v2 + move.smooth_delta_v2
+            smoothed_v2 = min(move.max_smoothed_v2, reachable_smoothed_v2)
+            if smoothed_v2 < reachable_smoothed_v2:
+                if (smoothed_v2 + move.smooth_delta_v2 > next_smoothed_v2
+                    or delayed):
+                    if peaks and i:
+                        self.limited_index = None
+                        return True
+                    peaks.append(i)
+                    delayed = False
+                if first_limited is None:
+                    first_limited = i
+            else:
+                delayed = True
+            next_smoothed_v2 = smoothed_v2
+        if self.limited_index is not None:
+            # Add the peaks found before limited_index on a prior check
+            peaks.extend(self.limited_peaks)
+            if len(peaks) >= 2 and peaks[1]:
+                self.limited_index = None
+                return True
+        self.limited_index = first_limited
+        self.limited_peaks = [i for i in peaks if i < first_limited]
+        return False
+    def _plan_moves(self, lazy):
+        # Calculate junction speeds and return the number of moves
+        # that are ready to be flushed
+        if (lazy and self.limited_index is not None
+            and not self._check_lazy_flush()):
+            return 0
+        self.limited_index = None
         update_flush_count = lazy
         queue = self.queue
         flush_count = len(queue)
@@ -171,8 +259,20 @@ class LookAheadQueue:
             next_end_v2 = start_v2
             next_smoothed_v2 = smoothed_v2
         if update_flush_count or not flush_count:
+            if lazy:
+                # Note where the next lazy flush check can resume
+                self._check_lazy_flush()
+            return 0
+        return flush_count
+    def flush(self, lazy=False):
+        self.junction_flush = LOOKAHEAD_FLUSH_TIME
+        start_time = self.monotonic()
+        flush_count = self._plan_moves(lazy)
+        self.flush_perf.note(self.monotonic() - start_time)
+        if not flush_count:
             return
         # Generate step times for all moves ready to be flushed
+        queue = self.queue
         self.toolhead._process_moves(queue[:flush_count])
         # Remove processed moves from the queue
         del queue[:flush_count]
@@ -197,12 +297,173 @@ MOVE_BATCH_TIME = 0.500
 STEPCOMPRESS_FLUSH_TIME = 0.050
 SDS_CHECK_TIME = 0.001 # step+dir+step filter in stepcompress.c
 MOVE_HISTORY_EXPIRE = 30.
+MOVE_POOL_SIZE = 4096
 
 DRIP_SEGMENT_TIME = 0.050
 DRIP_TIME = 0.100
 class DripModeEndSignal(Exception):
     pass
 
+# Return the steppers behind a step generator (or None if not known)
+def get_handler_steppers(handler):
+    obj = getattr(handler, '__self__', None)
+    if hasattr(obj, 'get_steppers'):
+        return obj.get_steppers()
+    if hasattr(obj, 'get_stepper_kinematics'):
+        return [obj]
+    return None
+
+# Run itersolve step generation for independent steppers in parallel.
+# Each stepper has its own stepper_kinematics and stepcompress objects
+# and the C code does not hold the GIL, so the steps generated are
+# identical to calling each step generator in turn.
+class StepGenerationPool:
+    def __init__(self, num_threads):
+        ffi_main, ffi_lib = chelper.get_ffi()
+        self.itersolve_generate_steps = ffi_lib.itersolve_generate_steps
+        self.monotonic = ffi_lib.get_monotonic
+        self.handlers = []
+        self.serial_handlers = []
+        self.steppers = []
+        self.groups = [[]]
+        self.done_queue = queue.Queue()
+        self.work_queues = []
+        for i in range(num_threads):
+            work_queue = queue.Queue()
+            self.work_queues.append(work_queue)
+            self.groups.append([])
+            bg_thread = threading.Thread(target=self._bg_thread,
+                                         args=(i + 1, work_queue))
+            bg_thread.daemon = True
+            bg_thread.start()
+    def _bg_thread(self, index, work_queue):
+        while 1:
+            flush_time = work_queue.get(True)
+            if flush_time is None:
+                break
+            # Always post a result so the main thread does not block
+            try:
+                res = self._generate_group(index, flush_time)
+            except Exception as e:
+                logging.exception("Error in step generation thread")
+                res = e
+            self.done_queue.put(res)
+    def _generate_group(self, index, flush_time):
+        # Returns a list of (handler_index, error, duration) tuples
+        generate_steps = self.itersolve_generate_steps
+        monotonic = self.monotonic
+        res = []
+        for s, hidx in self.groups[index]:
+            start_time = monotonic()
+            ret = generate_steps(s.get_stepper_kinematics(), flush_time)
+            res.append((hidx, ret, monotonic() - start_time))
+        return res
+    def _setup_groups(self, handlers):
+        # Find the steppers behind each registered step generator.
+        # Handlers not bound to a stepper or rail are run serially.
+        self.handlers = list(handlers)
+        self.serial_handlers = []
+        self.steppers = []
+        for hidx, handler in enumerate(handlers):
+            steppers = get_handler_steppers(handler)
+            if steppers is None:
+                self.serial_handlers.append((handler, hidx))
+            else:
+                self.steppers.extend([(s, hidx) for s in steppers])
+        num_groups = len(self.groups)
+        self.groups = [self.steppers[i::num_groups]
+                       for i in range(num_groups)]
+    def generate_steps(self, handlers, flush_time, perfs):
+        if handlers != self.handlers:
+            self._setup_groups(handlers)
+        monotonic = self.monotonic
+        for sg, hidx in self.serial_handlers:
+            start_time = monotonic()
+            sg(flush_time)
+            perfs[hidx].note(monotonic() - start_time)
+        for s, hidx in self.steppers:
+            s.check_active(flush_time)
+        # Wake worker threads and generate the first group locally
+        active = [wq for i, wq in enumerate(self.work_queues)
+                  if self.groups[i + 1]]
+        for work_queue in active:
+            work_queue.put(flush_time)
+        results = []
+        try:
+            results.append(self._generate_group(0, flush_time))
+        finally:
+            # Collect the results of all workers (even on an error) so
+            # that they are not read by a later flush
+            results.extend([self.done_queue.get(True) for wq in active])
+        for res in results:
+            if isinstance(res, Exception):
+                raise res
+        # Note the time spent on each step generator (summed over the
+        # steppers of the generator)
+        durations = {}
+        is_error = False
+        for res in results:
+            for hidx, ret, duration in res:
+                durations[hidx] = durations.get(hidx, 0.) + duration
+                is_error |= not not ret
+        for hidx, duration in durations.items():
+            perfs[hidx].note(duration)
+        if is_error:
+            raise stepper.error("Internal error in stepcompress")
+    def stop(self):
+        for work_queue in self.work_queues:
+            work_queue.put(None)
+
+# Adaptive tuning of the toolhead buffering times.  The buffer times are
+# raised above their defaults by a margin based on the recently observed
+# reactor timer latency (which includes any host scheduling delays).
+ADAPT_CHECK_TIME = 0.250
+ADAPT_LATENCY_DECAY = 0.990
+ADAPT_LATENCY_MARGIN = 4.
+ADAPT_MARGIN_MAX = 1.000
+ADAPT_START_TIME_MIN = 0.100
+ADAPT_QUEUE_FULL = 0.900
+
+class BufferTimeController:
+    def __init__(self, toolhead):
+        self.toolhead = toolhead
+        self.printer = toolhead.printer
+        self.reactor = self.printer.get_reactor()
+        self.latency = self.queue_fill = 0.
+        self.next_check_time = 0.
+        self.printer.register_event_handler("klippy:ready",
+                                            self._handle_ready)
+    def _handle_ready(self):
+        self.next_check_time = self.reactor.monotonic() + ADAPT_CHECK_TIME
+        self.reactor.register_timer(self._check_event, self.next_check_time)
+    def _check_event(self, eventtime):
+        # Track a decaying peak of the delay in running this timer
+        latency = max(0., eventtime - self.next_check_time)
+        self.latency = max(latency, self.latency * ADAPT_LATENCY_DECAY)
+        # Check how much of each mcu move queue is in use
+        toolhead = self.toolhead
+        est_print_time = toolhead.mcu.estimated_print_time(eventtime)
+        self.queue_fill = max([m.get_move_queue_fill(est_print_time)
+                               for m in toolhead.all_mcus])
+        self._update_buffer_times()
+        self.next_check_time = eventtime + ADAPT_CHECK_TIME
+        return self.next_check_time
+    def _update_buffer_times(self):
+        toolhead = self.toolhead
+        margin = min(self.latency * ADAPT_LATENCY_MARGIN, ADAPT_MARGIN_MAX)
+        toolhead.buffer_time_start = ADAPT_START_TIME_MIN + margin
+        toolhead.bgflush_low_time = BGFLUSH_LOW_TIME + margin
+        if self.queue_fill < ADAPT_QUEUE_FULL:
+            # Don't queue further ahead if the mcu move queue is full
+            toolhead.buffer_time_low = BUFFER_TIME_LOW + margin
+            toolhead.buffer_time_high = BUFFER_TIME_HIGH + margin
+    def stats(self, eventtime):
+        toolhead = self.toolhead
+        return (" buffer_start=%.3f buffer_low=%.3f reactor_latency=%.4f"
+                " move_queue_fill=%.2f" % (
+                    toolhead.buffer_time_start, toolhead.buffer_time_low,
+                    self.latency, self.queue_fill))
+
 # Main code to track events (and their timing) on the printer toolhead
 class ToolHead:
     def __init__(self, config):
@@ -211,9 +472,18 @@ class ToolHead:
         self.all_mcus = [
             m for n, m in self.printer.lookup_objects(module='mcu')]
         self.mcu = self.all_mcus[0]
+        # Buffering times (may be tuned at runtime if adaptive)
+        self.buffer_time_low = BUFFER_TIME_LOW
+        self.buffer_time_high = BUFFER_TIME_HIGH
+        self.buffer_time_start = BUFFER_TIME_START
+        self.bgflush_low_time = BGFLUSH_LOW_TIME
+        self.buffer_controller = None
+        if config.getboolean('adaptive_buffer_time', False):
+            self.buffer_controller = BufferTimeController(self)
         self.lookahead = LookAheadQueue(self)
-        self.lookahead.set_flush_time(BUFFER_TIME_HIGH)
+        self.lookahead.set_flush_time(self.buffer_time_high)
         self.commanded_pos = [0., 0., 0., 0.]
+        self.move_pool = []
         # Velocity and acceleration control
         self.max_velocity = config.getfloat('max_velocity', above=0.)
         self.max_accel = config.getfloat('max_accel', above=0.)
@@ -259,6 +529,20 @@ class ToolHead:
         self.trapq_append = ffi_lib.trapq_append
         self.trapq_finalize_moves = ffi_lib.trapq_finalize_moves
         self.step_generators = []
+        self.step_pool = None
+        step_threads = config.getint('step_generation_threads', 0, minval=0)
+        if step_threads:
+            self.step_pool = StepGenerationPool(step_threads)
+            self.printer.register_event_handler("klippy:disconnect",
+                                                self.step_pool.stop)
+        # Flush and step generation timing
+        self.perf_stats = False
+        self.move_count = 0
+        self.process_moves_perf = LatencyHistogram()
+        self.step_generation_perf = LatencyHistogram()
+        self.step_generator_perf = []
+        self.trapq_finalize_perf = LatencyHistogram()
+        self.flush_moves_perf = [LatencyHistogram() for m in self.all_mcus]
         # Create kinematics class
         gcode = self.printer.lookup_object('gcode')
         self.Coord = gcode.Coord
@@ -282,6 +566,10 @@ class ToolHead:
                                self.cmd_SET_VELOCITY_LIMIT,
                                desc=self.cmd_SET_VELOCITY_LIMIT_help)
         gcode.register_command('M204', self.cmd_M204)
+        gcode.register_command('TOOLHEAD_PERF', self.cmd_TOOLHEAD_PERF,
+                               desc=self.cmd_TOOLHEAD_PERF_help)
+        webhooks = self.printer.lookup_object('webhooks')
+        webhooks.register_endpoint("toolhead/perf", self._handle_perf)
         self.printer.register_event_handler("klippy:shutdown",
                                             self._handle_shutdown)
         # Load some default modules
@@ -296,19 +584,33 @@ class ToolHead:
         sg_flush_want = min(flush_time + STEPCOMPRESS_FLUSH_TIME,
                             self.print_time - self.kin_flush_delay)
         sg_flush_time = max(sg_flush_want, flush_time)
-        for sg in self.step_generators:
-            sg(sg_flush_time)
+        monotonic = self.reactor.monotonic
+        start_time = monotonic()
+        if self.step_pool is not None:
+            self.step_pool.generate_steps(self.step_generators, sg_flush_time,
+                                          self.step_generator_perf)
+        else:
+            for sg, perf in zip(self.step_generators,
+                                self.step_generator_perf):
+                sg_start_time = monotonic()
+                sg(sg_flush_time)
+                perf.note(monotonic() - sg_start_time)
+        self.step_generation_perf.note(monotonic() - start_time)
         self.min_restart_time = max(self.min_restart_time, sg_flush_time)
         # Free trapq entries that are no longer needed
         clear_history_time = self.clear_history_time
         if not self.can_pause:
             clear_history_time = flush_time - MOVE_HISTORY_EXPIRE
         free_time = sg_flush_time - self.kin_flush_delay
+        start_time = monotonic()
         self.trapq_finalize_moves(self.trapq, free_time, clear_history_time)
         self.extruder.update_move_time(free_time, clear_history_time)
+        self.trapq_finalize_perf.note(monotonic() - start_time)
         # Flush stepcompress and mcu steppersync
-        for m in self.all_mcus:
+        for m, perf in zip(self.all_mcus, self.flush_moves_perf):
+            start_time = monotonic()
             m.flush_moves(flush_time, clear_history_time)
+            perf.note(monotonic() - start_time)
         self.last_flush_time = flush_time
     def _advance_move_time(self, next_print_time):
         pt_delay = self.kin_flush_delay + STEPCOMPRESS_FLUSH_TIME
@@ -325,12 +627,14 @@ class ToolHead:
         est_print_time = self.mcu.estimated_print_time(curtime)
         kin_time = max(est_print_time + MIN_KIN_TIME, self.min_restart_time)
         kin_time += self.kin_flush_delay
-        min_print_time = max(est_print_time + BUFFER_TIME_START, kin_time)
+        min_print_time = max(est_print_time + self.buffer_time_start, kin_time)
         if min_print_time > self.print_time:
             self.print_time = min_print_time
             self.printer.send_event("toolhead:sync_print_time",
                                     curtime, est_print_time, self.print_time)
     def _process_moves(self, moves):
+        start_time = self.reactor.monotonic()
+        self.move_count += len(moves)
         # Resync print_time if necessary
         if self.special_queuing_state:
             if self.special_queuing_state != "Drip":
@@ -354,6 +658,10 @@ class ToolHead:
                               + move.cruise_t + move.decel_t)
             for cb in move.timing_callbacks:
                 cb(next_move_time)
+        # Keep processed Move objects for reuse (see move())
+        move_pool = self.move_pool
+        move_pool.extend(moves[:MOVE_POOL_SIZE - len(move_pool)])
+        self.process_moves_perf.note(self.reactor.monotonic() - start_time)
         # Generate steps for moves
         if self.special_queuing_state:
             self._update_drip_move_time(next_move_time)
@@ -365,7 +673,7 @@ class ToolHead:
         self.lookahead.flush()
         self.special_queuing_state = "NeedPrime"
         self.need_check_pause = -1.
-        self.lookahead.set_flush_time(BUFFER_TIME_HIGH)
+        self.lookahead.set_flush_time(self.buffer_time_high)
         self.check_stall_time = 0.
     def flush_step_generation(self):
         self._flush_lookahead()
@@ -394,11 +702,11 @@ class ToolHead:
             if self.priming_timer is None:
                 self.priming_timer = self.reactor.register_timer(
                     self._priming_handler)
-            wtime = eventtime + max(0.100, buffer_time - BUFFER_TIME_LOW)
+            wtime = eventtime + max(0.100, buffer_time - self.buffer_time_low)
             self.reactor.update_timer(self.priming_timer, wtime)
         # Check if there are lots of queued moves and pause if so
         while 1:
-            pause_time = buffer_time - BUFFER_TIME_HIGH
+            pause_time = buffer_time - self.buffer_time_high
             if pause_time <= 0.:
                 break
             if not self.can_pause:
@@ -409,7 +717,8 @@ class ToolHead:
             buffer_time = self.print_time - est_print_time
         if not self.special_queuing_state:
             # In main state - defer pause checking until needed
-            self.need_check_pause = est_print_time + BUFFER_TIME_HIGH + 0.100
+            self.need_check_pause = (est_print_time + self.buffer_time_high
+                                     + 0.100)
     def _priming_handler(self, eventtime):
         self.reactor.unregister_timer(self.priming_timer)
         self.priming_timer = None
@@ -428,9 +737,9 @@ class ToolHead:
                 # In "main" state - flush lookahead if buffer runs low
                 print_time = self.print_time
                 buffer_time = print_time - est_print_time
-                if buffer_time > BUFFER_TIME_LOW:
+                if buffer_time > self.buffer_time_low:
                     # Running normally - reschedule check
-                    return eventtime + buffer_time - BUFFER_TIME_LOW
+                    return eventtime + buffer_time - self.buffer_time_low
                 # Under ran low buffer mark - flush lookahead queue
                 self._flush_lookahead()
                 if print_time != self.print_time:
@@ -442,9 +751,10 @@ class ToolHead:
                     self.do_kick_flush_timer = True
                     return self.reactor.NEVER
                 buffer_time = self.last_flush_time - est_print_time
-                if buffer_time > BGFLUSH_LOW_TIME:
-                    return eventtime + buffer_time - BGFLUSH_LOW_TIME
-                ftime = est_print_time + BGFLUSH_LOW_TIME + BGFLUSH_BATCH_TIME
+                if buffer_time > self.bgflush_low_time:
+                    return eventtime + buffer_time - self.bgflush_low_time
+                ftime = (est_print_time + self.bgflush_low_time
+                         + BGFLUSH_BATCH_TIME)
                 self._advance_flush_time(min(end_flush, ftime))
         except:
             logging.exception("Exception in flush_handler")
@@ -462,8 +772,15 @@ class ToolHead:
         self.kin.set_position(newpos, homing_axes)
         self.printer.send_event("toolhead:set_position")
     def move(self, newpos, speed):
-        move = Move(self, self.commanded_pos, newpos, speed)
+        move_pool = self.move_pool
+        if move_pool:
+            # Reinitialize a previously processed Move object
+            move = move_pool.pop()
+            move.__init__(self, self.commanded_pos, newpos, speed)
+        else:
+            move = Move(self, self.commanded_pos, newpos, speed)
         if not move.move_d:
+            move_pool.append(move)
             return
         if move.is_kinematic_move:
             self.kin.check_move(move)
@@ -507,10 +824,15 @@ class ToolHead:
             est_print_time = self.mcu.estimated_print_time(curtime)
             wait_time = self.print_time - est_print_time - flush_delay
             if wait_time > 0. and self.can_pause:
-                # Pause before sending more steps
+                # Sleep until more steps are needed or the endstop triggers
                 self.drip_completion.wait(curtime + wait_time)
                 continue
-            npt = min(self.print_time + DRIP_SEGMENT_TIME, next_print_time)
+            npt = self.print_time + DRIP_SEGMENT_TIME
+            if self.can_pause:
+                # Catch up in a single step generation pass if behind
+                npt = max(npt, est_print_time + flush_delay
+                          + DRIP_SEGMENT_TIME)
+            npt = min(npt, next_print_time)
             self.note_mcu_movequeue_activity(npt + self.kin_flush_delay,
                                              set_step_gen_time=True)
             self._advance_move_time(npt)
@@ -522,7 +844,7 @@ class ToolHead:
         self.need_check_pause = self.reactor.NEVER
         self.reactor.update_timer(self.flush_timer, self.reactor.NEVER)
         self.do_kick_flush_timer = False
-        self.lookahead.set_flush_time(BUFFER_TIME_HIGH)
+        self.lookahead.set_flush_time(self.buffer_time_high)
         self.check_stall_time = 0.
         self.drip_completion = drip_completion
         # Submit move
@@ -552,8 +874,75 @@ class ToolHead:
         is_active = buffer_time > -60. or not self.special_queuing_state
         if self.special_queuing_state == "Drip":
             buffer_time = 0.
-        return is_active, "print_time=%.3f buffer_time=%.3f print_stall=%d" % (
+        msg = "print_time=%.3f buffer_time=%.3f print_stall=%d" % (
             self.print_time, max(buffer_time, 0.), self.print_stall)
+        if self.buffer_controller is not None:
+            msg += self.buffer_controller.stats(eventtime)
+        if self.perf_stats:
+            msg += self._get_perf_stats()
+        return is_active, msg
+    # Flush and step generation timing
+    def _get_perf_histograms(self):
+        perf = {'lookahead_flush': self.lookahead.flush_perf,
+                'process_moves': self.process_moves_perf,
+                'step_generation': self.step_generation_perf,
+                'trapq_finalize': self.trapq_finalize_perf}
+        for sg, sg_perf in zip(self.step_generators, self.step_generator_perf):
+            obj = getattr(sg, '__self__', None)
+            if hasattr(obj, 'get_name'):
+                perf['step_generator:' + obj.get_name()] = sg_perf
+        for m, m_perf in zip(self.all_mcus, self.flush_moves_perf):
+            perf['flush_moves:' + m.get_name()] = m_perf
+        return perf
+    def _get_step_counts(self):
+        step_counts = {}
+        for sg in self.step_generators:
+            for s in get_handler_steppers(sg) or []:
+                step_counts[s.get_name()] = s.get_step_count()
+        return step_counts
+    def _get_perf_stats(self):
+        stages = [('lookahead', [self.lookahead.flush_perf]),
+                  ('process', [self.process_moves_perf]),
+                  ('stepgen', [self.step_generation_perf]),
+                  ('finalize', [self.trapq_finalize_perf]),
+                  ('flush', self.flush_moves_perf)]
+        msg = ""
+        for name, perfs in stages:
+            msg += " %s_max=%.6f" % (name, max([p.interval_max
+                                                for p in perfs]))
+            for p in perfs:
+                p.interval_max = 0.
+        return msg
+    def _handle_perf(self, web_request):
+        perf = self._get_perf_histograms()
+        web_request.send({
+            'histograms': {n: p.get_status() for n, p in perf.items()},
+            'move_count': self.move_count,
+            'step_counts': self._get_step_counts()})
+    cmd_TOOLHEAD_PERF_help = "Report toolhead flush and step generation timing"
+    def cmd_TOOLHEAD_PERF(self, gcmd):
+        perf = self._get_perf_histograms()
+        if gcmd.get_int('RESET', 0):
+            for p in perf.values():
+                p.reset()
+            self.move_count = 0
+        stats = gcmd.get_int('STATS', None, minval=0, maxval=1)
+        if stats is not None:
+            self.perf_stats = not not stats
+            for p in perf.values():
+                p.interval_max = 0.
+        msg = []
+        for name, p in sorted(perf.items()):
+            if not p.count:
+                continue
+            msg.append("%s: count=%d avg=%.6f max=%.6f"
+                       % (name, p.count, p.total_time / p.count, p.max_time))
+        msg.append("moves: %d" % (self.move_count,))
+        step_counts = self._get_step_counts()
+        if step_counts:
+            msg.append("steps: " + " ".join(
+                ["%s=%d" % (n, c) for n, c in sorted(step_counts.items())]))
+        gcmd.respond_info("\n".join(msg))
     def check_busy(self, eventtime):
         est_print_time = self.mcu.estimated_print_time(eventtime)
         lookahead_empty = not self.lookahead.queue
@@ -581,6 +970,7 @@ class ToolHead:
         return self.trapq
     def register_step_generator(self, handler):
         self.step_generators.append(handler)
+        self.step_generator_perf.append(LatencyHistogram())
     def note_step_generation_scan_time(self, delay, old_delay=0.):
         self.flush_step_generation()
         cur_delay = self.kin_flush_delay
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# Benchmark host g-code parsing and dispatch of a sliced file
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time, logging, io
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import reactor, klippy, configfile, configparser
+import extras.gcode_move, extras.gcode_arcs, extras.virtual_sdcard as vsd
+
+# Stand-in for the toolhead that records the requested moves
+class MoveSink:
+    def __init__(self):
+        self.count = 0
+        self.checksum = 0.
+    def get_position(self):
+        return [0., 0., 0., 0.]
+    def move(self, newpos, speed):
+        self.count += 1
+        self.checksum += sum(newpos) + speed
+
+def setup_printer(gcode_fname):
+    start_args = {'debuginput': gcode_fname, 'software_version': 'bench'}
+    printer = klippy.Printer(reactor.Reactor(), None, start_args)
+    sink = MoveSink()
+    printer.add_object('toolhead', sink)
+    fileconfig = configparser.RawConfigParser()
+    config = configfile.ConfigWrapper(printer, fileconfig, {}, 'gcode_move')
+    gcode_move = extras.gcode_move.load_config(config)
+    printer.add_object('gcode_move', gcode_move)
+    gcode_move.set_move_transform(sink)
+    printer.lookup_object('gcode')._handle_ready()
+    gcode_move._handle_ready()
+    return printer, sink
+
+def run_bench(gcode_fname, lines, use_fast_path):
+    printer, sink = setup_printer(gcode_fname)
+    gcode = printer.lookup_object('gcode')
+    if not use_fast_path:
+        gcode.fast_move_handlers = None
+        gcode._build_status_commands()
+    start_time = time.time()
+    gcode._process_commands(lines, need_ack=False)
+    duration = time.time() - start_time
+    return duration, sink.count, sink.checksum
+
+def open_reader(gcode_fname, reader_type):
+    f = io.open(gcode_fname, 'r', newline='')
+    if reader_type == 'text':
+        return vsd.TextFileReader(f, 0)
+    if reader_type == 'mmap':
+        return vsd.MmapFileReader(f, 0, 4 * 1024 * 1024)
+    reader = vsd.ParsedFileReader(gcode_fname + vsd.PARSED_EXT, gcode_fname)
+    reader.seek(0)
+    return reader
+
+def run_reader_bench(gcode_fname, reader_type):
+    reader = open_reader(gcode_fname, reader_type)
+    count = 0
+    start_time = time.time()
+    while 1:
+        entries = reader.read()
+        if entries is None:
+            break
+        count += len(entries)
+    duration = time.time() - start_time
+    reader.close()
+    return duration, count
+
+def run_arc_bench(resolution, arcs, use_batch):
+    printer, sink = setup_printer("/dev/null")
+    fileconfig = configparser.RawConfigParser()
+    fileconfig.add_section('gcode_arcs')
+    fileconfig.set('gcode_arcs', 'resolution', str(resolution))
+    config = configfile.ConfigWrapper(printer, fileconfig, {}, 'gcode_arcs')
+    extras.gcode_arcs.load_config(config)
+    gcode = printer.lookup_object('gcode')
+    gcode_move = printer.lookup_object('gcode_move')
+    if not use_batch:
+        # Emulate submitting each arc segment as a G1 command
+        def move_G1_batch(moves, feedrate=None):
+            for x, y, z, e in moves:
+                params = {'X': x, 'Y': y, 'Z': z}
+                if e is not None:
+                    params['E'] = e
+                if feedrate is not None:
+                    params['F'] = feedrate
+                gcmd = gcode.create_gcode_command("G1", "G1", params)
+                gcode_move.cmd_G1(gcmd)
+        gcode_move.move_G1_batch = move_G1_batch
+    lines = ["G90", "M83", "G1 X50 Y50 F6000"]
+    for i in range(arcs):
+        lines.append("G2 X60 Y50 E0.5 I5 J0")
+        lines.append("G3 X50 Y50 E0.5 I-5 J0")
+    start_time = time.time()
+    gcode._process_commands(lines, need_ack=False)
+    duration = time.time() - start_time
+    return duration, sink.count, sink.checksum
+
+def main():
+    usage = "%prog [options] <gcode file>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-r", "--repeat", type="int", dest="repeat", default=3,
+                    help="number of times to run each benchmark")
+    opts.add_option("-a", "--arc-resolution", type="float", dest="arc_res",
+                    default=0.1, help="gcode_arcs resolution for arc benchmark")
+    options, args = opts.parse_args()
+    if len(args) != 1:
+        opts.error("Incorrect number of arguments")
+    gcode_fname = args[0]
+    logging.disable(logging.CRITICAL)
+
+    f = open(gcode_fname, 'r')
+    lines = f.read().split('\n')
+    f.close()
+
+    results = {}
+    for name, use_fast_path in [("generic", False), ("fast path", True)]:
+        best = None
+        for i in range(options.repeat):
+            res = run_bench(gcode_fname, lines, use_fast_path)
+            if best is None or res[0] < best[0]:
+                best = res
+        results[name] = best
+        duration, count, checksum = best
+        print("%-10s: %d lines in %.3fs (%.0f lines/sec, %d moves)"
+              % (name, len(lines), duration, len(lines) / duration, count))
+    generic, fast = results["generic"], results["fast path"]
+    if generic[1:] != fast[1:]:
+        print("ERROR: fast path moves do not match generic path moves")
+        sys.exit(-1)
+    print("speedup   : %.2fx" % (generic[0] / fast[0],))
+
+    # Benchmark virtual_sdcard file readers
+    fsize = os.path.getsize(gcode_fname)
+    reader_types = ['text', 'mmap']
+    if os.path.exists(gcode_fname + vsd.PARSED_EXT):
+        reader_types.append('pre-parsed')
+    for reader_type in reader_types:
+        duration, count = min([run_reader_bench(gcode_fname, reader_type)
+                               for i in range(options.repeat)])
+        print("%-10s: %d lines read in %.3fs (%.0f lines/sec, %.1f MB/sec)"
+              % (reader_type, count, duration, count / duration,
+                 fsize / duration / 1000000.))
+
+    # Benchmark G2/G3 arc segmentation
+    results = {}
+    for name, use_batch in [("arc G1", False), ("arc batch", True)]:
+        best = min([run_arc_bench(options.arc_res, 500, use_batch)
+                    for i in range(options.repeat)])
+        results[name] = best
+        duration, count, checksum = best
+        print("%-10s: %d segments in %.3fs (%.0f segments/sec)"
+              % (name, count, duration, count / duration))
+    legacy, batch = results["arc G1"], results["arc batch"]
+    if legacy[1:] != batch[1:]:
+        print("ERROR: arc batch moves do not match arc G1 moves")
+        sys.exit(-1)
+    print("speedup   : %.2fx" % (legacy[0] / batch[0],))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# Benchmark host step generation for each kinematics type
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time, math
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import chelper
+from extras import shaper_defs
+
+MOVE_BATCH_TIME = 0.500
+ACCEL = 3000.
+EXTRUDE_RATIO = .0333
+
+# Wrap a stepper kinematics with an input shaper
+def setup_input_shaper(sk, axis, shaper_type, shaper_freq):
+    ffi_main, ffi_lib = chelper.get_ffi()
+    shapers = {s.name: s.init_func for s in shaper_defs.INPUT_SHAPERS}
+    A, T = shapers[shaper_type](shaper_freq, shaper_defs.DEFAULT_DAMPING_RATIO)
+    is_sk = ffi_main.gc(ffi_lib.input_shaper_alloc(), ffi_lib.free)
+    ffi_lib.input_shaper_set_sk(is_sk, sk)
+    ffi_lib.input_shaper_set_shaper_params(is_sk, axis, len(A), A, T)
+    return is_sk
+
+# Stepper kinematics to benchmark:
+#   (name, extruder, [(alloc_func, args, step_dist, [(setup_func, args)])])
+# A setup_func is either a stepper kinematics function or a python
+# function that returns a replacement stepper kinematics
+def get_kinematics():
+    arm2 = 300.**2
+    towers = [(math.cos(math.radians(a)) * 140.,
+               math.sin(math.radians(a)) * 140.) for a in [210., 330., 90.]]
+    rotary_step = 2. * math.pi / (200. * 16. * (107. / 16.) * (60. / 16.))
+    anchors = [(-200., -200., 400.), (200., -200., 400.),
+               (200., 200., 400.), (-200., 200., 400.)]
+    return [
+        ('cartesian', False, [('cartesian_stepper_alloc', (b'x',), .0125, []),
+                              ('cartesian_stepper_alloc', (b'y',), .0125, [])]),
+        ('delta', False, [('delta_stepper_alloc', (arm2, tx, ty), .01, [])
+                          for tx, ty in towers]),
+        ('rotary_delta', False, [('rotary_delta_stepper_alloc',
+                                  (33.9, 412.9, math.radians(a), 170., 320.),
+                                  rotary_step, []) for a in [30., 150., 270.]]),
+        ('winch', False, [('winch_stepper_alloc', a, .0125, [])
+                          for a in anchors]),
+        ('polar', False, [('polar_stepper_alloc', (b'r',), .0125, []),
+                          ('polar_stepper_alloc', (b'a',),
+                           2. * math.pi / (200. * 16. * 4.), [])]),
+        ('shaper_mzv', False,
+         [('cartesian_stepper_alloc', (a,), .0125,
+           [(setup_input_shaper, (a, 'mzv', 50.))]) for a in [b'x', b'y']]),
+        ('shaper_3hump_ei', False,
+         [('cartesian_stepper_alloc', (a,), .0125,
+           [(setup_input_shaper, (a, '3hump_ei', 50.))])
+          for a in [b'x', b'y']]),
+        ('extruder', True, [('extruder_stepper_alloc', (), .0025,
+                             [('extruder_set_pressure_advance', (.05, st))])
+                            for st in [.040, .200]]),
+    ]
+
+# Generate a path of circle segments followed by stop-and-go zig-zags
+def gen_moves(count, speed):
+    moves = []
+    radius, cx, cy, z = 40., 20., 10., 20.
+    seg_count = count // 2
+    pos = (cx + radius, cy, z)
+    for i in range(1, seg_count + 1):
+        angle = 2. * math.pi * 5. * i / seg_count
+        npos = (cx + radius * math.cos(angle), cy + radius * math.sin(angle),
+                z + .2 * i / seg_count)
+        moves.append((pos, npos, speed, i == 1, i == seg_count))
+        pos = npos
+    for i in range(count - seg_count):
+        npos = (cx + 5. * (-1)**i, cy + 30. * i / count, pos[2])
+        moves.append((pos, npos, speed, True, True))
+        pos = npos
+    return moves
+
+# Build a trapq from a list of moves (accelerating at the requested ends)
+def fill_trapq(ffi_lib, trapq, moves, extruder):
+    print_time = 2.
+    extrude_pos = 0.
+    for start_pos, end_pos, speed, do_accel, do_decel in moves:
+        axes_d = [e - s for s, e in zip(start_pos, end_pos)]
+        dist = math.sqrt(sum([d*d for d in axes_d]))
+        ramp_t = speed / ACCEL
+        ramp_d = .5 * speed * ramp_t
+        ramps = do_accel + do_decel
+        cruise_v = speed
+        if ramps * ramp_d > dist:
+            cruise_v = math.sqrt(dist * ACCEL / ramps)
+            ramp_t = cruise_v / ACCEL
+            ramp_d = .5 * cruise_v * ramp_t
+        accel_t = ramp_t if do_accel else 0.
+        decel_t = ramp_t if do_decel else 0.
+        cruise_t = (dist - ramps * ramp_d) / cruise_v
+        start_v = 0. if do_accel else cruise_v
+        if extruder:
+            # Extrude along the path (with the pressure advance flag set)
+            r = EXTRUDE_RATIO
+            ffi_lib.trapq_append(trapq, print_time, accel_t, cruise_t, decel_t,
+                                 extrude_pos, 0., 0., 1., 1., 0.,
+                                 start_v * r, cruise_v * r, ACCEL * r)
+            extrude_pos += dist * r
+        else:
+            ffi_lib.trapq_append(trapq, print_time, accel_t, cruise_t, decel_t,
+                                 start_pos[0], start_pos[1], start_pos[2],
+                                 axes_d[0] / dist, axes_d[1] / dist,
+                                 axes_d[2] / dist, start_v, cruise_v, ACCEL)
+        print_time += accel_t + cruise_t + decel_t
+    return print_time
+
+def run_bench(steppers, extruder, moves):
+    ffi_main, ffi_lib = chelper.get_ffi()
+    trapq = ffi_main.gc(ffi_lib.trapq_alloc(), ffi_lib.trapq_free)
+    end_time = fill_trapq(ffi_lib, trapq, moves, extruder)
+    start_pos = (0., 0., 0.) if extruder else moves[0][0]
+    sks = []
+    orig_sks = []
+    for oid, (alloc_func, args, step_dist, setup) in enumerate(steppers):
+        sc = ffi_main.gc(ffi_lib.stepcompress_alloc(oid),
+                         ffi_lib.stepcompress_free)
+        ffi_lib.stepcompress_fill(sc, 25, 1, 2)
+        sk = ffi_main.gc(getattr(ffi_lib, alloc_func)(*args), ffi_lib.free)
+        for setup_func, setup_args in setup:
+            if callable(setup_func):
+                orig_sks.append(sk)
+                sk = setup_func(sk, *setup_args)
+            else:
+                getattr(ffi_lib, setup_func)(sk, *setup_args)
+        ffi_lib.itersolve_set_stepcompress(sk, sc, step_dist)
+        ffi_lib.itersolve_set_trapq(sk, trapq)
+        ffi_lib.itersolve_set_position(sk, *start_pos)
+        sks.append((sk, sc))
+    sc_list = ffi_main.new('struct stepcompress *[]', [sc for sk, sc in sks])
+    ss = ffi_main.gc(ffi_lib.steppersync_alloc(ffi_main.NULL, sc_list,
+                                               len(sks), 1),
+                     ffi_lib.steppersync_free)
+    ffi_lib.steppersync_set_time(ss, 0., 16000000.)
+    start_time = time.time()
+    flush_time = 0.
+    while flush_time < end_time:
+        flush_time += MOVE_BATCH_TIME
+        for sk, sc in sks:
+            if ffi_lib.itersolve_generate_steps(sk, flush_time):
+                raise Exception("Internal error in stepcompress")
+    duration = time.time() - start_time
+    steps = [ffi_lib.stepcompress_get_step_count(sc) for sk, sc in sks]
+    positions = [ffi_lib.itersolve_get_commanded_pos(sk) for sk, sc in sks]
+    return duration, steps, positions
+
+def main():
+    usage = "%prog [options] [<kinematics>...]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-n", "--moves", type="int", dest="moves", default=10000,
+                    help="number of moves to run")
+    opts.add_option("-s", "--speed", type="float", dest="speed", default=300.,
+                    help="requested speed (in mm/s)")
+    opts.add_option("-r", "--repeat", type="int", dest="repeat", default=3,
+                    help="number of times to run each benchmark")
+    options, args = opts.parse_args()
+    moves = gen_moves(options.moves, options.speed)
+    for name, extruder, steppers in get_kinematics():
+        if args and name not in args:
+            continue
+        duration, steps, positions = min([run_bench(steppers, extruder, moves)
+                                          for i in range(options.repeat)])
+        total = sum(steps)
+        print("%-16s: %d steps in %.3fs (%.0f steps/sec) positions=%s"
+              % (name, total, duration, total / duration,
+                 ",".join(["%.6f" % (p,) for p in positions])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# Benchmark mcu message encoding and decoding
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time, json, logging, random, types
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import msgproto
+
+# Messages (and their relative frequency) of a sensor heavy config
+SENSOR_RESPONSES = [
+    ("sensor_bulk_data", 16), ("sensor_bulk_status", 1),
+    ("analog_in_state", 4), ("thermocouple_result", 2),
+    ("trsync_state", 1), ("endstop_state", 1),
+]
+SENSOR_COMMANDS = [
+    ("queue_step", 16), ("set_next_step_dir", 2), ("queue_digital_out", 4),
+    ("trsync_set_timeout", 1), ("update_digital_out", 1),
+]
+BULK_DATA_SIZE = 48
+
+
+######################################################################
+# Test data generation
+######################################################################
+
+def random_params(mid, rnd):
+    params = []
+    for t in mid.param_types:
+        if isinstance(t, msgproto.Enumeration):
+            params.append(rnd.choice(sorted(t.enums.keys())))
+        elif t.is_dynamic_string:
+            params.append(bytes(bytearray([rnd.randrange(256)
+                                           for i in range(BULK_DATA_SIZE)])))
+        elif t.max_length <= 2:
+            params.append(rnd.randrange(16))
+        elif t.max_length <= 3:
+            params.append(rnd.randrange(-0x8000 if t.signed else 0, 0x8000))
+        else:
+            params.append(rnd.randrange(0x80000000))
+    return params
+
+def build_messages(mp, msg_list, count):
+    rnd = random.Random(1)
+    choices = []
+    for name, weight in msg_list:
+        mid = mp.messages_by_name.get(name)
+        if mid is not None:
+            choices.extend([mid] * weight)
+    if not choices:
+        return []
+    out = []
+    for i in range(count):
+        mid = rnd.choice(choices)
+        out.append((mid, random_params(mid, rnd)))
+    return out
+
+def build_blocks(mp, msgs, per_block):
+    blocks = []
+    for i in range(0, len(msgs), per_block):
+        cmd = []
+        for mid, params in msgs[i:i+per_block]:
+            data = mid.encode(params)
+            if len(cmd) + len(data) > msgproto.MESSAGE_PAYLOAD_MAX:
+                blocks.append(bytearray(mp.encode(len(blocks), cmd)))
+                cmd = []
+            cmd.extend(data)
+        if cmd:
+            blocks.append(bytearray(mp.encode(len(blocks), cmd)))
+    return blocks
+
+
+######################################################################
+# Benchmark tests
+######################################################################
+
+# Generic message encoding and decoding (for comparison)
+def generic_encode(self, params):
+    out = []
+    out.append(self.msgid)
+    for i, t in enumerate(self.param_types):
+        t.encode(out, params[i])
+    return out
+
+def generic_parse(self, s, pos):
+    pos += 1
+    out = {}
+    for name, t in self.param_names:
+        v, pos = t.parse(s, pos)
+        out[name] = v
+    return out, pos
+
+def load_parser(dict_fname, generic):
+    mp = msgproto.MessageParser()
+    with open(dict_fname, 'rb') as f:
+        mp.process_identify(f.read(), decompress=False)
+    if generic:
+        for mid in mp.messages_by_id.values():
+            if isinstance(mid, msgproto.MessageFormat):
+                mid.encode = types.MethodType(generic_encode, mid)
+                mid.parse = types.MethodType(generic_parse, mid)
+    return mp
+
+def test_encode(mp, msgs):
+    start_time = time.time()
+    for mid, params in msgs:
+        mid.encode(params)
+    return time.time() - start_time, len(msgs)
+
+def test_parse(mp, blocks):
+    # Each response is in its own block (as received by serialhdl.py)
+    start_time = time.time()
+    for s in blocks:
+        mp.parse(s)
+    return time.time() - start_time, len(blocks)
+
+def test_capture(mp, data):
+    # Decode a buffer of message blocks (as done by parsedump.py)
+    start_time = time.time()
+    msgs, l = mp.parse_blocks(data)
+    return time.time() - start_time, len(msgs)
+
+def run_test(func, mp, data, options, generic):
+    if generic:
+        # Disable the C helpers for the generic test
+        msgproto.CHelper = ()
+    try:
+        # Report the fastest of several runs to reduce timing noise
+        duration, msgs = min([func(mp, data)
+                              for i in range(options.repeat)])
+    finally:
+        msgproto.CHelper = None
+    return {'messages': msgs, 'cpu_time': duration,
+            'rate': msgs / max(duration, .000001)}
+
+def run_bench(dict_fname, options):
+    mp = load_parser(dict_fname, False)
+    generic_mp = load_parser(dict_fname, True)
+    results = {}
+    for generic, p in [(True, generic_mp), (False, mp)]:
+        responses = build_messages(p, SENSOR_RESPONSES, options.count)
+        commands = build_messages(p, SENSOR_COMMANDS, options.count)
+        tests = [
+            ("encode", test_encode, commands),
+            ("parse", test_parse, build_blocks(p, responses, 1)),
+            ("capture", test_capture,
+             bytearray().join(build_blocks(p, responses, 4))),
+        ]
+        for name, func, data in tests:
+            if not data:
+                logging.info("%s: no sensor messages in dictionary", name)
+                continue
+            r = results.setdefault(name, {})
+            r['generic' if generic else 'compiled'] = run_test(
+                func, p, data, options, generic)
+    return results
+
+def report(results, baseline):
+    for name, r in sorted(results.items()):
+        g, c = r['generic'], r['compiled']
+        msg = ("%s: messages=%d generic=%.0f msgs/sec compiled=%.0f msgs/sec"
+               " (%.2fx)" % (name, c['messages'], g['rate'], c['rate'],
+                             c['rate'] / max(g['rate'], .000001)))
+        b = baseline.get(name)
+        if b is not None:
+            msg += "\n  vs baseline: compiled %+.1f%%" % (
+                100. * (c['rate'] / b['compiled']['rate'] - 1.),)
+        logging.info(msg)
+
+def main():
+    usage = "%prog [options] <dictionary>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-n", "--count", dest="count", type="int", default=20000,
+                    help="number of messages in each test (default 20000)")
+    opts.add_option("-o", "--output", dest="output",
+                    help="write results to a json file")
+    opts.add_option("-b", "--baseline", dest="baseline",
+                    help="compare against a previous json results file")
+    opts.add_option("-r", "--repeat", dest="repeat", type="int", default=5,
+                    help="runs per test, fastest is reported (default 5)")
+    options, args = opts.parse_args()
+    if len(args) != 1:
+        opts.error("Incorrect number of arguments")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    baseline = {}
+    if options.baseline is not None:
+        with open(options.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+    results = run_bench(args[0], options)
+    report(results, baseline)
+    if options.output is not None:
+        data = {'count': options.count, 'results': results}
+        with open(options.output, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# Benchmark the full host motion pipeline using klippy batch mode
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time, logging, json, resource, subprocess
+import tempfile, shutil
+TOPDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.append(os.path.join(TOPDIR, 'klippy'))
+
+DEFAULT_CONFIG = os.path.join(TOPDIR, "test/klippy/multi_z.cfg")
+DEFAULT_GCODE = [os.path.join(TOPDIR, "test/klippy/move.gcode")]
+
+# Stage timing histograms reported by the toolhead (see TOOLHEAD_PERF)
+STAGES = [('lookahead', 'lookahead_flush'), ('process', 'process_moves'),
+          ('stepgen', 'step_generation'), ('finalize', 'trapq_finalize'),
+          ('flush', 'flush_moves:')]
+
+
+######################################################################
+# Single benchmark run (invoked in a child process)
+######################################################################
+
+def get_rusage():
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return ru.ru_utime + ru.ru_stime, ru.ru_maxrss
+
+# Name of the mcu output file written by run_batch()
+BATCH_OUTPUT = "output"
+
+def run_batch(config_fname, gcode_fname, dictionaries, outdir, setup=None):
+    # Run a g-code file through klippy in batch mode (the mcu output is
+    # written to outdir).  The setup(printer) callback may register
+    # event handlers before the run.
+    import reactor, klippy, util
+    start_args = {'config_file': config_fname, 'start_reason': 'startup',
+                  'debuginput': gcode_fname,
+                  'debugoutput': os.path.join(outdir, BATCH_OUTPUT),
+                  'software_version': 'batch',
+                  'cpu_info': util.get_cpu_info()}
+    start_args.update(dictionaries)
+    debuginput = open(gcode_fname, 'rb')
+    try:
+        start_args['gcode_fd'] = debuginput.fileno()
+        printer = klippy.Printer(reactor.Reactor(), None, start_args)
+        if setup is not None:
+            setup(printer)
+        return printer.run()
+    finally:
+        debuginput.close()
+
+def run_single(config_fname, gcode_fname, dictionaries, outdir):
+    import webhooks
+    # Query the toolhead statistics (see the toolhead/perf endpoint)
+    # before the printer is torn down
+    stats = {}
+    def setup(printer):
+        def handle_disconnect():
+            wh = printer.lookup_object('webhooks')
+            web_request = webhooks.WebRequest(None, json.dumps(
+                {'id': 1, 'method': 'toolhead/perf'}))
+            try:
+                wh.get_callback('toolhead/perf')(web_request)
+            except webhooks.WebRequestError:
+                return
+            stats.update(web_request.response)
+        printer.register_event_handler("klippy:disconnect",
+                                       handle_disconnect)
+    start_cpu, start_rss = get_rusage()
+    start_time = time.time()
+    res = run_batch(config_fname, gcode_fname, dictionaries, outdir, setup)
+    duration = time.time() - start_time
+    end_cpu, peak_rss = get_rusage()
+    if res != 'exit' or not stats:
+        raise Exception("Klippy run of %s failed (%s)" % (gcode_fname, res))
+    output_bytes = sum([os.path.getsize(os.path.join(outdir, fname))
+                        for fname in os.listdir(outdir)])
+    steps = sum(stats['step_counts'].values())
+    cpu_time = end_cpu - start_cpu
+    # Summarize time spent in each pipeline stage
+    stage_cpu = {}
+    for name, prefix in STAGES:
+        stage_cpu[name] = sum([h['total_time']
+                               for n, h in stats['histograms'].items()
+                               if n.startswith(prefix)])
+    stage_cpu['other'] = max(0., cpu_time - sum(stage_cpu.values()))
+    moves = stats['move_count']
+    return {'moves': moves, 'steps': steps,
+            'output_bytes': output_bytes, 'wall_time': duration,
+            'cpu_time': cpu_time, 'peak_rss_kb': peak_rss,
+            'moves_per_sec': moves / cpu_time,
+            'steps_per_sec': steps / cpu_time,
+            'bytes_per_sec': output_bytes / cpu_time,
+            'stage_cpu': stage_cpu, 'step_counts': stats['step_counts'],
+            'histograms': stats['histograms']}
+
+def child_main(args):
+    config_fname, gcode_fname, dictionaries = json.loads(args)
+    logging.getLogger().setLevel(logging.WARNING)
+    outdir = tempfile.mkdtemp(prefix="benchpipe-")
+    try:
+        result = run_single(config_fname, gcode_fname, dictionaries, outdir)
+    finally:
+        shutil.rmtree(outdir)
+    sys.stdout.write(json.dumps(result))
+
+
+######################################################################
+# Benchmark driver
+######################################################################
+
+def run_child(config_fname, gcode_fname, dictionaries):
+    # Each run uses a fresh process so that peak RSS is per run
+    args = json.dumps([config_fname, gcode_fname, dictionaries])
+    proc = subprocess.Popen([sys.executable, os.path.realpath(__file__),
+                             "--child", args], stdout=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode:
+        raise Exception("Benchmark of %s failed" % (gcode_fname,))
+    return json.loads(out.decode())
+
+def run_bench(config_fname, gcode_fname, dictionaries, repeat):
+    # Report the fastest of several runs to reduce timing noise
+    best = None
+    for i in range(repeat):
+        result = run_child(config_fname, gcode_fname, dictionaries)
+        if best is not None:
+            for key in ('moves', 'steps'):
+                if result[key] != best[key]:
+                    raise Exception("Nondeterministic %s in %s"
+                                    % (key, gcode_fname))
+        if best is None or result['cpu_time'] < best['cpu_time']:
+            best = result
+    return best
+
+def report(name, result, baseline):
+    stages = " ".join(["%s=%.3f" % (n, result['stage_cpu'][n])
+                       for n, p in STAGES + [('other', None)]])
+    msg = ("%s: moves=%d steps=%d bytes=%d cpu=%.3fs rss=%dKiB\n"
+           "  moves/s=%.0f steps/s=%.0f bytes/s=%.0f\n  stages: %s"
+           % (name, result['moves'], result['steps'], result['output_bytes'],
+              result['cpu_time'], result['peak_rss_kb'],
+              result['moves_per_sec'], result['steps_per_sec'],
+              result['bytes_per_sec'], stages))
+    if baseline is not None:
+        deltas = ["%s %+.1f%%" % (key, 100. * (float(result[key])
+                                               / baseline[key] - 1.))
+                  for key in ('cpu_time', 'steps_per_sec', 'peak_rss_kb')
+                  if baseline.get(key)]
+        msg += "\n  vs baseline: %s" % (", ".join(deltas),)
+    logging.info(msg)
+
+def arg_dictionary(option, opt_str, value, parser):
+    key, fname = "dictionary", value
+    if '=' in value:
+        mcu_name, fname = value.split('=', 1)
+        key = "dictionary_" + mcu_name
+    parser.values.dictionary[key] = os.path.abspath(fname)
+
+def main():
+    usage = "%prog [options] -d <dictionary> [<config> <gcode>...]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-d", "--dictionary", dest="dictionary", type="string",
+                    action="callback", callback=arg_dictionary, default={},
+                    help="file to read for mcu protocol dictionary")
+    opts.add_option("-o", "--output", dest="output",
+                    help="write results to a json file")
+    opts.add_option("-b", "--baseline", dest="baseline",
+                    help="compare against a previous json results file")
+    opts.add_option("-r", "--repeat", dest="repeat", type="int", default=3,
+                    help="runs per file, fastest is reported (default 3)")
+    opts.add_option("--child", dest="child", help=optparse.SUPPRESS_HELP)
+    options, args = opts.parse_args()
+    if options.child is not None:
+        child_main(options.child)
+        return
+    if not options.dictionary:
+        opts.error("A mcu dictionary must be specified")
+    if len(args) == 1:
+        opts.error("Incorrect number of arguments")
+    config_fname, gcode_fnames = DEFAULT_CONFIG, DEFAULT_GCODE
+    if args:
+        config_fname, gcode_fnames = args[0], args[1:]
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    baseline = {}
+    if options.baseline is not None:
+        with open(options.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+    results = {}
+    for gcode_fname in gcode_fnames:
+        name = os.path.basename(gcode_fname)
+        result = run_bench(os.path.abspath(config_fname),
+                           os.path.abspath(gcode_fname), options.dictionary,
+                           options.repeat)
+        results[name] = result
+        report(name, result, baseline.get(name))
+    if options.output is not None:
+        data = {'config': os.path.basename(config_fname),
+                'python': sys.version.split()[0], 'results': results}
+        with open(options.output, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+if __name__ == '__main__':
+    main()
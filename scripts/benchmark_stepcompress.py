@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# Benchmark step compression using recorded step streams
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time, json, logging
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import chelper, msgproto
+
+HISTORY_CHUNK = 4096
+
+
+######################################################################
+# Step stream recording
+######################################################################
+
+# Extract the step times of each stepper from a batch mode output file
+def parse_serial(dict_fname, serial_fname):
+    mp = msgproto.MessageParser()
+    with open(dict_fname, 'rb') as f:
+        mp.process_identify(f.read(), decompress=False)
+    clock_freq = mp.get_constant_float('CLOCK_FREQ')
+    clocks, dirs, steppers = {}, {}, {}
+    def handle_msg(name, params):
+        oid = params.get('oid')
+        if name == 'reset_step_clock':
+            clocks[oid] = params['clock']
+        elif name == 'set_next_step_dir':
+            dirs[oid] = params['dir']
+        elif name == 'queue_step':
+            runs = steppers.setdefault(oid, [])
+            sdir = dirs.get(oid, 0)
+            if not runs or runs[-1][0] != sdir:
+                runs.append((sdir, []))
+            step_clocks = runs[-1][1]
+            clock, interval = clocks.get(oid, 0), params['interval']
+            for i in range(params['count']):
+                clock += interval
+                interval += params['add']
+                step_clocks.append(clock)
+            clocks[oid] = clock
+    with open(serial_fname, 'rb') as f:
+        data = bytearray(f.read())
+    while 1:
+        msgs, l = mp.parse_blocks(data)
+        for params in msgs:
+            handle_msg(params['#name'], params)
+        data = data[l:]
+        l = mp.check_packet(data)
+        if l >= 0:
+            break
+        data = data[-l:]
+    return clock_freq, steppers
+
+def record(dict_fname, serial_fname, out_fname):
+    clock_freq, steppers = parse_serial(dict_fname, serial_fname)
+    # Store step clocks as deltas to reduce the file size
+    out = {}
+    for oid, runs in steppers.items():
+        last_clock, druns = 0, []
+        for sdir, step_clocks in runs:
+            deltas = []
+            for clock in step_clocks:
+                deltas.append(clock - last_clock)
+                last_clock = clock
+            druns.append([sdir, deltas])
+        out[str(oid)] = druns
+    with open(out_fname, 'w') as f:
+        json.dump({'clock_freq': clock_freq, 'steppers': out}, f)
+    logging.info("Recorded %d steppers (%d steps) to %s", len(out),
+                 sum([len(s) for r in steppers.values() for d, s in r]),
+                 out_fname)
+
+
+######################################################################
+# Step compression benchmark
+######################################################################
+
+def load_stream(fname):
+    with open(fname, 'r') as f:
+        data = json.load(f)
+    ffi_main, ffi_lib = chelper.get_ffi()
+    steppers = {}
+    for oid, druns in data['steppers'].items():
+        last_clock, runs = 0, []
+        for sdir, deltas in druns:
+            step_clocks = []
+            for delta in deltas:
+                last_clock += delta
+                step_clocks.append(last_clock)
+            runs.append((sdir, ffi_main.new('uint64_t[]', step_clocks),
+                         len(step_clocks)))
+        steppers[int(oid)] = runs
+    return data['clock_freq'], steppers
+
+def count_messages(sc):
+    ffi_main, ffi_lib = chelper.get_ffi()
+    data = ffi_main.new('struct pull_history_steps[]', HISTORY_CHUNK)
+    end_clock, count = 2**64 - 1, 0
+    while 1:
+        res = ffi_lib.stepcompress_extract_old(sc, data, HISTORY_CHUNK,
+                                               0, end_clock)
+        count += res
+        if res < HISTORY_CHUNK:
+            return count
+        end_clock = data[res - 1].first_clock
+
+def run_stepper(runs, max_error):
+    ffi_main, ffi_lib = chelper.get_ffi()
+    sc = ffi_main.gc(ffi_lib.stepcompress_alloc(0), ffi_lib.stepcompress_free)
+    ffi_lib.stepcompress_fill(sc, max_error, 0, 0)
+    start_time = time.time()
+    for sdir, step_clocks, count in runs:
+        ret = ffi_lib.stepcompress_append_clocks(sc, sdir, step_clocks, count)
+        if ret:
+            raise Exception("Internal error in stepcompress")
+    if ffi_lib.stepcompress_reset(sc, 0):
+        raise Exception("Internal error in stepcompress")
+    duration = time.time() - start_time
+    return duration, ffi_lib.stepcompress_get_step_count(sc), count_messages(sc)
+
+def run_bench(fname, options):
+    clock_freq, steppers = load_stream(fname)
+    max_error = int(options.max_error * clock_freq)
+    results = {}
+    for oid, runs in sorted(steppers.items()):
+        # Report the fastest of several runs to reduce timing noise
+        duration, steps, msgs = min([run_stepper(runs, max_error)
+                                     for i in range(options.repeat)])
+        results[str(oid)] = {'steps': steps, 'messages': msgs,
+                             'cpu_time': duration}
+    return results
+
+def report(name, results, baseline):
+    for oid, r in sorted(results.items()):
+        msg = ("%s oid=%s: steps=%d messages=%d (%.1f steps/msg)"
+               " cpu=%.3fs (%.0f steps/sec)"
+               % (name, oid, r['steps'], r['messages'],
+                  float(r['steps']) / max(1, r['messages']), r['cpu_time'],
+                  r['steps'] / max(r['cpu_time'], .000001)))
+        b = baseline.get(oid)
+        if b is not None:
+            msg += "\n  vs baseline: messages %+d, cpu_time %+.1f%%" % (
+                r['messages'] - b['messages'],
+                100. * (r['cpu_time'] / b['cpu_time'] - 1.))
+        logging.info(msg)
+
+def main():
+    usage = ("%prog [options] <stepstream>...\n"
+             "   or: %prog -d <dictionary> -w <stepstream> <serial_output>")
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-d", "--dictionary", dest="dictionary",
+                    help="mcu dictionary of a batch mode output file")
+    opts.add_option("-w", "--write", dest="record",
+                    help="record a step stream from a batch mode output file")
+    opts.add_option("-e", "--max-error", dest="max_error", type="float",
+                    default=.000025, help="max_stepper_error (in seconds)")
+    opts.add_option("-o", "--output", dest="output",
+                    help="write results to a json file")
+    opts.add_option("-b", "--baseline", dest="baseline",
+                    help="compare against a previous json results file")
+    opts.add_option("-r", "--repeat", dest="repeat", type="int", default=3,
+                    help="runs per stream, fastest is reported (default 3)")
+    options, args = opts.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if options.record is not None:
+        if len(args) != 1 or options.dictionary is None:
+            opts.error("Recording requires a dictionary and an output file")
+        record(options.dictionary, args[0], options.record)
+        return
+    if not args:
+        opts.error("Incorrect number of arguments")
+    baseline = {}
+    if options.baseline is not None:
+        with open(options.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+    results = {}
+    for fname in args:
+        name = os.path.basename(fname)
+        results[name] = run_bench(fname, options)
+        report(name, results[name], baseline.get(name, {}))
+    if options.output is not None:
+        data = {'max_error': options.max_error, 'results': results}
+        with open(options.output, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+if __name__ == '__main__':
+    main()
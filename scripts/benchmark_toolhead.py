@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# Benchmark toolhead move creation and look-ahead processing
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time, math, gc, tracemalloc, random
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import toolhead, chelper
+
+class DummyKinematics:
+    def check_move(self, move):
+        pass
+
+class DummyExtruder:
+    def check_move(self, move):
+        pass
+    def calc_junction(self, prev_move, move):
+        return move.max_cruise_v2
+
+# Look-ahead queue that runs the full backward pass on every lazy flush
+class FullScanLookAheadQueue(toolhead.LookAheadQueue):
+    def _check_lazy_flush(self):
+        return True
+
+# Stand-in for the ToolHead class that runs the real ToolHead.move()
+# and LookAheadQueue code, but does not generate any steps
+class BenchToolHead:
+    move = toolhead.ToolHead.move
+    def __init__(self, use_pool, full_scan=False, record=False):
+        self.max_velocity = 300.
+        self.max_accel = 3000.
+        self.max_accel_to_decel = 1500.
+        scv2 = 5.**2
+        self.junction_deviation = scv2 * (math.sqrt(2.) - 1.) / self.max_accel
+        self.kin = DummyKinematics()
+        self.extruder = DummyExtruder()
+        if full_scan:
+            self.lookahead = FullScanLookAheadQueue(self)
+        else:
+            self.lookahead = toolhead.LookAheadQueue(self)
+        self.lookahead.set_flush_time(toolhead.BUFFER_TIME_HIGH)
+        self.commanded_pos = [0., 0., 0., 0.]
+        self.move_pool = []
+        self.use_pool = use_pool
+        self.print_time = 0.
+        self.need_check_pause = float('inf')
+        self.move_count = 0
+        self.move_time = 0.
+        self.record = None
+        if record:
+            self.record = []
+    def _process_moves(self, moves):
+        if self.record is not None:
+            self.record.append([(m.start_v, m.cruise_v, m.end_v, m.accel_t,
+                                 m.cruise_t, m.decel_t) for m in moves])
+        for move in moves:
+            self.move_time += move.accel_t + move.cruise_t + move.decel_t
+        self.move_count += len(moves)
+        if self.use_pool:
+            move_pool = self.move_pool
+            move_pool.extend(moves[:toolhead.MOVE_POOL_SIZE - len(move_pool)])
+
+def gen_moves(count, segment_len):
+    # Tiny segments around a circle (with extrusion)
+    radius = 50.
+    theta = segment_len / radius
+    return [[100. + radius * math.cos(i * theta),
+             100. + radius * math.sin(i * theta), 0.2, i * 0.002]
+            for i in range(count)]
+
+def gen_random_moves(count, seed):
+    # Random mix of tiny segments, long moves, and direction changes
+    rnd = random.Random(seed)
+    moves = []
+    x = y = e = 0.
+    angle = 0.
+    straight = 0
+    for i in range(count):
+        kind = rnd.random()
+        if straight:
+            # Long run of collinear tiny segments
+            straight -= 1
+            length = 0.02
+        elif kind < .01:
+            straight = rnd.randrange(100, 5000)
+            length = 0.02
+        elif kind < .7:
+            length = rnd.uniform(0.01, 0.5)
+            angle += rnd.uniform(-.2, .2)
+        elif kind < .9:
+            length = rnd.uniform(1., 50.)
+            angle += rnd.uniform(-math.pi, math.pi)
+        else:
+            length = rnd.uniform(0.1, 5.)
+            angle += math.pi
+        x += length * math.cos(angle)
+        y += length * math.sin(angle)
+        if rnd.random() < .8:
+            e += length * 0.03
+        speed = rnd.choice([5., 25., 100., 300., rnd.uniform(1., 400.)])
+        moves.append(([x, y, 0.2, e], speed))
+    return moves
+
+def run_lookahead_check(count, seed):
+    # Verify the incremental lazy flush check against the full backward
+    # pass by comparing every junction speed and every flush
+    moves = gen_random_moves(count, seed)
+    rnd = random.Random(seed)
+    max_accel = rnd.choice([10., 100., 500., 3000., 20000.])
+    accel_to_decel = max_accel * rnd.choice([.1, .5, 1.])
+    results = []
+    for full_scan in [False, True]:
+        th = BenchToolHead(True, full_scan=full_scan, record=True)
+        th.max_accel = max_accel
+        th.max_accel_to_decel = accel_to_decel
+        queue_sizes = []
+        for pos, speed in moves:
+            th.move(pos, speed)
+            queue_sizes.append(len(th.lookahead.queue))
+        th.lookahead.flush()
+        results.append((th.record, queue_sizes))
+    return results[0] == results[1]
+
+def gen_ramp_moves(count, segment_len):
+    # Tiny collinear segments (long acceleration ramps)
+    return [[i * segment_len, 0., 0., 0.] for i in range(count)]
+
+def run_bench(positions, speed, use_pool, full_scan=False,
+              accel_to_decel=None):
+    th = BenchToolHead(use_pool, full_scan)
+    if accel_to_decel is not None:
+        th.max_accel_to_decel = accel_to_decel
+    gc_before = [s['collections'] for s in gc.get_stats()]
+    start_time = time.time()
+    for pos in positions:
+        th.move(pos, speed)
+    th.lookahead.flush()
+    duration = time.time() - start_time
+    gc_after = [s['collections'] for s in gc.get_stats()]
+    gc_counts = [a - b for a, b in zip(gc_after, gc_before)]
+    return duration, gc_counts, th.move_count, th.move_time
+
+def run_memory(positions, speed, use_pool):
+    th = BenchToolHead(use_pool)
+    tracemalloc.start()
+    for pos in positions:
+        th.move(pos, speed)
+    th.lookahead.flush()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+# Minimal stand-in for stepper.MCU_stepper used by StepGenerationPool
+class BenchStepper:
+    def __init__(self, ffi_main, ffi_lib, oid, axis, trapq, use_linear=True):
+        self.stepqueue = ffi_main.gc(ffi_lib.stepcompress_alloc(oid),
+                                     ffi_lib.stepcompress_free)
+        ffi_lib.stepcompress_fill(self.stepqueue, 25, 1, 2)
+        self.sk = ffi_main.gc(ffi_lib.cartesian_stepper_alloc(axis),
+                              ffi_lib.free)
+        ffi_lib.itersolve_set_stepcompress(self.sk, self.stepqueue, .0025)
+        ffi_lib.itersolve_set_trapq(self.sk, trapq)
+        if not use_linear:
+            # Force use of the iterative solver
+            ffi_lib.itersolve_set_linear(self.sk, 0., 0., 0.)
+        self.generate = ffi_lib.itersolve_generate_steps
+    def get_stepper_kinematics(self):
+        return self.sk
+    def check_active(self, flush_time):
+        pass
+    def generate_steps(self, flush_time):
+        if self.generate(self.sk, flush_time):
+            raise Exception("Internal error in stepcompress")
+
+def run_stepgen_bench(positions, speed, num_steppers, pool, use_linear=True):
+    # Generate steps for several steppers following the same moves
+    ffi_main, ffi_lib = chelper.get_ffi()
+    th = BenchToolHead(True, record=True)
+    for pos in positions:
+        th.move(pos, speed)
+    th.lookahead.flush()
+    trapq = ffi_main.gc(ffi_lib.trapq_alloc(), ffi_lib.trapq_free)
+    print_time = pos = 0.
+    for move in [m for moves in th.record for m in moves]:
+        start_v, cruise_v, end_v, accel_t, cruise_t, decel_t = move
+        accel = th.max_accel
+        ffi_lib.trapq_append(trapq, print_time, accel_t, cruise_t, decel_t,
+                             pos, 0., 0., 1., 0., 0., start_v, cruise_v, accel)
+        print_time += accel_t + cruise_t + decel_t
+        pos += ((start_v + cruise_v) * .5 * accel_t + cruise_v * cruise_t
+                + (end_v + cruise_v) * .5 * decel_t)
+    steppers = [BenchStepper(ffi_main, ffi_lib, i, b'x', trapq, use_linear)
+                for i in range(num_steppers)]
+    sc_list = ffi_main.new('struct stepcompress *[]',
+                           [s.stepqueue for s in steppers])
+    ss = ffi_main.gc(ffi_lib.steppersync_alloc(ffi_main.NULL, sc_list,
+                                               len(steppers), 1),
+                     ffi_lib.steppersync_free)
+    ffi_lib.steppersync_set_time(ss, 0., 16000000.)
+    handlers = [s.generate_steps for s in steppers]
+    start_time = time.time()
+    flush_time = 0.
+    while flush_time < print_time:
+        flush_time = min(flush_time + toolhead.MOVE_BATCH_TIME,
+                         print_time + 1.)
+        if pool is None:
+            for sg in handlers:
+                sg(flush_time)
+        else:
+            pool.generate_steps(handlers, flush_time)
+    duration = time.time() - start_time
+    # Extract the generated steps for comparison
+    steps = []
+    data = ffi_main.new('struct pull_history_steps[]', 1000000)
+    for s in steppers:
+        count = ffi_lib.stepcompress_extract_old(s.stepqueue, data, 1000000,
+                                                 0, 1<<62)
+        steps.append([(d.first_clock, d.last_clock, d.start_position,
+                       d.step_count, d.interval, d.add)
+                      for d in data[0:count]])
+    return duration, steps
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-n", "--moves", type="int", dest="moves", default=200000,
+                    help="number of moves to run")
+    opts.add_option("-l", "--length", type="float", dest="length", default=0.1,
+                    help="length of each move (in mm)")
+    opts.add_option("-s", "--speed", type="float", dest="speed", default=100.,
+                    help="requested speed (in mm/s)")
+    opts.add_option("-r", "--repeat", type="int", dest="repeat", default=3,
+                    help="number of times to run each benchmark")
+    opts.add_option("-c", "--check", type="int", dest="check", default=20,
+                    help="number of random look-ahead sequences to verify")
+    opts.add_option("-t", "--threads", type="int", dest="threads", default=3,
+                    help="number of step generation worker threads")
+    opts.add_option("-k", "--steppers", type="int", dest="steppers",
+                    default=8, help="number of steppers for step generation")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    positions = gen_moves(options.moves, options.length)
+    results = {}
+    for name, use_pool in [("no pool", False), ("pool", True)]:
+        best = min([run_bench(positions, options.speed, use_pool)
+                    for i in range(options.repeat)])
+        results[name] = best
+        duration, gc_counts, count, move_time = best
+        peak = run_memory(positions[:20000], options.speed, use_pool)
+        print("%-8s: %d moves in %.3fs (%.0f moves/sec)"
+              " gc collections=%s peak memory (20000 moves)=%.1fKiB"
+              % (name, count, duration, count / duration,
+                 "/".join(["%d" % (c,) for c in gc_counts]), peak / 1024.))
+    if results["no pool"][2:] != results["pool"][2:]:
+        print("ERROR: pooled moves do not match unpooled moves")
+        sys.exit(-1)
+
+    # Benchmark and verify incremental look-ahead flush checks
+    for seed in range(options.check):
+        if not run_lookahead_check(5000, seed):
+            print("ERROR: look-ahead mismatch on random sequence %d" % (seed,))
+            sys.exit(-1)
+    print("look-ahead: %d random sequences match full scan" % (options.check,))
+    ramp_positions = gen_ramp_moves(options.moves, options.length)
+    results = {}
+    for name, full_scan in [("full scan", True), ("incremental", False)]:
+        best = min([run_bench(ramp_positions, options.speed, True, full_scan,
+                              accel_to_decel=1.)
+                    for i in range(options.repeat)])
+        results[name] = best
+        duration, gc_counts, count, move_time = best
+        print("%-11s: %d moves in %.3fs (%.0f moves/sec)"
+              % (name, count, duration, count / duration))
+    full, incr = results["full scan"], results["incremental"]
+    if full[2:] != incr[2:]:
+        print("ERROR: incremental look-ahead does not match full scan")
+        sys.exit(-1)
+    print("speedup    : %.2fx" % (full[0] / incr[0],))
+
+
+    # Benchmark and verify parallel step generation
+    stepgen_positions = positions[:20000]
+    serial = min([run_stepgen_bench(stepgen_positions, options.speed,
+                                    options.steppers, None)
+                  for i in range(options.repeat)])
+    pool = toolhead.StepGenerationPool(options.threads)
+    parallel = min([run_stepgen_bench(stepgen_positions, options.speed,
+                                      options.steppers, pool)
+                    for i in range(options.repeat)])
+    pool.stop()
+    if serial[1] != parallel[1]:
+        print("ERROR: parallel step generation does not match serial")
+        sys.exit(-1)
+    step_count = sum([d[3] for steps in serial[1] for d in steps])
+    for name, res in [("serial", serial), ("%d threads" % (options.threads,),
+                                           parallel)]:
+        print("%-11s: %d steps in %.3fs (%.0f steps/sec)"
+              % (name, step_count, res[0], step_count / res[0]))
+    print("speedup    : %.2fx" % (serial[0] / parallel[0],))
+
+    # Benchmark closed form step times against the iterative solver
+    iterative = min([run_stepgen_bench(stepgen_positions, options.speed,
+                                       options.steppers, None, False)
+                     for i in range(options.repeat)])
+    iter_count = sum([d[3] for steps in iterative[1] for d in steps])
+    if iter_count != step_count:
+        print("ERROR: closed form step count does not match iterative")
+        sys.exit(-1)
+    for name, res in [("iterative", iterative), ("closed form", serial)]:
+        print("%-11s: %d steps in %.3fs (%.0f steps/sec)"
+              % (name, step_count, res[0], step_count / res[0]))
+    print("speedup    : %.2fx" % (iterative[0] / serial[0],))
+
+if __name__ == '__main__':
+    main()
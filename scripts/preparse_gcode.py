@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Convert a g-code file into a pre-parsed file for virtual_sdcard
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, io
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import gcode
+from extras import virtual_sdcard as vsd
+
+fast_move_r = gcode.GCodeDispatch.fast_move_r
+
+def encode_line(raw):
+    # Encode one source line (without its newline) as a record
+    size = len(raw)
+    try:
+        line = raw.decode().strip()
+    except UnicodeDecodeError:
+        return vsd.PARSED_RECORD.pack(vsd.REC_TEXT, size) + raw
+    cpos = line.find(';')
+    if cpos >= 0:
+        line = line[:cpos]
+    if not line:
+        return vsd.PARSED_RECORD.pack(vsd.REC_SKIP, size)
+    if fast_move_r.match(line) is None:
+        return vsd.PARSED_RECORD.pack(vsd.REC_TEXT, size) + raw
+    # Parse the move in the same way as GCodeDispatch._process_commands()
+    params = {}
+    for p in line.split()[1:]:
+        params[p[0]] = float(p[1:])
+    if params.get('F', 1.) <= 0.:
+        return vsd.PARSED_RECORD.pack(vsd.REC_TEXT, size) + raw
+    rtype = vsd.REC_MOVE
+    if line.startswith('G0'):
+        rtype |= vsd.REC_MOVE_G0
+    for i, axis in enumerate(vsd.MOVE_AXES):
+        if axis in params:
+            rtype |= 1 << i
+    cmd, axes, fmt = vsd.MOVE_TYPES[rtype]
+    return (vsd.PARSED_RECORD.pack(rtype, size)
+            + fmt.pack(*[params[a] for a in axes]))
+
+def convert(source_fname, parsed_fname):
+    st = os.stat(source_fname)
+    infile = io.open(source_fname, 'rb')
+    tmp_fname = parsed_fname + ".tmp"
+    outfile = io.open(tmp_fname, 'wb')
+    outfile.write(vsd.PARSED_HEADER.pack(vsd.PARSED_MAGIC, vsd.PARSED_VERSION,
+                                         st.st_size, st.st_mtime))
+    index = []
+    counts = {'moves': 0, 'lines': 0}
+    source_pos = 0
+    for raw in infile:
+        if not raw.endswith(b'\n'):
+            # A final line without a newline is never run by virtual_sdcard
+            break
+        if not counts['lines'] % vsd.PARSED_INDEX_INTERVAL:
+            index.append((source_pos, outfile.tell()))
+        record = encode_line(raw[:-1])
+        if ord(record[:1]) & vsd.REC_MOVE:
+            counts['moves'] += 1
+        outfile.write(record)
+        counts['lines'] += 1
+        source_pos += len(raw)
+    index.append((source_pos, outfile.tell()))
+    index_pos = outfile.tell()
+    for entry in index:
+        outfile.write(vsd.PARSED_INDEX.pack(*entry))
+    outfile.write(vsd.PARSED_FOOTER.pack(index_pos, len(index),
+                                         vsd.PARSED_MAGIC))
+    infile.close()
+    outfile.close()
+    os.rename(tmp_fname, parsed_fname)
+    return counts, st.st_size, os.path.getsize(parsed_fname)
+
+def main():
+    usage = "%prog [options] <gcode file> [<gcode file> ...]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-o", "--output", dest="output",
+                    help="filename of the pre-parsed file (default is the"
+                    " gcode filename with a '%s' suffix)" % (vsd.PARSED_EXT,))
+    options, args = opts.parse_args()
+    if len(args) < 1:
+        opts.error("Incorrect number of arguments")
+    if options.output is not None and len(args) != 1:
+        opts.error("Only one gcode file may be given with --output")
+    for source_fname in args:
+        parsed_fname = options.output
+        if parsed_fname is None:
+            parsed_fname = source_fname + vsd.PARSED_EXT
+        counts, source_size, parsed_size = convert(source_fname, parsed_fname)
+        print("%s: %d lines (%d moves), %d bytes -> %s (%d bytes)"
+              % (source_fname, counts['lines'], counts['moves'],
+                 source_size, parsed_fname, parsed_size))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# Check if the mcus and serial links can keep up with a g-code file
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, logging, json, tempfile, shutil
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import msgproto
+import benchmark_pipeline
+
+# Bits per byte on a uart link (start bit, 8 data bits, stop bit)
+UART_BITS = 10
+
+
+######################################################################
+# Batch mode run
+######################################################################
+
+def run_batch(config_fname, gcode_fname, dictionaries, outdir):
+    # Note the output file, link baud rate, and steppers of each mcu
+    mcus = {}
+    debugoutput = os.path.join(outdir, benchmark_pipeline.BATCH_OUTPUT)
+    def setup(printer):
+        def handle_connect():
+            settings = printer.lookup_object('configfile').get_status(
+                None)['settings']
+            for section, mcu in printer.lookup_objects('mcu'):
+                mcu_name = mcu.get_name()
+                out_fname = debugoutput
+                dict_fname = dictionaries.get('dictionary')
+                if mcu_name != 'mcu':
+                    out_fname += "-" + mcu_name
+                    dict_fname = dictionaries.get('dictionary_' + mcu_name)
+                # Only uart connections have a baud setting
+                baud = settings.get(section, {}).get('baud', 0)
+                mcus[mcu_name] = {'output': out_fname,
+                                  'dictionary': dict_fname, 'baud': baud,
+                                  'steppers': {}}
+            stepper_enable = printer.lookup_object('stepper_enable')
+            for name in stepper_enable.get_steppers():
+                stepper = stepper_enable.lookup_enable(name).stepper
+                mcu_name = stepper.get_mcu().get_name()
+                mcus[mcu_name]['steppers'][stepper.get_oid()] = name
+        printer.register_event_handler("klippy:connect", handle_connect)
+    res = benchmark_pipeline.run_batch(config_fname, gcode_fname,
+                                       dictionaries, outdir, setup)
+    if res != 'exit' or not mcus:
+        raise Exception("Klippy run of %s failed (%s)" % (gcode_fname, res))
+    return mcus
+
+
+######################################################################
+# Output analysis
+######################################################################
+
+class WindowCounts:
+    def __init__(self, window):
+        self.window = window
+        self.counts = {}
+    def add(self, index, count):
+        self.counts[index] = self.counts.get(index, 0) + count
+    def get_rate(self, index):
+        return self.counts.get(index, 0) / self.window
+    def get_peak(self):
+        if not self.counts:
+            return 0., 0.
+        index, count = max(self.counts.items(), key=lambda i: i[1])
+        return count / self.window, index * self.window
+
+class StepperTracker:
+    def __init__(self, name, window_clocks, windows):
+        self.name = name
+        self.window_clocks = window_clocks
+        self.steps = windows
+        self.step_count = 0
+        self.clock = 0
+        self.after_reset = True
+        self.min_interval = None
+    def reset(self, clock):
+        self.clock = clock
+        self.after_reset = True
+    def queue_step(self, interval, count, add):
+        # Track the smallest step to step interval (the first interval
+        # after a reset_step_clock is not between two steps)
+        skip = 0
+        if self.after_reset:
+            self.after_reset = False
+            skip = 1
+        if count > skip:
+            min_interval = min(interval + add * skip,
+                               interval + add * (count - 1))
+            if self.min_interval is None or min_interval < self.min_interval:
+                self.min_interval = min_interval
+        # Add steps to the per window counts
+        first_clock = self.clock + interval
+        last_clock = (self.clock + interval * count
+                      + add * count * (count - 1) // 2)
+        wc = self.window_clocks
+        if first_clock // wc == last_clock // wc:
+            self.steps.add(first_clock // wc, count)
+        else:
+            clock = self.clock
+            for i in range(count):
+                clock += interval
+                interval += add
+                self.steps.add(clock // wc, 1)
+        self.clock = last_clock
+        self.step_count += count
+        return first_clock
+
+def analyze_mcu(info, window):
+    mp = msgproto.MessageParser()
+    with open(info['dictionary'], 'rb') as f:
+        mp.process_identify(f.read(), decompress=False)
+    clock_freq = mp.get_constant_float('CLOCK_FREQ')
+    window_clocks = int(window * clock_freq)
+    msgs, msg_bytes = WindowCounts(window), WindowCounts(window)
+    steps = WindowCounts(window)
+    steppers = {}
+    for oid, name in info['steppers'].items():
+        steppers[oid] = StepperTracker(name, window_clocks,
+                                       WindowCounts(window))
+    last_clock = [0]
+    def extend_clock(clock32):
+        # Convert a 32bit mcu clock to a 64bit clock
+        diff = (clock32 - last_clock[0]) & 0xffffffff
+        if diff & 0x80000000:
+            diff -= 0x100000000
+        return last_clock[0] + diff
+    with open(info['output'], 'rb') as f:
+        data = bytearray(f.read())
+    offset = 0
+    while offset < len(data):
+        block = data[offset:offset + msgproto.MESSAGE_MAX]
+        l = mp.check_packet(block)
+        if l == 0:
+            break
+        if l < 0:
+            offset -= l
+            continue
+        # Assign each message in the block its share of the framing
+        pos = msgproto.MESSAGE_HEADER_SIZE
+        parsed = []
+        while pos < l - msgproto.MESSAGE_TRAILER_SIZE:
+            mid = mp.messages_by_id.get(block[pos], mp.unknown)
+            params, next_pos = mid.parse(block, pos)
+            parsed.append((mid.name, params, next_pos - pos))
+            pos = next_pos
+        overhead = float(msgproto.MESSAGE_MIN) / max(1, len(parsed))
+        for name, params, size in parsed:
+            clock = last_clock[0]
+            st = steppers.get(params.get('oid'))
+            if st is not None and name == 'reset_step_clock':
+                clock = extend_clock(params['clock'])
+                st.reset(clock)
+            elif st is not None and name == 'queue_step':
+                clock = st.queue_step(params['interval'], params['count'],
+                                      params['add'])
+            elif 'clock' in params:
+                clock = extend_clock(params['clock'])
+            if not clock:
+                # Skip the startup configuration commands
+                continue
+            last_clock[0] = max(last_clock[0], clock)
+            index = clock // window_clocks
+            msgs.add(index, 1)
+            msg_bytes.add(index, size + overhead)
+        offset += l
+    for st in steppers.values():
+        for index, count in st.steps.counts.items():
+            steps.add(index, count)
+    return {'clock_freq': clock_freq, 'msgs': msgs, 'bytes': msg_bytes,
+            'steps': steps, 'steppers': steppers}
+
+
+######################################################################
+# Report
+######################################################################
+
+def find_overloads(res, link_rate, max_step_rate):
+    # Return the time ranges where a limit is exceeded
+    window = res['msgs'].window
+    indexes = set(res['bytes'].counts) | set(res['steps'].counts)
+    ranges = []
+    for index in sorted(indexes):
+        byte_rate = res['bytes'].get_rate(index)
+        step_rate = res['steps'].get_rate(index)
+        limits = set()
+        if link_rate and byte_rate > link_rate:
+            limits.add('link')
+        if max_step_rate and step_rate > max_step_rate:
+            limits.add('steps')
+        if not limits:
+            continue
+        if ranges and ranges[-1]['end_index'] == index - 1:
+            r = ranges[-1]
+            r['end_index'] = index
+            r['bytes_per_sec'] = max(r['bytes_per_sec'], byte_rate)
+            r['steps_per_sec'] = max(r['steps_per_sec'], step_rate)
+            r['limits'] |= limits
+            continue
+        ranges.append({'start_index': index, 'end_index': index,
+                       'bytes_per_sec': byte_rate, 'steps_per_sec': step_rate,
+                       'limits': limits})
+    return [{'start_time': r['start_index'] * window,
+             'end_time': (r['end_index'] + 1) * window,
+             'bytes_per_sec': r['bytes_per_sec'],
+             'steps_per_sec': r['steps_per_sec'],
+             'limits': sorted(r['limits'])} for r in ranges]
+
+def report_mcu(mcu_name, res, link_rate, max_step_rate):
+    clock_freq = res['clock_freq']
+    msg_rate, msg_time = res['msgs'].get_peak()
+    byte_rate, byte_time = res['bytes'].get_peak()
+    step_rate, step_time = res['steps'].get_peak()
+    out = {'peak_msgs_per_sec': msg_rate, 'peak_bytes_per_sec': byte_rate,
+           'peak_steps_per_sec': step_rate, 'link_rate': link_rate,
+           'max_step_rate': max_step_rate, 'steppers': {}}
+    lines = ["mcu '%s':" % (mcu_name,),
+             "  peak messages/sec: %.0f (at %.3fs)" % (msg_rate, msg_time),
+             "  peak bytes/sec: %.0f (at %.3fs)" % (byte_rate, byte_time),
+             "  peak steps/sec: %.0f (at %.3fs)" % (step_rate, step_time)]
+    if link_rate:
+        lines[2] += " - %.0f%% of link capacity" % (
+            100. * byte_rate / link_rate,)
+    if max_step_rate:
+        lines[3] += " - %.0f%% of max step rate" % (
+            100. * step_rate / max_step_rate,)
+    for oid, st in sorted(res['steppers'].items()):
+        rate, rate_time = st.steps.get_peak()
+        min_interval = None
+        if st.min_interval is not None:
+            min_interval = float(st.min_interval) / clock_freq
+        out['steppers'][st.name] = {'oid': oid, 'steps': st.step_count,
+                                    'peak_steps_per_sec': rate,
+                                    'min_interval': min_interval}
+        msg = "  %s: steps=%d peak steps/sec=%.0f" % (
+            st.name, st.step_count, rate)
+        if min_interval is not None:
+            msg += " min interval=%.1fus" % (min_interval * 1000000.,)
+        lines.append(msg)
+    overloads = find_overloads(res, link_rate, max_step_rate)
+    out['overloads'] = overloads
+    for o in overloads:
+        lines.append("  OVERLOAD (%s) %.3fs-%.3fs:"
+                     " bytes/sec=%.0f steps/sec=%.0f"
+                     % (",".join(o['limits']), o['start_time'], o['end_time'],
+                        o['bytes_per_sec'], o['steps_per_sec']))
+    logging.info("\n".join(lines))
+    return out
+
+def arg_mcu_value(option, opt_str, value, parser, prefix, conv):
+    key, val = prefix, value
+    if '=' in value:
+        mcu_name, val = value.split('=', 1)
+        key = prefix + "_" + mcu_name
+    if conv is None:
+        val = os.path.abspath(val)
+    else:
+        try:
+            val = conv(val)
+        except ValueError:
+            raise optparse.OptionValueError(
+                "option %s: invalid value: %r" % (opt_str, value))
+    getattr(parser.values, option.dest)[key] = val
+
+def get_mcu_value(values, prefix, mcu_name):
+    return values.get(prefix + "_" + mcu_name, values.get(prefix))
+
+def main():
+    usage = "%prog [options] -d <dictionary> <config> <gcode>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-d", "--dictionary", dest="dictionary", type="string",
+                    action="callback", callback=arg_mcu_value,
+                    callback_args=("dictionary", None), default={},
+                    help="file to read for mcu protocol dictionary")
+    opts.add_option("-s", "--max-step-rate", dest="max_step_rate",
+                    type="string", action="callback", callback=arg_mcu_value,
+                    callback_args=("rate", float), default={},
+                    help="maximum total steps/sec of an mcu")
+    opts.add_option("-l", "--link-rate", dest="link_rate", type="string",
+                    action="callback", callback=arg_mcu_value,
+                    callback_args=("rate", float), default={},
+                    help="bytes/sec of an mcu link (default is baud/10)")
+    opts.add_option("-w", "--window", dest="window", type="float",
+                    default=.100, help="rate averaging window in seconds")
+    opts.add_option("-o", "--output", dest="output",
+                    help="write results to a json file")
+    options, args = opts.parse_args()
+    if len(args) != 2:
+        opts.error("Incorrect number of arguments")
+    if not options.dictionary:
+        opts.error("A mcu dictionary must be specified")
+    if options.window <= 0.:
+        opts.error("Window must be positive")
+    config_fname, gcode_fname = args
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    outdir = tempfile.mkdtemp(prefix="stepplan-")
+    try:
+        mcus = run_batch(os.path.abspath(config_fname),
+                         os.path.abspath(gcode_fname), options.dictionary,
+                         outdir)
+        results = {}
+        for mcu_name, info in sorted(mcus.items()):
+            results[mcu_name] = analyze_mcu(info, options.window)
+    finally:
+        shutil.rmtree(outdir)
+    logging.getLogger().setLevel(logging.INFO)
+    data = {}
+    for mcu_name, res in sorted(results.items()):
+        link_rate = get_mcu_value(options.link_rate, "rate", mcu_name)
+        if link_rate is None and mcus[mcu_name]['baud']:
+            link_rate = float(mcus[mcu_name]['baud']) / UART_BITS
+        max_step_rate = get_mcu_value(options.max_step_rate, "rate", mcu_name)
+        data[mcu_name] = report_mcu(mcu_name, res, link_rate, max_step_rate)
+    if options.output is not None:
+        with open(options.output, 'w') as f:
+            json.dump({'window': options.window, 'mcus': data}, f,
+                      indent=2, sort_keys=True)
+            f.write("\n")
+    if any([d['overloads'] for d in data.values()]):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -37,6 +37,7 @@ class TestCase:
         config_fname = gcode_fname = dict_fnames = None
         should_fail = multi_tests = False
         gcode = []
+        self.preparse = []
         f = open(self.fname, 'r')
         for line in f:
             cpos = line.find('#')
@@ -66,6 +67,13 @@ class TestCase:
                 gcode_fname = self.relpath(parts[1])
             elif parts[0] == "SHOULD_FAIL":
                 should_fail = True
+            elif parts[0] == "PREPARSE":
+                source_fname = self.relpath(parts[1])
+                if len(parts) > 2:
+                    parsed_fname = self.relpath(parts[2])
+                else:
+                    parsed_fname = source_fname + ".parsed"
+                self.preparse.append((source_fname, parsed_fname))
             else:
                 gcode.append(line.strip())
         f.close()
@@ -96,7 +104,14 @@ class TestCase:
             args += ['-d', df]
         if not self.verbose:
             args += ['-l', TEMP_LOG_FILE]
-        res = subprocess.call(args)
+        try:
+            for source_fname, parsed_fname in self.preparse:
+                self.run_preparse(source_fname, parsed_fname)
+            res = subprocess.call(args)
+        finally:
+            for source_fname, parsed_fname in self.preparse:
+                if os.path.exists(parsed_fname):
+                    os.unlink(parsed_fname)
         is_fail = (should_fail and not res) or (not should_fail and res)
         if is_fail:
             if not self.verbose:
@@ -116,6 +131,12 @@ class TestCase:
             sys.stderr.write('\n')
         if gcode_is_temp:
             os.unlink(gcode_fname)
+    def run_preparse(self, source_fname, parsed_fname):
+        # Generate a pre-parsed g-code file for virtual_sdcard
+        args = [ sys.executable, './scripts/preparse_gcode.py',
+                 '-o', parsed_fname, source_fname ]
+        if subprocess.call(args, stdout=subprocess.PIPE):
+            raise error("Unable to pre-parse %s" % (source_fname,))
     def run(self):
         try:
             self.parse_test()
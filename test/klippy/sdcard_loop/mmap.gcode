@@ -0,0 +1,6 @@
+; Test of the mmap reader - the last line has no newline and is not run
+G1 X5 F6000
+
+G1 X10 ; comment
+CHECK_POSITION X=10
+G1 X9999
\ No newline at end of file
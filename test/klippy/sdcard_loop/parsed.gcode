@@ -0,0 +1,15 @@
+; Test of pre-parsed files - the last line has no newline and is not run
+G1 X5 F6000
+G0 Y5
+
+G1 X10 ; comment
+CHECK_POSITION X=10
+g1 x12
+CHECK_POSITION X=12
+G91
+G1 X1 E0.01
+G90
+CHECK_POSITION X=13
+M117 Température 20°
+CHECK_RAW A=1 B="two words"
+G1 X9999
\ No newline at end of file
@@ -0,0 +1,20 @@
+; Test of SD file seeking (see sdcard_seek.test)
+SEEK_NOT_RUN
+;LAYER:0
+SET_PRINT_STATS_INFO TOTAL_LAYER=3 CURRENT_LAYER=0
+G1 Z0.2 F6000
+G1 X10 E0.01
+SEEK_NOT_RUN
+;LAYER:1
+SET_PRINT_STATS_INFO TOTAL_LAYER=3 CURRENT_LAYER=1
+CHECK_LAYER LAYER=1
+G1 Z0.4
+G1 X20 E0.01
+G1 Z1.4
+G1 Z0.4
+;LAYER:2
+SET_PRINT_STATS_INFO TOTAL_LAYER=3 CURRENT_LAYER=2
+CHECK_LAYER LAYER=2
+G1 Z0.6
+G1 X30 E0.01
+CHECK_POSITION X=30
@@ -0,0 +1,3 @@
+; Test of an out of date pre-parsed file (see sdcard_parsed.test)
+G1 X20 F6000
+CHECK_POSITION X=20
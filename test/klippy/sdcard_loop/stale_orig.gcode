@@ -0,0 +1,3 @@
+; Original version of stale.gcode (converted by sdcard_parsed.test)
+G1 X30.0 F6000
+CHECK_POSITION X=20